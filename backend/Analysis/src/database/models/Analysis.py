@@ -1,24 +1,51 @@
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field
 from typing import Optional
 from datetime import datetime
 
 class Analysis(SQLModel, table=True):
     __tablename__ = "analysis"
+    __table_args__ = (
+        # serves "latest analysis of a project (and device)" without a sort
+        Index("ix_analysis_project_device_created", "project_id", "device", text("created_at DESC")),
+        # history without a device filter, in its (created_at, id) cursor order
+        Index("ix_analysis_project_created", "project_id", text("created_at DESC"), text("id DESC")),
+    )
 
 
     id: Optional[int] = Field(default=None, primary_key=True)
 
     analysis_id: str = Field(index=True)
-    project_id: str = Field(index=True)
+    project_id: int
+    device: Optional[str] = Field(default=None)
 
     status: str = Field(default="processing")
+    # replica that runs a queued job (see Services.JOB_OWNER)
+    owner: Optional[str] = Field(default=None)
+    cache_key: Optional[str] = Field(default=None, index=True)
+    error: Optional[str] = Field(default=None)
 
     results_json: Optional[str] = Field(default=None)
+    # blob with every issue when results_json keeps only the first ones
+    issues_hash: Optional[str] = Field(default=None)
+    # inline JSON of rows written before the blob store; new rows use raw_data_hash
     raw_data: Optional[str] = Field(default=None)
+    raw_data_hash: Optional[str] = Field(default=None, index=True)
 
     summary: Optional[str] = Field(default=None)
     opinion: Optional[str] = Field(default=None)
     recomendation: Optional[str] = Field(default=None)
+    # GET /analysis/{project_id} body, serialised once when the row is written
+    response_json: Optional[str] = Field(default=None)
+
+    # headline metrics as plain columns, for history listings and time series
+    min_contrast: Optional[float] = Field(default=None)
+    min_font_size: Optional[float] = Field(default=None)
+    min_button_height: Optional[float] = Field(default=None)
+    min_button_spacing: Optional[float] = Field(default=None)
+    min_touch_target: Optional[float] = Field(default=None)
+    avg_depth: Optional[float] = Field(default=None)
+    issue_count: Optional[int] = Field(default=None)
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
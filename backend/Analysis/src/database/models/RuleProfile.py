@@ -0,0 +1,17 @@
+from sqlmodel import SQLModel, Field
+from typing import Optional
+from datetime import datetime
+
+class RuleProfile(SQLModel, table=True):
+    __tablename__ = "rule_profile"
+
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    project_id: int = Field(index=True, unique=True)
+    # the defaults with the overrides applied, see services.RuleSet
+    thresholds_json: str
+    version: str
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
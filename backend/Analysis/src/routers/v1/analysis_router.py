@@ -1,10 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, Header, Request
+import os
+from typing import List, Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi_utils.cbv import cbv
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from src.schemas.AnalysisRequestSchema import AnalysisRequestSchema
-from src.schemas.AnalysisResponseSchema import AnalysisResponseSchema
+from src.schemas.AnalysisResponseSchema import AnalysisMultiDeviceResponseSchema, AnalysisResponseSchema
+from src.schemas.AnalysisBatchSchema import AnalysisBatchRequestSchema, AnalysisBatchResponseSchema
 from src.schemas.AnalysisChecklistSchema import AnalysisChecklistSchema
+from src.schemas.AnalysisHistorySchema import AnalysisHistorySchema
+from src.schemas.AnalysisJobSchema import AnalysisJobSchema
+from src.schemas.RuleProfileSchema import RuleProfileRequestSchema, RuleProfileSchema
+from src.services.JobRunner import job_runner
+from src.services.RawBody import read_body, spool_body
 from src.services.Services import Services
 from src.database.db_connection import get_db
 from src.security.auth_utils import get_user_data
@@ -12,50 +23,204 @@ from src.security.auth_utils import get_user_data
 analysis_router = APIRouter(prefix="/analysis", tags=["Analysis"])
 
 
+def _authenticate(request: Request, authorization: str | None):
+    """Return the caller's token after checking it identifies a user."""
+    token = request.cookies.get("token")
+    if not token and authorization and authorization.startswith("Bearer "):
+        token = authorization.split(" ", 1)[1]
+
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    user_data = get_user_data(token)
+    user_id = user_data.get("user_id") or user_data.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Could not decode user")
+
+    return token
+
+
 @cbv(analysis_router)
 class Analysis:
 
     db: Session = Depends(get_db)
 
-    @analysis_router.post("/{project_id}", response_model=AnalysisResponseSchema)
+    # declared before "/{project_id}" so "batch" is not taken for a project id
+    @analysis_router.post("/batch", response_model=AnalysisBatchResponseSchema)
+    def run_batch(
+        self,
+        request: Request,
+        payload: AnalysisBatchRequestSchema,
+        authorization: str | None = Header(None),
+    ):
+        service = Services(self.db)
+        token = _authenticate(request, authorization)
+        return service.run_batch(
+            [item.model_dump() for item in payload.items],
+            token=token,
+            use_cache=payload.use_cache,
+        )
+
+    @analysis_router.post(
+        "/{project_id}",
+        response_model=AnalysisResponseSchema | AnalysisMultiDeviceResponseSchema | AnalysisJobSchema,
+    )
     def run_analysis(
         self,
         request: Request,
+        response: Response,
         project_id: int,
         payload: AnalysisRequestSchema,
+        run_async: bool = Query(False, alias="async"),
         authorization: str | None = Header(None),
     ):
         service = Services(self.db)
+        token = _authenticate(request, authorization)
 
-        token = request.cookies.get("token")
-        if not token and authorization and authorization.startswith("Bearer "):
-            token = authorization.split(" ", 1)[1]
-
-        if not token:
-            raise HTTPException(status_code=401, detail="Not authenticated")
-
-        user_data = get_user_data(token)
-        user_id = user_data.get("user_id") or user_data.get("id")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Could not decode user")
-
-        return service.run_analysis(
-            project_id,
-            payload.device,
+        options = dict(
             figma_data=payload.figma_data,
             token=token,
             figma_url=payload.figma_url,
+            stream=payload.stream,
+            use_cache=payload.use_cache,
+            node_ids=payload.node_ids,
+            node_depth=payload.node_depth,
         )
 
+        if run_async:
+            if not isinstance(payload.device, str) or payload.device == "all":
+                raise HTTPException(400, "Asynchronous jobs analyse a single device")
+            job_id = service.create_job(project_id, payload.device)
+            job_runner.submit(job_id, project_id, payload.device, **options)
+            response.status_code = 202
+            return {"job_id": job_id, "project_id": project_id, "status": "processing"}
+
+        return service.run_analysis(project_id, payload.device, diagnostics=payload.diagnostics, **options)
+
+    # declared before "/{project_id}" so "metrics" and "checklist" are not taken for a project id
+    @analysis_router.get("/metrics")
+    def get_service_metrics(self):
+        service = Services(self.db)
+        return service.get_service_metrics()
+
+    @analysis_router.get("/checklist", response_model=AnalysisChecklistSchema)
+    def get_checklist(self, project_id: int | None = None):
+        service = Services(self.db)
+        return service.get_checklist(project_id)
+
+    @analysis_router.get("/jobs/{job_id}", response_model=AnalysisJobSchema)
+    def get_job(self, job_id: str):
+        service = Services(self.db)
+        job = service.get_job(job_id)
+        if not job:
+            raise HTTPException(404, "Analysis job not found")
+        return job
+
     @analysis_router.get("/{project_id}", response_model=AnalysisResponseSchema)
-    def get_analysis(self, project_id: int):
+    def get_analysis(self, project_id: int, device: Literal["desktop", "mobile"] | None = None):
         service = Services(self.db)
-        result = service.get_analysis(project_id)
-        if not result:
+        body = service.get_analysis(project_id, device)
+        if not body:
             raise HTTPException(404, "No analysis found for this project")
-        return result
+        # stored already serialised; skip response_model validation and encoding
+        return Response(content=body, media_type="application/json")
 
-    @analysis_router.get("/checklist", response_model=AnalysisChecklistSchema)
-    def get_checklist(self):
+    @analysis_router.get("/{project_id}/history", response_model=AnalysisHistorySchema)
+    def get_history(
+        self,
+        project_id: int,
+        device: Literal["desktop", "mobile"] | None = None,
+        limit: int = Query(20, ge=1, le=100),
+        cursor: str | None = None,
+        include_results: bool = False,
+        series: List[str] = Query(default=[], description="Metric columns to aggregate per day, e.g. min_contrast"),
+    ):
+        service = Services(self.db)
+        return service.get_history(
+            project_id,
+            device=device,
+            limit=limit,
+            cursor=cursor,
+            include_results=include_results,
+            series=series,
+        )
+
+    @analysis_router.get("/{project_id}/issues", response_class=StreamingResponse)
+    def stream_issues(
+        self,
+        project_id: int,
+        device: Literal["desktop", "mobile"] | None = None,
+        code: str | None = None,
+    ):
+        service = Services(self.db)
+        lines = service.get_issue_stream(project_id, device, code)
+        if lines is None:
+            raise HTTPException(404, "No analysis found for this project")
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    @analysis_router.get("/{project_id}/raw")
+    def get_raw_data(self, project_id: int):
+        service = Services(self.db)
+        raw = service.get_raw_data(project_id)
+        if not raw:
+            raise HTTPException(404, "No raw data stored for this project")
+        if "blob_path" in raw:
+            # the blob is already gzipped JSON, so it is sent as-is
+            return FileResponse(raw["blob_path"], media_type="application/json", headers={"Content-Encoding": "gzip"})
+        return Response(content=raw["raw_data"], media_type="application/json")
+
+    @analysis_router.post(
+        "/{project_id}/raw",
+        response_model=AnalysisResponseSchema | AnalysisMultiDeviceResponseSchema,
+    )
+    async def run_raw_analysis(
+        self,
+        request: Request,
+        project_id: int,
+        device: str = Query(..., description='"desktop", "mobile", "all" or a comma-separated list'),
+        stream: bool = Query(False, description="Parse the body incrementally from a spool file"),
+        use_cache: bool = True,
+        diagnostics: bool = False,
+        authorization: str | None = Header(None),
+    ):
+        """Analyse the Figma JSON sent as the request body, without decoding it into a request schema."""
+        service = Services(self.db)
+        token = await run_in_threadpool(_authenticate, request, authorization)
+        devices = device.split(",") if "," in device else device
+        options = dict(token=token, use_cache=use_cache, diagnostics=diagnostics)
+
+        if not stream:
+            body = await read_body(request)
+            return await run_in_threadpool(service.run_analysis, project_id, devices, raw_body=body, **options)
+
+        path = await spool_body(request)
+        try:
+            with open(path, "rb") as body:
+                return await run_in_threadpool(service.run_analysis, project_id, devices, raw_body=body, **options)
+        finally:
+            os.remove(path)
+
+    @analysis_router.get("/{project_id}/rules", response_model=RuleProfileSchema)
+    def get_rule_profile(self, project_id: int):
+        service = Services(self.db)
+        return service.get_rule_profile(project_id)
+
+    @analysis_router.put("/{project_id}/rules", response_model=RuleProfileSchema)
+    def set_rule_profile(
+        self,
+        request: Request,
+        project_id: int,
+        payload: RuleProfileRequestSchema,
+        authorization: str | None = Header(None),
+    ):
+        service = Services(self.db)
+        _authenticate(request, authorization)
+        return service.set_rule_profile(project_id, payload.thresholds)
+
+    @analysis_router.delete("/{project_id}/rules", status_code=204)
+    def delete_rule_profile(self, request: Request, project_id: int, authorization: str | None = Header(None)):
         service = Services(self.db)
-        return service.get_checklist()
\ No newline at end of file
+        _authenticate(request, authorization)
+        if not service.delete_rule_profile(project_id):
+            raise HTTPException(404, "No rule profile for this project")
+        return Response(status_code=204)
\ No newline at end of file
@@ -0,0 +1,30 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+from src.schemas.AnalysisResponseSchema import AnalysisResponseSchema
+
+
+class AnalysisBatchItemSchema(BaseModel):
+    project_id: int
+    device: Literal["desktop", "mobile"]
+    figma_url: Optional[str] = Field(
+        default=None,
+        description="Overrides the project's Figma link from the Projects service"
+    )
+
+
+class AnalysisBatchRequestSchema(BaseModel):
+    items: List[AnalysisBatchItemSchema]
+    use_cache: bool = True
+
+
+class AnalysisBatchResultSchema(BaseModel):
+    project_id: int
+    device: str
+    status: str
+    result: Optional[AnalysisResponseSchema] = None
+    error: Optional[str] = None
+
+
+class AnalysisBatchResponseSchema(BaseModel):
+    results: List[AnalysisBatchResultSchema]
@@ -1,6 +1,7 @@
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 
 class AnalysisChecklistSchema(BaseModel):
+    version: Optional[str] = None
     categories: List[Dict[str, Any]]
@@ -0,0 +1,36 @@
+from datetime import datetime
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+
+class AnalysisHistoryItemSchema(BaseModel):
+    analysis_id: str
+    device: Optional[str] = None
+    summary: Optional[str] = None
+    opinion: Optional[str] = None
+    created_at: datetime
+
+    min_contrast: Optional[float] = None
+    min_font_size: Optional[float] = None
+    min_button_height: Optional[float] = None
+    min_button_spacing: Optional[float] = None
+    min_touch_target: Optional[float] = None
+    avg_depth: Optional[float] = None
+    issue_count: Optional[int] = None
+
+    # only with include_results=true
+    metrics: Optional[Dict[str, Any]] = None
+    issues: Optional[List[Dict[str, Any]]] = None
+
+
+class MetricSeriesPointSchema(BaseModel):
+    date: str
+    value: Optional[float] = None
+    analyses: int
+
+
+class AnalysisHistorySchema(BaseModel):
+    project_id: int
+    items: List[AnalysisHistoryItemSchema]
+    next_cursor: Optional[str] = None
+    series: Dict[str, List[MetricSeriesPointSchema]] = {}
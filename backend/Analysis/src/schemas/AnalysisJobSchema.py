@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from typing import Optional
+
+from src.schemas.AnalysisResponseSchema import AnalysisResponseSchema
+
+
+class AnalysisJobSchema(BaseModel):
+    job_id: str
+    project_id: int
+    status: str
+    error: Optional[str] = None
+    result: Optional[AnalysisResponseSchema] = None
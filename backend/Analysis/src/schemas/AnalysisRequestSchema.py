@@ -1,14 +1,38 @@
 from pydantic import BaseModel, Field
-from typing import Literal, Dict, Any, Optional
+from typing import Literal, Dict, Any, List, Optional, Union
 
 
 class AnalysisRequestSchema(BaseModel):
-    device: Literal["desktop", "mobile"] = Field(..., description="Device type used for analysis")
+    device: Union[Literal["desktop", "mobile", "all"], List[Literal["desktop", "mobile"]]] = Field(
+        ...,
+        description="Device type used for analysis, a list of them or \"all\" (one extraction, one result per device)"
+    )
     figma_url: Optional[str] = Field(
         default=None,
         description="Link to Figma file, e.g. https://www.figma.com/file/ABC123"
     )
+    node_ids: Optional[List[str]] = Field(
+        default=None,
+        description="Import and analyse only these Figma nodes, e.g. [\"12:34\"]; defaults to the node-id of figma_url"
+    )
+    node_depth: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Levels imported below each of node_ids (the whole subtree when omitted)"
+    )
     figma_data: Optional[Dict[str, Any]] = Field(
         default=None,
         description="Optional raw Figma JSON payload (skips import from Figma service)"
     )
+    stream: bool = Field(
+        default=False,
+        description="Parse the Figma import incrementally and spool it to disk instead of loading it in memory"
+    )
+    use_cache: bool = Field(
+        default=True,
+        description="Reuse a stored result for the same file version, device and ruleset"
+    )
+    diagnostics: bool = Field(
+        default=False,
+        description="Include per-stage timings and counters in the response (synchronous analyses only)"
+    )
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, model_serializer
 from typing import Dict, Any, List, Optional
 
 
@@ -11,7 +11,22 @@ class MetricsSchema(BaseModel):
     layout_depth: Dict[str, Any]
 
 
-class AnalysisResponseSchema(BaseModel):
+class DiagnosticsSchema(BaseModel):
+    timings_ms: Dict[str, float]
+    counters: Dict[str, int]
+
+
+class _WithDiagnostics(BaseModel):
+    # diagnostics are only present when requested, so they are left out rather than sent as null
+    @model_serializer(mode="wrap")
+    def _omit_diagnostics(self, handler):
+        data = handler(self)
+        if data.get("diagnostics") is None:
+            data.pop("diagnostics", None)
+        return data
+
+
+class AnalysisResponseSchema(_WithDiagnostics):
     project_id: int
     device: str
 
@@ -20,4 +35,18 @@ class AnalysisResponseSchema(BaseModel):
     recommendations: List[str]
 
     metrics: MetricsSchema
+    # the first ANALYSIS_ISSUE_LIMIT issues; GET /analysis/{project_id}/issues streams all of them
     issues: List[Dict[str, Any]]
+    issue_count: Optional[int] = None
+    issue_groups: List[Dict[str, Any]] = []
+    # the nodes the analysis was limited to, None for the whole file
+    node_ids: Optional[List[str]] = None
+
+    cache_hit: bool = False
+    diagnostics: Optional[DiagnosticsSchema] = None
+
+
+class AnalysisMultiDeviceResponseSchema(_WithDiagnostics):
+    project_id: int
+    analyses: List[AnalysisResponseSchema]
+    diagnostics: Optional[DiagnosticsSchema] = None
@@ -0,0 +1,15 @@
+from pydantic import BaseModel, Field
+from typing import Dict, Any
+
+
+class RuleProfileRequestSchema(BaseModel):
+    thresholds: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Threshold overrides by rule section, e.g. {\"button_size\": {\"high\": 80}}"
+    )
+
+
+class RuleProfileSchema(BaseModel):
+    project_id: int
+    version: str
+    thresholds: Dict[str, Any]
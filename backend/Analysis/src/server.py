@@ -1,12 +1,96 @@
+import os
+
 from fastapi import FastAPI
 from fastapi.openapi.docs import get_swagger_ui_html
 from starlette.middleware.cors import CORSMiddleware
 
 from .global_settings import APP_NAME, APP_DESCRIPTION, APP_VERSION
 from .routers.api_router import api_router
-from .database.db_connection import engine
+from .services.FastJSON import FastJSONResponse, loads
+from .database.db_connection import AUTH_SESSION, engine
+from .database.models.Analysis import Analysis
+from .services.Services import METRIC_COLUMNS, Services, metric_fields
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel
 
+NEW_COLUMNS = {
+    "cache_key": "VARCHAR",
+    "error": "VARCHAR",
+    "raw_data_hash": "VARCHAR",
+    "device": "VARCHAR",
+    "response_json": "VARCHAR",
+    "issues_hash": "VARCHAR",
+    "owner": "VARCHAR",
+    **{name: "INTEGER" if name == "issue_count" else "FLOAT" for name in METRIC_COLUMNS},
+}
+# new columns filled in for existing rows from their results_json
+DERIVED_COLUMNS = ("device", *METRIC_COLUMNS)
+# rows parsed per backfill transaction; the results_json of a legacy row can take several MB
+BACKFILL_BATCH_SIZE = int(os.getenv("ANALYSIS_BACKFILL_BATCH_SIZE", "50"))
+
+
+def _ensure_new_columns():
+    inspector = inspect(engine)
+    if "analysis" not in inspector.get_table_names():
+        return
+    columns = {column["name"]: column for column in inspector.get_columns("analysis")}
+    indexes = {index["name"] for index in inspector.get_indexes("analysis")}
+
+    # Used for migration of previous database to add new columns
+    alter_statements = [
+        f"ALTER TABLE analysis ADD COLUMN {name} {column_type}"
+        for name, column_type in NEW_COLUMNS.items()
+        if name not in columns
+    ]
+    # project ids used to be strings; SQLite compares them fine through column affinity
+    if "CHAR" in str(columns["project_id"]["type"]).upper():
+        if engine.dialect.name == "postgresql":
+            alter_statements.append(
+                "ALTER TABLE analysis ALTER COLUMN project_id TYPE INTEGER USING project_id::integer"
+            )
+        elif engine.dialect.name == "mysql":
+            alter_statements.append("ALTER TABLE analysis MODIFY project_id INTEGER NOT NULL")
+
+    with engine.begin() as connection:
+        for statement in alter_statements:
+            connection.execute(text(statement))
+
+    _backfill_derived_columns()
+
+    with engine.begin() as connection:
+        for index in Analysis.__table__.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+
+
+def _backfill_derived_columns():
+    """Fill the ``DERIVED_COLUMNS`` of rows stored before they existed, one batch per transaction.
+
+    Those are the rows with results but no ``issue_count``, which every
+    analysis stored since has, so a backfill cut short by a restart goes on
+    where it stopped. Values already in a column are kept.
+    """
+    update = text(
+        f"UPDATE analysis SET {', '.join(f'{name} = COALESCE({name}, :{name})' for name in DERIVED_COLUMNS)}"
+        " WHERE id = :id"
+    )
+    select = text(
+        "SELECT id, results_json FROM analysis"
+        " WHERE id > :after AND results_json IS NOT NULL AND issue_count IS NULL"
+        " ORDER BY id LIMIT :size"
+    )
+    after = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select, {"after": after, "size": BACKFILL_BATCH_SIZE}).fetchall()
+            for row_id, results_json in rows:
+                parsed = loads(results_json)
+                connection.execute(update, {"device": parsed.get("device"), **metric_fields(parsed), "id": row_id})
+        if len(rows) < BACKFILL_BATCH_SIZE:
+            return
+        after = rows[-1][0]
+
+
 def create_app() -> FastAPI:
     app = FastAPI(
         title=APP_NAME,
@@ -14,9 +98,13 @@ def create_app() -> FastAPI:
         version=APP_VERSION,
         docs_url=None,
         redoc_url=None,
+        default_response_class=FastJSONResponse,
     )
 
+    _ensure_new_columns()
     SQLModel.metadata.create_all(engine)
+    with AUTH_SESSION() as db:
+        Services(db).fail_interrupted_jobs()
 
     app.add_middleware(
         CORSMiddleware,
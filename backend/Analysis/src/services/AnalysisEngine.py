@@ -0,0 +1,800 @@
+import os
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+import numpy as np
+
+from src.services.Colors import SRGB_TO_LINEAR, rgb_to_hex
+from src.services.Diagnostics import NO_DIAGNOSTICS, Diagnostics
+from src.services.NodeTable import PRIORITIES, NodeTable, NodeTableBuilder
+from src.services.RuleSet import DEFAULT_RULESET, RuleSet
+from src.services.SpatialIndex import GridIndex, close_pairs
+
+DEVICES = ("desktop", "mobile")
+
+LINEAR = np.array(SRGB_TO_LINEAR)
+
+# colour pairs listed in the contrast palette, lowest ratios first
+PALETTE_LIMIT = int(os.getenv("ANALYSIS_PALETTE_LIMIT", "50"))
+
+
+# ======================================================
+#                    NODE HELPERS
+# ======================================================
+def as_number(value):
+    """Plain Python number for JSON output; whole floats become ints."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+# stable issue codes: key of the threshold, key of the measured value and which value is worst
+ISSUE_CODES = {
+    "button_height": ("expected_min", "actual", min),
+    "button_spacing": ("expected_min", "actual", min),
+    "font_size": ("expected_min", "actual", min),
+    "contrast": ("required_ratio", "actual_ratio", min),
+    "touch_target": ("expected_min", "actual", min),
+    "touch_text": ("expected_min", "actual", min),
+    "touch_overlap": ("expected_min", "actual", min),
+    "touch_spacing": ("expected_min", "actual", min),
+    "layout_depth": ("recommended_max", "avg_depth", max),
+}
+
+
+def group_issues(issues: list, sample: int = 10):
+    """Issues aggregated by ``(code, threshold)``, in order of first occurrence.
+
+    Each group keeps the issue text, how many issues it stands for, the
+    worst measured value, the ids of its first ``sample`` nodes and the
+    text sample of its first issue, if any.
+    """
+    groups = {}
+    for issue in issues:
+        code = issue["code"]
+        threshold_key, actual_key, worst = ISSUE_CODES[code]
+        threshold = issue[threshold_key]
+        group = groups.get((code, threshold))
+        if group is None:
+            group = groups[code, threshold] = {
+                "code": code,
+                "issue": issue["issue"],
+                "threshold": threshold,
+                "worst": issue[actual_key],
+                "count": 0,
+                "nodes": [],
+            }
+            if "text_sample" in issue:
+                group["text_sample"] = issue["text_sample"]
+        else:
+            group["worst"] = worst(group["worst"], issue[actual_key])
+        group["count"] += 1
+        if "node" in issue and len(group["nodes"]) < sample:
+            group["nodes"].append(issue["node"])
+    return list(groups.values())
+
+
+# ======================================================
+#                  VECTORIZED RULES
+# ======================================================
+class Rule(ABC):
+    """One analysis rule, evaluated over a whole ``NodeTable`` at once.
+
+    Rules are declared in ``RULES`` with the devices they apply to and
+    their checklist category; a subclass instance binds the thresholds of
+    one device and ``RuleSet`` up front. ``partial`` reduces the rows of a
+    table to a small JSON-serialisable summary (timing any sub-stages
+    into ``diagnostics``); ``merge`` combines the summaries of any number
+    of disjoint tables (e.g. the top-level frames of one document, in
+    document order), fills the rule's entry in ``metrics`` and returns its
+    issues. A whole document is evaluated as the merge of a single partial.
+    """
+
+    name = None
+    # devices the rule applies to
+    devices = DEVICES
+
+    def __init__(self, device: str):
+        self.device = device
+
+    @classmethod
+    def checklist(cls, ruleset: RuleSet):
+        """Checklist categories describing the rule under ``ruleset``."""
+        return []
+
+    @abstractmethod
+    def partial(self, table: NodeTable, rows: np.ndarray = None, diagnostics=NO_DIAGNOSTICS):
+        """Summary of ``table``, restricted to the boolean mask ``rows`` when given."""
+
+    @abstractmethod
+    def merge(self, partials: list, metrics: dict):
+        """Fill the rule's entry in ``metrics`` from ``partials`` and return its issues."""
+
+
+def _owned(table: NodeTable, rows: np.ndarray):
+    return np.ones(len(table), dtype=bool) if rows is None else rows
+
+
+def _minimum(values):
+    values = [value for value in values if value is not None]
+    return min(values) if values else None
+
+
+def _frame_groups(frames: np.ndarray):
+    """Positions in ``frames`` grouped by frame, for passes that never cross a frame."""
+    order = np.argsort(frames, kind="stable")
+    starts = np.flatnonzero(np.r_[True, frames[order][1:] != frames[order][:-1]]) if len(order) else []
+    for start, stop in zip(starts, list(starts[1:]) + [len(order)]):
+        yield order[start:stop]
+
+
+class ButtonRule(Rule):
+    name = "button"
+
+    def __init__(self, device, ruleset=DEFAULT_RULESET):
+        super().__init__(device)
+        self.minimum = ruleset["button_size"]
+        self.spacing = ruleset["button_spacing"]
+        self.thresholds = np.array([self.minimum[p] for p in PRIORITIES])
+
+    @classmethod
+    def checklist(cls, ruleset):
+        return [
+            {
+                "name": "Button Size",
+                "rules": [
+                    {"description": f"{p.title()} priority button ≥ {ruleset['button_size'][p]}px",
+                     "desktop": ruleset["button_size"][p], "mobile": ruleset["button_size"][p]}
+                    for p in PRIORITIES
+                ],
+            },
+            {
+                "name": "Spacing",
+                "rules": [
+                    {"description": f"{p.title()} priority buttons spacing "
+                                    f"{ruleset['button_spacing'][p][0]}–{ruleset['button_spacing'][p][1]}px"}
+                    for p in PRIORITIES
+                ],
+            },
+        ]
+
+    def _frame_spacing(self, boxes: np.ndarray, priorities: np.ndarray):
+        """Nearest-neighbour gap per button, attributed to the stricter priority of each pair."""
+        index = GridIndex([tuple(box) for box in boxes.tolist()])
+        minima = {}
+        for i in range(len(boxes)):
+            gap, j = index.nearest(i)
+            if gap is None:
+                continue
+            pair_priority = PRIORITIES[min(priorities[i], priorities[j])]
+            if pair_priority not in minima or gap < minima[pair_priority]:
+                minima[pair_priority] = gap
+        return minima
+
+    def partial(self, table, rows=None, diagnostics=NO_DIAGNOSTICS):
+        owned = _owned(table, rows)[table.button_node]
+        heights = table.button_height[owned]
+        priorities = table.button_priority[owned]
+        boxes = table.button_box[owned]
+        button_node = table.button_node[owned]
+        thresholds = self.thresholds
+
+        priority_min = {}
+        for code, priority in enumerate(PRIORITIES):
+            mask = priorities == code
+            if mask.any():
+                priority_min[priority] = as_number(heights[mask].min())
+
+        issues = []
+        for b in np.flatnonzero(heights < thresholds[priorities]):
+            priority = PRIORITIES[priorities[b]]
+            issues.append(
+                {
+                    "code": "button_height",
+                    "issue": f"{priority.title()} priority button height too small",
+                    "expected_min": self.minimum[priority],
+                    "actual": as_number(heights[b]),
+                    "node": table.ids[button_node[b]],
+                }
+            )
+
+        # spacing is per frame; keep each frame's raw minima for the merge
+        frame_minima = []
+        frames = table.frame[button_node]
+        with diagnostics.stage("spacing"):
+            for members in _frame_groups(frames):
+                if len(members) < 2:
+                    continue
+                minima = self._frame_spacing(boxes[members], priorities[members])
+                if minima:
+                    frame = frames[members[0]]
+                    frame_minima.append([table.frame_ids[frame] if frame >= 0 else None, minima])
+
+        return {
+            "min": as_number(heights.min()) if len(heights) else None,
+            "priority_min": priority_min,
+            "frames": frame_minima,
+            "issues": issues,
+        }
+
+    def merge(self, partials, metrics):
+        issues = [issue for partial in partials for issue in partial["issues"]]
+
+        button_size = metrics["button_size"]
+        button_size["min_detected"] = _minimum(partial["min"] for partial in partials)
+        for priority in PRIORITIES:
+            lowest = _minimum(partial["priority_min"].get(priority) for partial in partials)
+            if lowest is not None:
+                button_size["priority_breakdown"][priority] = {
+                    "min_detected": lowest,
+                    "expected_min": self.minimum[priority],
+                }
+
+        button_spacing = metrics["button_spacing"]
+        priority_minima = {}
+        for partial in partials:
+            for frame_key, minima in partial["frames"]:
+                frame_priority = min(PRIORITIES, key=lambda p: minima.get(p, float("inf")))
+                button_spacing["frames"][frame_key] = {
+                    "min_spacing": as_number(round(minima[frame_priority], 5)),
+                    "priority": frame_priority,
+                }
+                for priority, gap in minima.items():
+                    if priority not in priority_minima or gap < priority_minima[priority]:
+                        priority_minima[priority] = gap
+
+        min_spacing = None
+        spacing_priority = None
+        if priority_minima:
+            # ties go to the stricter priority
+            spacing_priority = min(PRIORITIES, key=lambda p: priority_minima.get(p, float("inf")))
+            min_spacing = as_number(round(priority_minima[spacing_priority], 5))
+            button_spacing["recommended_min"] = self.spacing[spacing_priority][0]
+
+        button_spacing["min_spacing"] = min_spacing
+
+        for priority in PRIORITIES:
+            if priority not in priority_minima:
+                continue
+            gap = as_number(round(priority_minima[priority], 5))
+            button_spacing["priority_breakdown"][priority] = {
+                "min_detected": gap,
+                "recommended_range": self.spacing[priority],
+            }
+            if gap < self.spacing[priority][0]:
+                button_spacing["status"] = "warning"
+                issues.append(
+                    {
+                        "code": "button_spacing",
+                        "issue": f"Spacing below {priority} priority guidance",
+                        "expected_min": self.spacing[priority][0],
+                        "actual": gap,
+                    }
+                )
+
+        if button_size["min_detected"] and button_size["min_detected"] < self.minimum["low"]:
+            button_size["status"] = "error"
+        return issues
+
+
+class FontRule(Rule):
+    name = "font"
+
+    def __init__(self, device, ruleset=DEFAULT_RULESET):
+        super().__init__(device)
+        self.font_min = ruleset["font_size"][device]["min"]
+
+    @classmethod
+    def checklist(cls, ruleset):
+        rules = []
+        for device, label in (("desktop", "Desktop"), ("mobile", "Phone")):
+            font = ruleset["font_size"][device]
+            rules.append({
+                "description": f"{label} text ideal {font['ideal'][0]}–{font['ideal'][1]}px (min {font['min']}px)",
+                device: font["min"],
+            })
+        return [{"name": "Text Readability", "rules": rules}]
+
+    def partial(self, table, rows=None, diagnostics=NO_DIAGNOSTICS):
+        font_min = self.font_min
+        sizes = table.font_size
+        sized = ~np.isnan(sizes) & _owned(table, rows)
+
+        issues = []
+        for i in np.flatnonzero(sized & (sizes < font_min)):
+            issues.append(
+                {
+                    "code": "font_size",
+                    "issue": "Font too small",
+                    "expected_min": font_min,
+                    "actual": as_number(sizes[i]),
+                    "node": table.ids[i],
+                }
+            )
+        return {"min": as_number(sizes[sized].min()) if sized.any() else None, "issues": issues}
+
+    def merge(self, partials, metrics):
+        min_font = _minimum(partial["min"] for partial in partials)
+        if min_font is not None:
+            metrics["font_size"]["min_detected"] = min_font
+            if min_font < self.font_min:
+                metrics["font_size"]["status"] = "warning"
+        return [issue for partial in partials for issue in partial["issues"]]
+
+
+class ContrastRule(Rule):
+    """Contrast per unique (foreground, background, large text) combination.
+
+    Text rows are packed into integer colour-pair keys; each distinct key is
+    evaluated once against the linearised sRGB table and the verdict is
+    fanned back out to the rows that use it. Partials carry the distinct
+    keys with their node counts, so the palette is rebuilt on merge; it
+    lists the ``PALETTE_LIMIT`` pairs with the lowest ratios and counts all.
+    """
+
+    name = "contrast"
+
+    def __init__(self, device, ruleset=DEFAULT_RULESET):
+        super().__init__(device)
+        self.normal = ruleset["contrast"]["normal"]
+        self.large = ruleset["contrast"]["large"]
+
+    @classmethod
+    def checklist(cls, ruleset):
+        return [{
+            "name": "Color Contrast",
+            "rules": [
+                {"description": f"Normal text ratio ≥ {ruleset['contrast']['normal']:g}:1"},
+                {"description": f"Large text/UI icons ratio ≥ {ruleset['contrast']['large']:g}:1"},
+            ],
+        }]
+
+    def partial(self, table, rows=None, diagnostics=NO_DIAGNOSTICS):
+        fill = table.fill.astype(np.int64)
+        backdrop = table.backdrop.astype(np.int64)
+        fg_key = (fill[:, 0] << 16) | (fill[:, 1] << 8) | fill[:, 2]
+        bg_key = (backdrop[:, 0] << 16) | (backdrop[:, 1] << 8) | backdrop[:, 2]
+
+        rows = np.flatnonzero(table.has_fill & (fg_key != bg_key) & _owned(table, rows))
+        if not len(rows):
+            return {"keys": [], "counts": [], "issues": []}
+
+        sizes = np.nan_to_num(table.font_size[rows])
+        weights = table.font_weight[rows]
+        large = (sizes >= 18) | ((sizes >= 14) & (weights >= 700))
+
+        keys = (fg_key[rows] << 25) | (bg_key[rows] << 1) | large
+        unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        ratios, required = self.verdicts(unique)
+
+        failing = (ratios < required)[inverse]
+        node_ratios = ratios[inverse]
+        node_required = required[inverse]
+        issues = []
+        for k in np.flatnonzero(failing):
+            row = rows[k]
+            issues.append(
+                {
+                    "code": "contrast",
+                    "issue": "Insufficient contrast",
+                    "actual_ratio": round(float(node_ratios[k]), 2),
+                    "required_ratio": float(node_required[k]),
+                    "text_sample": table.text_samples.get(row, ""),
+                    "node": table.ids[row],
+                }
+            )
+        return {"keys": unique.tolist(), "counts": counts.tolist(), "issues": issues}
+
+    def merge(self, partials, metrics):
+        issues = [issue for partial in partials for issue in partial["issues"]]
+        keys = np.array([key for partial in partials for key in partial["keys"]], dtype=np.int64)
+        if not len(keys):
+            return issues
+
+        counts = np.array([count for partial in partials for count in partial["counts"]], dtype=np.int64)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=counts, minlength=len(unique))
+        ratios, required = self.verdicts(unique)
+
+        u_fg = unique >> 25
+        u_bg = (unique >> 1) & 0xFFFFFF
+        palette = []
+        for u in np.argsort(ratios, kind="stable")[:PALETTE_LIMIT]:
+            fg = int(u_fg[u])
+            bg = int(u_bg[u])
+            palette.append(
+                {
+                    "foreground": rgb_to_hex((fg >> 16, (fg >> 8) & 0xFF, fg & 0xFF)),
+                    "background": rgb_to_hex((bg >> 16, (bg >> 8) & 0xFF, bg & 0xFF)),
+                    "large_text": bool(unique[u] & 1),
+                    "ratio": round(float(ratios[u]), 2),
+                    "required_ratio": float(required[u]),
+                    "nodes": int(counts[u]),
+                    "status": "ok" if ratios[u] >= required[u] else "fail",
+                }
+            )
+        contrast = metrics["contrast_ratio"]
+        contrast["palette"] = palette
+        contrast["palette_count"] = len(unique)
+
+        lowest = float(ratios.min())
+        contrast["min_ratio"] = round(lowest, 2)
+        if lowest < self.large:
+            contrast["status"] = "error"
+        elif lowest < self.normal:
+            contrast["status"] = "warning"
+        else:
+            contrast["status"] = "ok"
+        return issues
+
+    def verdicts(self, keys: np.ndarray):
+        """Contrast ratio and required minimum of packed colour-pair keys."""
+        ratios = self.contrast_ratios(keys >> 25, (keys >> 1) & 0xFFFFFF)
+        required = np.where((keys & 1).astype(bool), self.large, self.normal)
+        return ratios, required
+
+    @staticmethod
+    def contrast_ratios(fg: np.ndarray, bg: np.ndarray):
+        def luminance(rgb):
+            return (
+                0.2126 * LINEAR[rgb >> 16]
+                + 0.7152 * LINEAR[(rgb >> 8) & 0xFF]
+                + 0.0722 * LINEAR[rgb & 0xFF]
+            )
+
+        l1 = luminance(fg)
+        l2 = luminance(bg)
+        return (np.maximum(l1, l2) + 0.05) / (np.minimum(l1, l2) + 0.05)
+
+
+class TouchRule(Rule):
+    """Mobile-only touch targets: their sizes, and how close the hit areas of buttons are.
+
+    Every node's own bounding box is checked against the minimum sizes.
+    Buttons are the interactive targets: each gets an effective hit area,
+    its background grown around its centre to the minimum control size,
+    and pairs of buttons in the same frame whose hit areas overlap or are
+    less than ``spacing`` apart are found with a sweep line.
+    """
+
+    name = "touch"
+    devices = ("mobile",)
+
+    def __init__(self, device, ruleset=DEFAULT_RULESET):
+        super().__init__(device)
+        self.control_min = ruleset["touch_target"]["control"]
+        self.text_min = ruleset["touch_target"]["text"]
+        self.spacing = ruleset["touch_target"]["spacing"]
+
+    @classmethod
+    def checklist(cls, ruleset):
+        return [{
+            "name": "Touch Targets",
+            "rules": [
+                {"description": f"Touch targets ≥ {ruleset['touch_target']['control']}px",
+                 "mobile": ruleset["touch_target"]["control"]},
+                {"description": f"Tappable text ≥ {ruleset['touch_target']['text']}px",
+                 "mobile": ruleset["touch_target"]["text"]},
+                {"description": f"Touch target hit areas ≥ {ruleset['touch_target']['spacing']}px apart",
+                 "mobile": ruleset["touch_target"]["spacing"]},
+            ],
+        }]
+
+    def hit_areas(self, boxes: np.ndarray):
+        """``boxes`` grown around their centre to at least the minimum control size."""
+        size = np.maximum(boxes[:, 2:] - boxes[:, :2], self.control_min)
+        centre = (boxes[:, :2] + boxes[:, 2:]) / 2
+        return np.hstack([centre - size / 2, centre + size / 2])
+
+    def crowding(self, table, rows=None):
+        """Issues for buttons whose hit areas overlap or are closer than ``spacing``, frame by frame."""
+        owned = _owned(table, rows)[table.button_node]
+        button_node = table.button_node[owned]
+        hit = self.hit_areas(table.button_box[owned])
+
+        issues = []
+        for members in _frame_groups(table.frame[button_node]):
+            if len(members) < 2:
+                continue
+            for i, j in sorted(close_pairs(hit[members], self.spacing)):
+                a, b = hit[members[i]], hit[members[j]]
+                # Chebyshev gap between the hit areas; negative when they overlap
+                gap = float(max(b[0] - a[2], a[0] - b[2], b[1] - a[3], a[1] - b[3]))
+                if gap < 0:
+                    code, issue = "touch_overlap", "Touch target hit areas overlap"
+                else:
+                    code, issue = "touch_spacing", "Touch targets too close"
+                issues.append(
+                    {
+                        "code": code,
+                        "issue": issue,
+                        "actual": as_number(round(gap, 5)),
+                        "expected_min": self.spacing,
+                        "node": table.ids[button_node[members[i]]],
+                        "other_node": table.ids[button_node[members[j]]],
+                    }
+                )
+        return issues
+
+    def partial(self, table, rows=None, diagnostics=NO_DIAGNOSTICS):
+        w, h = table.w, table.h
+        # NaN (no bounding box) compares False, so those rows drop out here
+        sized = (w > 0) & (h > 0) & _owned(table, rows)
+        size = np.minimum(w, h)
+        is_text = table.is_type("TEXT")
+
+        text_rows = sized & is_text
+        control_rows = sized & ~is_text
+
+        issues = []
+        for i in np.flatnonzero(sized & (size < np.where(is_text, self.text_min, self.control_min))):
+            if is_text[i]:
+                code, issue, expected = "touch_text", "Tappable text target too small", self.text_min
+            else:
+                code, issue, expected = "touch_target", "Touch target too small", self.control_min
+            issues.append(
+                {
+                    "code": code,
+                    "issue": issue,
+                    "actual": as_number(size[i]),
+                    "expected_min": expected,
+                    "node": table.ids[i],
+                }
+            )
+
+        with diagnostics.stage("hit_areas"):
+            crowded = self.crowding(table, rows)
+        return {
+            "min": as_number(size[control_rows].min()) if control_rows.any() else None,
+            "text_min": as_number(size[text_rows].min()) if text_rows.any() else None,
+            "issues": issues,
+            "crowded": crowded,
+        }
+
+    def merge(self, partials, metrics):
+        smallest_touch = _minimum(partial["min"] for partial in partials)
+        smallest_text_touch = _minimum(partial["text_min"] for partial in partials)
+        crowded = [issue for partial in partials for issue in partial["crowded"]]
+        status = "ok" if (
+            smallest_touch and smallest_touch >= self.control_min
+            and smallest_text_touch and smallest_text_touch >= self.text_min
+        ) else "error"
+        if crowded and status == "ok":
+            status = "warning"
+        metrics["touch_target"] = {
+            "min_detected": smallest_touch,
+            "recommended_min": self.control_min,
+            "text_min_detected": smallest_text_touch,
+            "text_recommended_min": self.text_min,
+            "crowded_pairs": len(crowded),
+            "min_hit_area_gap": _minimum(issue["actual"] for issue in crowded),
+            "recommended_spacing": self.spacing,
+            "status": status,
+        }
+        # size issues first, then crowding, whatever the number of partials
+        return [issue for partial in partials for issue in partial["issues"]] + crowded
+
+
+def histogram_percentile(histogram: list, total: int, percentile: float):
+    """Nearest-rank percentile of a histogram indexed by value."""
+    if not total:
+        return 0
+    rank = max(1, -(-total * percentile // 100))
+    seen = 0
+    for value, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return value
+    return len(histogram) - 1
+
+
+def subtree_heights(parent: np.ndarray, depth: np.ndarray):
+    """Height of every node's subtree, folded level by level from the deepest rows up."""
+    heights = np.zeros(len(parent), dtype=np.int32)
+    if not len(parent):
+        return heights
+
+    # depths may be offset when the table is a subtree of a larger document
+    depth = depth - depth[0]
+    order = np.argsort(depth, kind="stable")
+    bounds = np.searchsorted(depth[order], np.arange(depth.max() + 2))
+    for level in range(int(depth.max()), 0, -1):
+        rows = order[bounds[level]:bounds[level + 1]]
+        np.maximum.at(heights, parent[rows], heights[rows] + 1)
+    return heights
+
+
+class DepthRule(Rule):
+    """Subtree heights and absolute depths, computed in linear time.
+
+    Absolute depth is recorded when a node is entered (parent depth + 1);
+    subtree heights are folded bottom-up one depth level at a time, which
+    is equivalent to a post-order pass. Partials keep the depth histogram
+    and the sum of heights, plus the root's height so that the heights of
+    ancestors outside the table can be derived.
+    """
+
+    name = "depth"
+
+    def __init__(self, device, ruleset=DEFAULT_RULESET):
+        super().__init__(device)
+        self.max_depth = ruleset["layout_depth"]["max"]
+
+    @classmethod
+    def checklist(cls, ruleset):
+        return [{
+            "name": "Layout Structure",
+            "rules": [{"description": f"Average layout nesting depth ≤ {ruleset['layout_depth']['max']}"}],
+        }]
+
+    def partial(self, table, rows=None, diagnostics=NO_DIAGNOSTICS):
+        heights = subtree_heights(table.parent, table.depth)
+        owned = _owned(table, rows)
+        return {
+            "histogram": np.bincount(table.depth[owned]).tolist(),
+            "height_sum": int(heights[owned].sum()),
+            "count": int(owned.sum()),
+            "root_height": int(heights[0]) if len(heights) else 0,
+        }
+
+    def merge(self, partials, metrics):
+        histogram = []
+        for partial in partials:
+            counts = partial["histogram"]
+            if len(counts) > len(histogram):
+                histogram.extend([0] * (len(counts) - len(histogram)))
+            for depth, count in enumerate(counts):
+                histogram[depth] += count
+        total = sum(partial["count"] for partial in partials)
+
+        layout_depth = metrics["layout_depth"]
+        # avg_depth is the mean subtree height (what the threshold applies to);
+        # the node_depth_* metrics describe absolute node depths
+        avg_depth = sum(partial["height_sum"] for partial in partials) / total if total else 0
+        layout_depth["avg_depth"] = avg_depth
+        layout_depth["max_node_depth"] = len(histogram) - 1 if histogram else 0
+        layout_depth["node_depth_percentiles"] = {
+            "p50": histogram_percentile(histogram, total, 50),
+            "p90": histogram_percentile(histogram, total, 90),
+            "max": layout_depth["max_node_depth"],
+        }
+        layout_depth["node_depth_histogram"] = histogram
+
+        if avg_depth > self.max_depth:
+            layout_depth["status"] = "warning"
+            return [{
+                "code": "layout_depth",
+                "issue": "Deep nesting",
+                "avg_depth": avg_depth,
+                "recommended_max": self.max_depth,
+            }]
+        return []
+
+
+# ======================================================
+#                   ANALYSIS ENGINE
+# ======================================================
+# rule registry; results list the issues of each rule in this order
+RULES = (ButtonRule, FontRule, ContrastRule, TouchRule, DepthRule)
+
+
+def checklist(ruleset: RuleSet = DEFAULT_RULESET):
+    """Checklist generated from the rule registry, so it states exactly what is enforced."""
+    return {
+        "version": ruleset.version,
+        "categories": [category for rule in RULES for category in rule.checklist(ruleset)],
+    }
+
+
+class AnalysisEngine:
+    """Extracts a ``NodeTable`` in one walk, then runs every rule over its columns."""
+
+    def __init__(self, device: str, ruleset: RuleSet = DEFAULT_RULESET):
+        self.device = device
+        self.ruleset = ruleset
+        self.rules = [rule(device, ruleset) for rule in RULES if device in rule.devices]
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def compiled(device: str, ruleset: RuleSet = DEFAULT_RULESET):
+        """Shared engine for a device and rule set, built once per rule set version."""
+        return AnalysisEngine(device, ruleset)
+
+    def build_metrics(self):
+        thresholds = self.ruleset
+        font = thresholds["font_size"][self.device]
+        return {
+            "button_size": {
+                "min_detected": None,
+                "expected_min": thresholds["button_size"]["low"],
+                "priority_breakdown": {},
+                "status": "ok",
+            },
+            "button_spacing": {
+                "min_spacing": None,
+                "recommended_min": None,
+                "status": "ok",
+                "priority_breakdown": {},
+                "frames": {},
+            },
+            "contrast_ratio": {
+                "min_ratio": None,
+                "required_min_normal": thresholds["contrast"]["normal"],
+                "required_min_large": thresholds["contrast"]["large"],
+                "palette": [],
+                "palette_count": 0,
+                "status": "ok",
+            },
+            "font_size": {
+                "min_detected": None,
+                "recommended_min": font["min"],
+                "ideal_range": tuple(font["ideal"]),
+                "status": "ok",
+            },
+            "touch_target": None,
+            "layout_depth": {
+                "avg_depth": 0,
+                "max_node_depth": 0,
+                "node_depth_percentiles": {"p50": 0, "p90": 0, "max": 0},
+                "node_depth_histogram": [],
+                "recommended_max": thresholds["layout_depth"]["max"],
+                "status": "ok",
+            },
+        }
+
+    def analyze(self, figma_data: dict, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+        return self.evaluate(extract(figma_data, diagnostics), diagnostics)
+
+    @classmethod
+    def analyze_devices(
+        cls, figma_data: dict, devices, ruleset: RuleSet = DEFAULT_RULESET, diagnostics: Diagnostics = NO_DIAGNOSTICS
+    ):
+        """Extract the node table once and evaluate every device profile against it."""
+        table = extract(figma_data, diagnostics)
+        return cls.evaluate_devices(table, devices, ruleset, diagnostics)
+
+    @classmethod
+    def evaluate_devices(
+        cls, table: NodeTable, devices, ruleset: RuleSet = DEFAULT_RULESET, diagnostics: Diagnostics = NO_DIAGNOSTICS
+    ):
+        return {device: cls.compiled(device, ruleset).evaluate(table, diagnostics) for device in devices}
+
+    def evaluate(self, table: NodeTable, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+        return self.merge([self.partial(table, diagnostics=diagnostics)], diagnostics)
+
+    def partial(self, table: NodeTable, rows: np.ndarray = None, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+        """Per-rule summaries of ``table`` (optionally of the rows in the mask ``rows``)."""
+        partial = {}
+        for rule in self.rules:
+            with diagnostics.stage(f"rule.{rule.name}"):
+                partial[rule.name] = rule.partial(table, rows, diagnostics)
+        return partial
+
+    def merge(self, partials: list, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+        """Result for the union of the tables behind ``partials``, given in document order."""
+        metrics = self.build_metrics()
+        issues = []
+        with diagnostics.stage("merge"):
+            for rule in self.rules:
+                issues.extend(rule.merge([partial[rule.name] for partial in partials], metrics))
+
+        return {"device": self.device, "metrics": metrics, "issues": issues}
+
+
+def extract(figma_data: dict, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+    """Node table of a Figma file, counted into ``diagnostics``."""
+    table = build_table(figma_data.get("document", {}), diagnostics)
+    diagnostics.count_table(table)
+    return table
+
+
+def build_table(node: dict, diagnostics: Diagnostics = NO_DIAGNOSTICS, **context):
+    """``NodeTable`` of the tree under ``node``; ``context`` goes to ``NodeTableBuilder.resolve``.
+
+    The walk is timed as ``traversal``, the pass deriving depth,
+    backdrops and buttons as ``resolve``.
+    """
+    builder = NodeTableBuilder()
+    with diagnostics.stage("traversal"):
+        builder.walk(node)
+    with diagnostics.stage("resolve"):
+        return NodeTable(builder.resolve(**context))
@@ -0,0 +1,247 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from src.services.BlobStore import blob_store
+from src.services.Diagnostics import NO_DIAGNOSTICS, Diagnostics
+from src.services.DocumentShards import DocumentShards, frame_partials, partial_store
+from src.services.FastJSON import dump_bytes, loads
+from src.services.FigmaStream import figma_document
+from src.services.RawBody import DocumentRejected, check_node_limit, decode_json
+from src.services.ResultCache import file_version_key
+from src.services.RuleSet import DEFAULT_RULESET, RuleSet
+
+PROCESS_WORKERS = int(os.getenv("ANALYSIS_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# recycle workers regularly so memory fragmented by huge documents is given back
+MAX_TASKS_PER_CHILD = int(os.getenv("ANALYSIS_MAX_TASKS_PER_CHILD", "20"))
+# below this size handing the document over costs more than analysing it in place
+PROCESS_MIN_BYTES = int(os.getenv("ANALYSIS_PROCESS_MIN_BYTES", str(1024 * 1024)))
+# every worker gets a task of at least this many bytes of frames
+SHARD_MIN_BYTES = int(os.getenv("ANALYSIS_SHARD_MIN_BYTES", str(4 * 1024 * 1024)))
+
+
+def decode_document(
+    body: bytes, max_nodes: int = None, diagnostics: Diagnostics = NO_DIAGNOSTICS, imported: bool = False
+):
+    """The Figma file of a JSON body, unwrapped from a figma-service import response when ``imported``.
+
+    Raises ``DocumentRejected`` for a body that is not JSON or no Figma
+    file, or whose file has more than ``max_nodes`` nodes.
+    """
+    with diagnostics.stage("decode"):
+        try:
+            figma_data = figma_document(decode_json(body), imported)
+        except DocumentRejected as e:
+            if imported:
+                raise DocumentRejected(502, f"Invalid JSON from figma-service: {e.__cause__}")
+            raise
+    if figma_data is None:
+        if imported:
+            raise DocumentRejected(500, "Figma import did not return project data")
+        raise DocumentRejected(400, "Invalid figma_data payload")
+    if max_nodes is not None:
+        check_node_limit(figma_data.get("document") or {}, max_nodes)
+    return figma_data
+
+
+def keep_import(figma_data: dict, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+    """Store an imported Figma file as raw data.
+
+    Returns ``{"raw_data_hash", "raw_bytes", "document_key"}``: its blob,
+    its size and the key of its revision.
+    """
+    with diagnostics.stage("serialize"):
+        raw_bytes = dump_bytes(figma_data)
+    with diagnostics.stage("persist_raw"):
+        raw_data_hash = blob_store.put(raw_bytes)
+    document_key = file_version_key(
+        figma_data.get("file_key"),
+        figma_data.get("version"),
+        figma_data.get("last_modified"),
+        figma_data.get("node_ids"),
+        figma_data.get("depth"),
+    )
+    return {"raw_data_hash": raw_data_hash, "raw_bytes": len(raw_bytes), "document_key": document_key}
+
+
+def _read(path: str):
+    with open(path, "rb") as handover:
+        return handover.read()
+
+
+def _analyze_document(
+    path: str, devices, ruleset: RuleSet, diagnostics: bool, reuse: bool, max_nodes: int, imported: bool
+):
+    """``DocumentShards.analyze_devices`` of the Figma JSON in ``path``, with the timings of the worker.
+
+    An imported file is stored as raw data here, see ``keep_import``.
+    """
+    recorder = Diagnostics() if diagnostics else NO_DIAGNOSTICS
+    figma_data = decode_document(_read(path), max_nodes, recorder, imported)
+    kept = keep_import(figma_data, recorder) if imported else None
+    store = partial_store if reuse else None
+    results = DocumentShards.analyze_devices(figma_data, devices, store, ruleset, recorder)
+    return {"results": results, "import": kept, "diagnostics": recorder.state()}
+
+
+def _analyze_frames(path: str, contexts: list, devices, ruleset: RuleSet, diagnostics: bool, reuse: bool):
+    """``frame_partials`` of the list of top-level frames in ``path``, with the timings of the worker."""
+    recorder = Diagnostics() if diagnostics else NO_DIAGNOSTICS
+    with recorder.stage("decode"):
+        frames = loads(_read(path))
+    store = partial_store if reuse else None
+    partials, _ = frame_partials(frames, contexts, devices, store, ruleset, recorder)
+    return {"partials": partials, "diagnostics": recorder.state()}
+
+
+class AnalysisPool:
+    """Process pool that runs the analysis engine outside the web process.
+
+    The engine is CPU-bound Python, so running it on a request thread holds
+    the GIL and stalls every other request. Documents of at least
+    ``min_bytes`` are handed over as JSON in a temp file, decoded by the
+    worker, and only results or small partials are pickled back. A
+    document of at least twice ``shard_bytes`` whose frames are worth
+    analysing one by one is decoded and split once, here: each of up to
+    ``workers`` tasks is sent only the frames it owns, with their context,
+    and the calling thread merges their partials against the skeleton.
+    The pool is created on first use with the ``spawn`` start method,
+    which ``max_tasks_per_child`` requires.
+    """
+
+    def __init__(
+        self,
+        workers: int = PROCESS_WORKERS,
+        max_tasks_per_child: int = MAX_TASKS_PER_CHILD,
+        min_bytes: int = PROCESS_MIN_BYTES,
+        shard_bytes: int = SHARD_MIN_BYTES,
+    ):
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.min_bytes = min_bytes
+        self.shard_bytes = shard_bytes
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def offloads(self, size: int):
+        """Whether a document of ``size`` bytes is analysed in a worker process."""
+        return self.workers > 0 and size >= self.min_bytes
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child or None,
+                )
+            return self._executor
+
+    def analyze(
+        self,
+        body: bytes,
+        devices,
+        ruleset: RuleSet = DEFAULT_RULESET,
+        diagnostics: Diagnostics = NO_DIAGNOSTICS,
+        reuse: bool = True,
+        figma_data: dict = None,
+        max_nodes: int = None,
+        imported: bool = False,
+    ):
+        """Analyse the Figma JSON ``body`` for each of ``devices``.
+
+        Analysed in place for small documents. ``figma_data`` is ``body``
+        decoded, when the caller already has it; otherwise ``body`` is
+        decoded where it is analysed, and refused with ``DocumentRejected``
+        beyond ``max_nodes`` nodes. An ``imported`` body is a figma-service
+        response, whose file is unwrapped and stored where it is decoded.
+        With ``reuse``, frame partials are looked up in and saved to
+        ``partial_store``.
+
+        Returns ``{"results", "import"}``: results per device, and what
+        ``keep_import`` returned for an imported file (else None).
+        """
+        if not self.offloads(len(body)):
+            if figma_data is None:
+                figma_data = decode_document(body, max_nodes, diagnostics, imported)
+            kept = keep_import(figma_data, diagnostics) if imported else None
+            store = partial_store if reuse else None
+            results = DocumentShards.analyze_devices(figma_data, devices, store, ruleset, diagnostics)
+            return {"results": results, "import": kept}
+
+        parts = min(self.workers, len(body) // max(1, self.shard_bytes))
+        shards = None
+        if parts > 1:
+            # only a document big enough to be split is decoded in this process
+            if figma_data is None:
+                figma_data = decode_document(body, max_nodes, diagnostics, imported)
+            shards = DocumentShards(figma_data.get("document", {}), diagnostics)
+            parts = min(parts, len(shards))
+        if parts < 2 or not shards.splits_well():
+            arguments = (devices, ruleset, diagnostics.enabled, reuse, None if shards else max_nodes, imported)
+            outcome = self._run([(_analyze_document, body, arguments)])[0]
+            diagnostics.add(outcome["diagnostics"])
+            return {"results": outcome["results"], "import": outcome["import"]}
+
+        diagnostics.count("worker_parts", parts)
+        kept = keep_import(figma_data, diagnostics) if imported else None
+        partials = [None] * len(shards)
+        tasks = self._frame_tasks(shards, parts, devices, ruleset, diagnostics, reuse)
+        for part, outcome in enumerate(self._run(tasks)):
+            partials[part::parts] = outcome["partials"]
+            diagnostics.add(outcome["diagnostics"])
+        return {"results": shards.merge(devices, partials, ruleset), "import": kept}
+
+    @staticmethod
+    def _frame_tasks(
+        shards: DocumentShards, parts: int, devices, ruleset: RuleSet, diagnostics: Diagnostics, reuse: bool
+    ):
+        # frames are dealt round-robin, so big and small ones spread over the tasks
+        for part in range(parts):
+            indices = range(part, len(shards), parts)
+            with diagnostics.stage("serialize"):
+                frames = dump_bytes([shards.shards[k] for k in indices])
+            contexts = [shards.context(k) for k in indices]
+            yield _analyze_frames, frames, (contexts, devices, ruleset, diagnostics.enabled, reuse)
+
+    def _run(self, tasks):
+        """Outcomes of ``(function, JSON bytes, arguments)`` tasks, each called on a temp file of its bytes.
+
+        ``tasks`` may be a generator: each task is written out and
+        submitted before the next one is made.
+        """
+        paths = []
+        futures = []
+        try:
+            executor = self._get_executor()
+            try:
+                for function, body, arguments in tasks:
+                    fd, path = tempfile.mkstemp(prefix="analysis-", suffix=".json")
+                    paths.append(path)
+                    with os.fdopen(fd, "wb") as handover:
+                        handover.write(body)
+                    futures.append(executor.submit(function, path, *arguments))
+                return [future.result() for future in futures]
+            except BrokenProcessPool:
+                # a worker died (e.g. killed for memory); start a fresh pool next time
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                raise
+        finally:
+            # the other tasks may still be reading their handover files
+            wait(futures)
+            for path in paths:
+                os.remove(path)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+analysis_pool = AnalysisPool()
@@ -0,0 +1,124 @@
+import gzip
+import hashlib
+import os
+import threading
+import uuid
+
+BLOB_DIR = os.getenv("ANALYSIS_BLOB_DIR", "blobs")
+
+
+def blob_digest(data: bytes):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """Content-addressed, gzip-compressed blobs on local disk.
+
+    A blob lives at ``<root>/<first two hex digits>/<sha256>.json.gz``,
+    where the digest is taken over the uncompressed bytes, so storing the
+    same document twice costs nothing. Files are written under a temporary
+    name in ``<root>/tmp`` and moved into place, so a reader never sees a
+    partial blob.
+
+    With ``max_bytes``, reads mark a blob as used and the least recently
+    used blobs are removed whenever the store grows past that size, down
+    to ``PRUNE_TO`` of it. Other processes sharing the directory are only
+    accounted for when it is scanned, so the bound is approximate.
+    """
+
+    # share of max_bytes left after pruning, so a full store is not pruned on every write
+    PRUNE_TO = 0.9
+
+    def __init__(self, root: str = BLOB_DIR, max_bytes: int = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, digest: str):
+        return os.path.join(self.root, digest[:2], f"{digest}.json.gz")
+
+    def temp_path(self, name: str):
+        """Scratch path on the same filesystem as the blobs, for ``put_file``."""
+        return os.path.join(self.root, "tmp", f"{name}-{uuid.uuid4().hex}.gz")
+
+    def exists(self, digest: str):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data: bytes, digest: str = None):
+        """Store ``data`` unless an identical blob exists; returns its digest."""
+        digest = digest or blob_digest(data)
+        if self.exists(digest):
+            return digest
+
+        temp_path = self.temp_path(digest)
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        with gzip.open(temp_path, "wb", compresslevel=6) as blob:
+            blob.write(data)
+        return self.put_file(temp_path, digest)
+
+    def put_file(self, temp_path: str, digest: str):
+        """Move an already gzipped file into place, or drop it if the blob exists."""
+        target = self.path(digest)
+        if os.path.exists(target):
+            os.remove(temp_path)
+            return digest
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(temp_path, target)
+        if self.max_bytes is not None:
+            self._grow(os.path.getsize(target))
+        return digest
+
+    def _grow(self, size: int):
+        with self._lock:
+            if self._size is None:
+                # the first write of this process scans the store, which already counts this blob
+                self._size = sum(size for _, _, size in self._blobs())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._prune(int(self.max_bytes * self.PRUNE_TO))
+
+    def _blobs(self):
+        """``(mtime, path, size)`` of every stored blob."""
+        if not os.path.isdir(self.root):
+            return
+        for folder in os.scandir(self.root):
+            if len(folder.name) != 2 or not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, entry.path, stat.st_size
+
+    def _prune(self, limit: int):
+        """Remove the least recently used blobs until at most ``limit`` bytes are left."""
+        blobs = sorted(self._blobs())
+        size = sum(blob_size for _, _, blob_size in blobs)
+        for _, path, blob_size in blobs:
+            if size <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= blob_size
+        self._size = size
+
+    def open(self, digest: str):
+        """Binary file object over the decompressed blob; raises ``FileNotFoundError`` if there is none."""
+        path = self.path(digest)
+        blob = gzip.open(path, "rb")
+        if self.max_bytes is not None:
+            os.utime(path)
+        return blob
+
+    def read(self, digest: str):
+        with self.open(digest) as blob:
+            return blob.read()
+
+
+blob_store = BlobStore()
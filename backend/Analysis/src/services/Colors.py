@@ -0,0 +1,77 @@
+def figma_color_to_rgb(color):
+    """Convert a Figma colour (dict with ``r``/``g``/``b`` or a 0–1 tuple) to 0–255 ints."""
+    if isinstance(color, dict):
+        color = (color["r"], color["g"], color["b"])
+    return [
+        int(color[0] * 255),
+        int(color[1] * 255),
+        int(color[2] * 255),
+    ]
+
+
+def blend(top: tuple, alpha: float, bottom: tuple):
+    """Source-over compositing of ``top`` with opacity ``alpha`` onto an opaque ``bottom``."""
+    if alpha >= 1:
+        return top
+    return (
+        top[0] * alpha + bottom[0] * (1 - alpha),
+        top[1] * alpha + bottom[1] * (1 - alpha),
+        top[2] * alpha + bottom[2] * (1 - alpha),
+    )
+
+
+def solid_paints(fills, background_color=None):
+    """Visible solid paints of a node as ``(r, g, b, alpha)`` tuples, bottom to top.
+
+    Colour alpha and paint opacity are folded into ``alpha``. When the node
+    has no ``fills`` key at all (pages, legacy frames) ``backgroundColor``
+    is used instead.
+    """
+    if fills is None:
+        if not background_color:
+            return ()
+        return ((background_color["r"], background_color["g"], background_color["b"], background_color.get("a", 1)),)
+    if not isinstance(fills, list):
+        return ()
+
+    paints = []
+    for paint in fills:
+        if not paint.get("visible", True):
+            continue
+        color = paint.get("color")
+        if not color:
+            continue
+        paints.append((color["r"], color["g"], color["b"], color.get("a", 1) * paint.get("opacity", 1)))
+    return tuple(paints)
+
+
+def composite(paints: tuple, opacity: float, backdrop: tuple):
+    """Composite ``paints`` of a layer with the given ``opacity`` over ``backdrop``."""
+    result = backdrop
+    for r, g, b, alpha in paints:
+        alpha *= opacity
+        if alpha <= 0:
+            continue
+        result = blend((r, g, b), alpha, result)
+    return result
+
+
+def glyph_color(paints: tuple, opacity: float, backdrop: tuple):
+    """Colour of text drawn with its first solid paint over ``backdrop``, or None without one."""
+    if not paints:
+        return None
+    r, g, b, alpha = paints[0]
+    return blend((r, g, b), alpha * opacity, backdrop)
+
+
+def _srgb_to_linear(c: int):
+    c = c / 255
+    return c / 12.92 if c <= 0.03928 else ((c + 0.055) / 1.055) ** 2.4
+
+
+# every 8-bit channel value linearised once at import
+SRGB_TO_LINEAR = tuple(_srgb_to_linear(c) for c in range(256))
+
+
+def rgb_to_hex(rgb):
+    return "#{:02X}{:02X}{:02X}".format(*rgb)
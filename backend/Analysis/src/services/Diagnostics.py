@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from src.services.NodeTable import TEXT_CODE
+
+# collect diagnostics for every analysis (service metrics), not only when a request asks for them
+DIAGNOSTICS_ENABLED = os.getenv("ANALYSIS_DIAGNOSTICS", "0") == "1"
+
+
+class Diagnostics:
+    """Stage timers and counters of one analysis.
+
+    Stages are timed with ``stage`` and may nest (``rule.button`` includes
+    ``spacing``); a stage entered several times, e.g. once per frame or
+    device, accumulates. Outcomes from worker processes are folded in with
+    ``add``, so their timings are summed across workers rather than wall
+    time, and counters count work done: the few rows outside every frame
+    are counted by each worker that extracts them.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    def count_table(self, table, rows: np.ndarray = None):
+        """Count the nodes, buttons and text nodes of an extracted table (of the rows in the mask ``rows``)."""
+        if rows is None:
+            rows = np.ones(len(table), dtype=bool)
+        self.count("nodes", np.count_nonzero(rows))
+        self.count("buttons", np.count_nonzero(rows[table.button_node]))
+        self.count("text_nodes", np.count_nonzero(table.type[rows] == TEXT_CODE))
+
+    def add(self, other: dict):
+        for name, seconds in other["timings"].items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+        for name, amount in other["counters"].items():
+            self.count(name, amount)
+
+    def state(self):
+        """Picklable totals, for ``add`` in another process."""
+        return {"timings": self.timings, "counters": self.counters}
+
+    def to_dict(self):
+        return {
+            "timings_ms": {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()},
+            "counters": dict(self.counters),
+        }
+
+
+class _DisabledDiagnostics:
+    """Stand-in that records nothing, so uninstrumented analyses pay one attribute lookup per stage."""
+
+    enabled = False
+    _stage = nullcontext()
+
+    def stage(self, name: str):
+        return self._stage
+
+    def count(self, name: str, amount: int = 1):
+        pass
+
+    def count_table(self, table, rows: np.ndarray = None):
+        pass
+
+    def add(self, other: dict):
+        pass
+
+    def state(self):
+        return None
+
+
+NO_DIAGNOSTICS = _DisabledDiagnostics()
+
+
+class ServiceMetrics:
+    """Thread-safe running totals of the diagnostics of every instrumented analysis."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.analyses = 0
+            self.timings = {}
+            self.counters = {}
+
+    def record(self, diagnostics: Diagnostics):
+        if not diagnostics.enabled:
+            return
+        with self._lock:
+            self.analyses += 1
+            for name, seconds in diagnostics.timings.items():
+                total, calls = self.timings.get(name, (0.0, 0))
+                self.timings[name] = (total + seconds, calls + 1)
+            for name, amount in diagnostics.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "analyses": self.analyses,
+                "timings_ms": {
+                    name: {"total": round(total * 1000, 3), "mean": round(total * 1000 / calls, 3), "count": calls}
+                    for name, (total, calls) in self.timings.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+service_metrics = ServiceMetrics()
@@ -0,0 +1,231 @@
+import hashlib
+import os
+from functools import cached_property
+
+import numpy as np
+
+from src.services.AnalysisEngine import AnalysisEngine, build_table
+from src.services.BlobStore import BLOB_DIR, BlobStore
+from src.services.Diagnostics import NO_DIAGNOSTICS, Diagnostics
+from src.services.FastJSON import dump_bytes, loads
+from src.services.NodeTable import CONTAINER_CODES, NODE_TYPES
+from src.services.ResultCache import cache_key
+from src.services.RuleSet import DEFAULT_RULESET, RuleSet
+
+PARTIAL_DIR = os.getenv("ANALYSIS_PARTIAL_DIR", os.path.join(BLOB_DIR, "partials"))
+# least recently used partials are removed once the store grows past this
+PARTIAL_MAX_BYTES = int(os.getenv("ANALYSIS_PARTIAL_MAX_BYTES", str(512 * 1024 * 1024)))
+# below this many nodes per frame on average, a table and partials per frame cost more than their reuse saves
+PARTIAL_MIN_NODES = int(os.getenv("ANALYSIS_PARTIAL_MIN_NODES", "500"))
+
+CONTAINER_TYPES = tuple(NODE_TYPES[code] for code in CONTAINER_CODES)
+
+
+class DocumentShards:
+    """A Figma document split at its top-level frames.
+
+    Every child of the root or of a page (a DOCUMENT or CANVAS node) that
+    is not a page itself is a top-level frame, and its subtree is a shard
+    that can be analysed as a table of its own. The root and the pages,
+    with the shard roots kept as childless leaves, form the skeleton: a
+    small table that supplies each shard's depth and incoming backdrop and
+    owns the few rows outside any shard.
+
+    A shard's partial rule results depend only on its JSON and that
+    context, so they are stored under a fingerprint of both and reused by
+    any later analysis that contains the same frame. Merging the skeleton
+    partial with the shard partials in document order gives the same
+    result as evaluating the whole document at once (issues of page nodes
+    with their own bounding boxes are listed before those of the frames).
+    Work done for this document is recorded in ``diagnostics``.
+    """
+
+    def __init__(self, document: dict, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+        self.shards = []
+        self.shard_rows = []
+        self._rows = 0
+        self.diagnostics = diagnostics
+
+        with diagnostics.stage("split"):
+            self._tree = self._skeleton(document, True)
+
+    @cached_property
+    def skeleton(self):
+        """Node table of the skeleton, built on first use."""
+        table = build_table(self._tree, self.diagnostics)
+        self.diagnostics.count_table(table, self._owned_rows())
+        return table
+
+    def _skeleton(self, node: dict, is_root: bool):
+        row = self._rows
+        self._rows += 1
+        if not is_root and node.get("type") not in CONTAINER_TYPES:
+            self.shards.append(node)
+            self.shard_rows.append(row)
+            return {key: value for key, value in node.items() if key != "children"}
+
+        node = dict(node)
+        if node.get("children"):
+            node["children"] = [self._skeleton(child, False) for child in node["children"]]
+        return node
+
+    def _owned_rows(self):
+        """Mask of the skeleton rows outside every shard."""
+        rows = np.ones(self._rows, dtype=bool)
+        rows[self.shard_rows] = False
+        return rows
+
+    def __len__(self):
+        return len(self.shards)
+
+    def splits_well(self, min_nodes: int = None):
+        """Whether the frames have ``min_nodes`` (``PARTIAL_MIN_NODES``) nodes on average."""
+        needed = (PARTIAL_MIN_NODES if min_nodes is None else min_nodes) * len(self.shards)
+        nodes = 0
+        stack = list(self.shards)
+        while stack and nodes < needed:
+            nodes += 1
+            children = stack.pop().get("children")
+            if children:
+                stack.extend(children)
+        return bool(self.shards) and nodes >= needed
+
+    def context(self, k: int):
+        """Backdrop and depth of the ``k``-th shard root within the document."""
+        row = self.shard_rows[k]
+        return tuple(float(c) for c in self.skeleton.backdrop_float[row]), int(self.skeleton.depth[row])
+
+    def skeleton_partial(self, engine: AnalysisEngine, root_heights: list):
+        """Partial of the rows outside every shard, given the height of each shard root."""
+        table = self.skeleton
+        rows = self._owned_rows()
+        partial = engine.partial(table, rows, self.diagnostics)
+
+        # heights of skeleton rows come from the shards below them, not from the leaves kept here
+        heights = [0] * len(table)
+        for row, height in zip(self.shard_rows, root_heights):
+            heights[row] = height
+        parent = table.parent.tolist()
+        for i in range(len(table) - 1, 0, -1):
+            if heights[i] + 1 > heights[parent[i]]:
+                heights[parent[i]] = heights[i] + 1
+
+        partial["depth"] = {
+            "histogram": np.bincount(table.depth[rows]).tolist(),
+            "height_sum": sum(height for height, owned in zip(heights, rows) if owned),
+            "count": int(rows.sum()),
+            "root_height": heights[0],
+        }
+        return partial
+
+    @classmethod
+    def analyze_devices(
+        cls,
+        figma_data: dict,
+        devices,
+        store: BlobStore = None,
+        ruleset: RuleSet = DEFAULT_RULESET,
+        diagnostics: Diagnostics = NO_DIAGNOSTICS,
+    ):
+        """Like ``AnalysisEngine.analyze_devices``, but only re-analyses frames not found in ``store``.
+
+        Without a store, or when the frames are too small to be worth
+        storing, the document is evaluated whole.
+        """
+        if store is not None:
+            shards = cls(figma_data.get("document", {}), diagnostics)
+            if shards.splits_well():
+                results, _ = shards.analyze(devices, store, ruleset)
+                return results
+        return AnalysisEngine.analyze_devices(figma_data, devices, ruleset, diagnostics)
+
+    def analyze(self, devices, store: BlobStore = None, ruleset: RuleSet = DEFAULT_RULESET):
+        """Results per device, reusing shard partials found in ``store`` and saving new ones.
+
+        Returns ``(results, reused)`` where ``reused`` counts the shards
+        that did not have to be analysed again.
+        """
+        partials, reused = self.shard_partials(range(len(self.shards)), devices, store, ruleset)
+        return self.merge(devices, partials, ruleset), reused
+
+    def shard_partials(self, indices, devices, store: BlobStore = None, ruleset: RuleSet = DEFAULT_RULESET):
+        """``{device: partial}`` for each shard in ``indices``, plus how many came from ``store``."""
+        frames = [self.shards[k] for k in indices]
+        contexts = [self.context(k) for k in indices]
+        return frame_partials(frames, contexts, devices, store, ruleset, self.diagnostics)
+
+    def merge(self, devices, partials: list, ruleset: RuleSet = DEFAULT_RULESET):
+        """Results per device from the ``{device: partial}`` of every shard, in shard order."""
+        results = {}
+        for device in devices:
+            engine = AnalysisEngine.compiled(device, ruleset)
+            shard_partials = [partial[device] for partial in partials]
+            root_heights = [partial["depth"]["root_height"] for partial in shard_partials]
+            results[device] = engine.merge(
+                [self.skeleton_partial(engine, root_heights)] + shard_partials, self.diagnostics
+            )
+        return results
+
+
+def frame_fingerprint(frame: dict, context: tuple):
+    backdrop, depth = context
+    digest = hashlib.sha256(f"{backdrop!r}|{depth}|".encode())
+    digest.update(dump_bytes(frame))
+    return digest.hexdigest()
+
+
+def frame_table(frame: dict, context: tuple, diagnostics: Diagnostics = NO_DIAGNOSTICS):
+    backdrop, depth = context
+    table = build_table(frame, diagnostics, backdrop=backdrop, depth=depth, frame_root=True)
+    diagnostics.count_table(table)
+    return table
+
+
+def frame_partials(
+    frames: list,
+    contexts: list,
+    devices,
+    store: BlobStore = None,
+    ruleset: RuleSet = DEFAULT_RULESET,
+    diagnostics: Diagnostics = NO_DIAGNOSTICS,
+):
+    """``{device: partial}`` of each top-level frame in its ``(backdrop, depth)`` context.
+
+    Returns them with how many came from ``store``. Needs nothing but
+    the frames, so it also runs in a worker process that was only sent
+    its share of a document.
+    """
+    engines = {device: AnalysisEngine.compiled(device, ruleset) for device in devices}
+    partials = []
+    reused = 0
+
+    for frame, context in zip(frames, contexts):
+        keys = {}
+        found = {}
+        if store is not None:
+            with diagnostics.stage("partial_store"):
+                fingerprint = frame_fingerprint(frame, context)
+                for device in devices:
+                    keys[device] = cache_key(fingerprint, device, ruleset.version)
+                    try:
+                        found[device] = loads(store.read(keys[device]))
+                    except FileNotFoundError:
+                        pass
+
+        if len(found) < len(devices):
+            table = frame_table(frame, context, diagnostics)
+            for device in devices:
+                if device not in found:
+                    found[device] = engines[device].partial(table, diagnostics=diagnostics)
+                    if store is not None:
+                        with diagnostics.stage("partial_store"):
+                            store.put(dump_bytes(found[device]), keys[device])
+        else:
+            reused += 1
+        partials.append(found)
+    diagnostics.count("shards", len(partials))
+    diagnostics.count("shards_reused", reused)
+    return partials, reused
+
+
+partial_store = BlobStore(PARTIAL_DIR, PARTIAL_MAX_BYTES)
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# dicts keyed by ints are written with str keys, numpy values as plain numbers and lists
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+loads = orjson.loads
+
+
+def _default(value):
+    """Values orjson does not serialize by itself (datetimes, UUIDs and enums it does)."""
+    if isinstance(value, BaseModel):
+        # schemas and SQLModel rows
+        return value.model_dump()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _walked(value):
+    """``value`` itself if it is a container ``_dump_nested`` walks, else its JSON."""
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    elif isinstance(value, (set, frozenset)):
+        value = list(value)
+    if isinstance(value, (dict, list, tuple)):
+        return value
+    return orjson.dumps(value, default=_default, option=OPTIONS)
+
+
+def _dump_nested(value) -> bytes:
+    """``dump_bytes`` of a value nested deeper than orjson goes, encoded with a stack instead of recursion."""
+    out = []
+    stack = [_walked(value)]
+    while stack:
+        item = stack.pop()
+        if type(item) is bytes:
+            out.append(item)
+            continue
+        pieces = []
+        if isinstance(item, dict):
+            out.append(b"{")
+            for key, child in item.items():
+                key = orjson.dumps(key if isinstance(key, str) else str(key))
+                pieces.append(b"," + key + b":" if pieces else key + b":")
+                pieces.append(_walked(child))
+            pieces.append(b"}")
+        else:
+            out.append(b"[")
+            for child in item:
+                if pieces:
+                    pieces.append(b",")
+                pieces.append(_walked(child))
+            pieces.append(b"]")
+        stack.extend(reversed(pieces))
+    return b"".join(out)
+
+
+def dump_bytes(value) -> bytes:
+    """Compact UTF-8 JSON of ``value``."""
+    try:
+        return orjson.dumps(value, default=_default, option=OPTIONS)
+    except orjson.JSONEncodeError as e:
+        # orjson stops at 255 levels of nesting, which is about 127 levels of Figma nodes
+        if "Recursion limit" not in str(e):
+            raise
+        return _dump_nested(value)
+
+
+def dumps(value) -> str:
+    """``dump_bytes`` as text, for JSON kept in text columns."""
+    return dump_bytes(value).decode()
+
+
+class FastJSONResponse(JSONResponse):
+    """``JSONResponse`` rendered by orjson; the default response class of the app."""
+
+    def render(self, content) -> bytes:
+        return dump_bytes(content)
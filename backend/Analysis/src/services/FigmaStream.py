@@ -0,0 +1,312 @@
+import gzip
+import hashlib
+import os
+
+import ijson
+import orjson
+
+from src.services.NodeTable import NODE_KEYS, NodeTable, NodeTableBuilder
+from src.services.RawBody import too_many_nodes
+
+# how deep into the import response the "document" key may sit
+# ({"project": {"document": ...}} or {"project": {"project": {"document": ...}}})
+DOCUMENT_MAX_DEPTH = 3
+
+CHUNK_SIZE = 64 * 1024
+
+
+class SpoolWriter:
+    """Binary sink that gzips everything written to it into ``path``.
+
+    The sha256 of the uncompressed bytes is available as ``digest`` after
+    closing, their length as ``size``. ``fields`` holds the top-level
+    scalars (``file_key``, ``version``, ...) of a map copied into it.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.digest = None
+        self._open()
+
+    def _open(self):
+        self.spool = gzip.open(self.path, "wb", compresslevel=6)
+        self._sha = hashlib.sha256()
+        self.size = 0
+        self.fields = {}
+
+    def write(self, data: bytes):
+        self.spool.write(data)
+        self._sha.update(data)
+        self.size += len(data)
+
+    def reset(self):
+        """Drop everything written so far."""
+        self.spool.close()
+        self._open()
+
+    def close(self):
+        self.spool.close()
+        self.digest = self._sha.hexdigest()
+
+    def discard(self):
+        """Close the spool and delete its file."""
+        self.spool.close()
+        os.remove(self.path)
+
+
+class SpoolReader:
+    """File-like wrapper that gzips every chunk it reads into ``path``.
+
+    Lets the parser and the on-disk copy share a single pass over the
+    response body; ``close`` drains whatever the parser did not consume.
+    ``spool`` is the ``SpoolWriter`` behind the copy.
+    """
+
+    def __init__(self, raw, path: str):
+        self.raw = raw
+        self.path = path
+        self.spool = SpoolWriter(path)
+
+    @property
+    def digest(self):
+        return self.spool.digest
+
+    @property
+    def size(self):
+        return self.spool.size
+
+    def read(self, size: int = -1):
+        chunk = self.raw.read(size)
+        if chunk:
+            self.spool.write(chunk)
+        return chunk
+
+    def close(self):
+        while self.read(CHUNK_SIZE):
+            pass
+        self.spool.close()
+
+    def discard(self):
+        """Stop spooling without reading the rest and delete the spool file."""
+        self.spool.discard()
+
+
+def figma_document(payload: dict, imported: bool):
+    """The Figma file inside ``payload``; unwraps figma-service import responses."""
+    if not imported:
+        return payload if isinstance(payload, dict) else None
+    project = payload.get("project") if isinstance(payload, dict) else None
+    if not project:
+        return None
+    return project.get("project") or project
+
+
+# JSON text of the events that open and close containers
+_OPEN = {"start_map": b"{", "start_array": b"["}
+_CLOSE = {"end_map": b"}", "end_array": b"]"}
+
+
+def _copy_map(events, out, nested: bool):
+    """Pass through the map whose ``start_map`` was just read from ``events``, writing it to ``out`` as JSON.
+
+    With ``nested``, a map under its own ``project`` key replaces it as
+    what is written. Returns how many of its containers the copy leaves
+    open: 1 when a nested project ended it, else 0.
+    """
+    dumps = orjson.dumps
+    pieces = [b"{"]
+    append = pieces.append
+    opened = 1
+    # whether a comma goes before the next key or array item
+    comma = False
+    project_key = False
+    key = None
+    yield "start_map", None
+    for event, value in events:
+        close = _CLOSE.get(event)
+        if close is not None:
+            append(close)
+            comma = True
+            opened -= 1
+            if not opened or len(pieces) >= 8192:
+                out.write(b"".join(pieces))
+                pieces.clear()
+            if not opened:
+                yield event, value
+                return 0
+        elif event == "map_key":
+            if opened == 1:
+                key = value
+                project_key = nested and value == "project"
+            append(b"," + dumps(value) + b":" if comma else dumps(value) + b":")
+            comma = False
+        else:
+            start = _OPEN.get(event)
+            if start is None:
+                append(b"," + dumps(value) if comma else dumps(value))
+                comma = True
+                if opened == 1:
+                    out.fields[key] = value
+            elif project_key and opened == 1 and event == "start_map":
+                # a project inside the project is the file itself
+                out.reset()
+                yield from _copy_map(events, out, nested=False)
+                return 1
+            else:
+                append(b"," + start if comma else start)
+                opened += 1
+                comma = False
+        yield event, value
+    return 0
+
+
+def _copy_file(events, out):
+    """Pass ``events`` through, writing the Figma file of an import response to ``out`` as compact JSON.
+
+    The file is the map under the top-level ``project`` key, or the map
+    under that map's own ``project`` key, as ``figma_document`` unwraps it.
+    ``out`` needs ``write`` and ``reset``.
+    """
+    depth = 0
+    project_key = False
+    for event, value in events:
+        if project_key and event == "start_map":
+            depth += yield from _copy_map(events, out, nested=True)
+            project_key = False
+            continue
+        project_key = event == "map_key" and depth == 1 and value == "project"
+        if event in _OPEN:
+            depth += 1
+        elif event in _CLOSE:
+            depth -= 1
+        yield event, value
+
+
+def _value(event, value, events):
+    """Materialise the value that starts with ``event`` (only used for small node properties)."""
+    if event == "start_map":
+        root = {}
+    elif event == "start_array":
+        root = []
+    else:
+        return value
+
+    stack = [root]
+    key = None
+    for event, value in events:
+        if event == "map_key":
+            key = value
+            continue
+        if event == "end_map" or event == "end_array":
+            stack.pop()
+            if not stack:
+                return root
+            continue
+
+        if event == "start_map":
+            value = {}
+        elif event == "start_array":
+            value = []
+        top = stack[-1]
+        if type(top) is list:
+            top.append(value)
+        else:
+            top[key] = value
+        if event == "start_map" or event == "start_array":
+            stack.append(value)
+    return root
+
+
+def _skip(event, events):
+    if event not in ("start_map", "start_array"):
+        return
+
+    depth = 1
+    for event, _ in events:
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def _seek_document(events):
+    """Advance ``events`` to just inside the ``document`` map; False if there is none."""
+    depth = 0
+    for event, value in events:
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+        elif event == "map_key" and value == "document" and depth <= DOCUMENT_MAX_DEPTH:
+            event, value = next(events)
+            if event == "start_map":
+                return True
+            _skip(event, events)
+    return False
+
+
+def read_nodes(events, builder: NodeTableBuilder, max_nodes: int = None):
+    """Feed the node tree that starts after a ``start_map`` event into ``builder``.
+
+    ``rows`` mirrors the open JSON containers: a row index while inside a
+    node's map, -1 while inside a ``children`` array (whose owner is the
+    entry below it). A row is opened on its ``start_map``, so rows stay in
+    pre-order whatever order the keys arrive in. Only ``NODE_KEYS`` values
+    are materialised; everything else is skipped event by event. Parsing
+    stops with ``DocumentRejected`` as soon as a row beyond ``max_nodes``
+    is opened.
+    """
+    rows = [builder.start(-1)]
+    for event, value in events:
+        row = rows[-1]
+        if row >= 0:
+            if event == "map_key":
+                key = value
+                event, value = next(events)
+                if key == "children" and event == "start_array":
+                    rows.append(-1)
+                elif key in NODE_KEYS:
+                    builder.set(row, key, _value(event, value, events))
+                else:
+                    _skip(event, events)
+            elif event == "end_map":
+                rows.pop()
+                if not rows:
+                    return
+        elif event == "start_map":
+            rows.append(builder.start(rows[-2]))
+            if max_nodes is not None and len(builder) > max_nodes:
+                raise too_many_nodes(max_nodes)
+        elif event == "end_array":
+            rows.pop()
+        else:
+            _skip(event, events)
+
+
+def node_table_from_stream(fp, max_nodes: int = None, copy=None):
+    """Build a ``NodeTable`` from the Figma JSON in the binary file-like ``fp``.
+
+    ``fp`` may be a raw file document or a figma-service import response;
+    the first ``document`` object found near the top is used. Returns None
+    when there is no document. Memory is bounded by the table itself,
+    never by the size of the JSON, and by ``max_nodes`` rows when given.
+    With ``copy`` (a ``SpoolWriter``), the Figma file inside an import
+    response is written to it as compact JSON in the same pass.
+    """
+    events = ijson.basic_parse(fp, buf_size=CHUNK_SIZE, use_float=True)
+    if copy is not None:
+        events = _copy_file(events, copy)
+
+    table = None
+    if _seek_document(events):
+        builder = NodeTableBuilder()
+        read_nodes(events, builder, max_nodes)
+        table = NodeTable(builder.resolve())
+    if copy is not None:
+        # the rest of the file (name, version, ...) may follow its document
+        for _ in events:
+            pass
+    return table
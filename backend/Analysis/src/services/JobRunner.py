@@ -0,0 +1,52 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from src.database.db_connection import AUTH_SESSION
+from src.services.Services import Services
+
+JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "4"))
+# jobs are not bound to a client request, so slow Figma imports may take longer
+JOB_IMPORT_TIMEOUT = float(os.getenv("ANALYSIS_JOB_IMPORT_TIMEOUT", "120"))
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """Runs queued analyses on a pool of worker threads.
+
+    Each job gets its own database session from ``session_factory`` and
+    completes the ``processing`` row created by ``Services.create_job``;
+    errors are recorded on that row as ``failed`` instead of being raised.
+    """
+
+    def __init__(self, session_factory, workers: int = JOB_WORKERS):
+        self.session_factory = session_factory
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis-job")
+
+    def submit(self, analysis_id: str, project_id: int, device: str, **options):
+        return self.executor.submit(self._run, analysis_id, project_id, device, options)
+
+    def _run(self, analysis_id: str, project_id: int, device: str, options: dict):
+        db = self.session_factory()
+        service = Services(db)
+        try:
+            service.run_analysis(
+                project_id,
+                device,
+                analysis_id=analysis_id,
+                import_timeout=JOB_IMPORT_TIMEOUT,
+                **options,
+            )
+        except HTTPException as e:
+            service.fail_job(analysis_id, str(e.detail))
+        except Exception as e:
+            logger.exception("Analysis job %s failed", analysis_id)
+            service.fail_job(analysis_id, f"Internal error: {e}")
+        finally:
+            db.close()
+
+
+job_runner = JobRunner(AUTH_SESSION)
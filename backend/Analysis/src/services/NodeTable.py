@@ -0,0 +1,435 @@
+from array import array
+
+import numpy as np
+
+from src.services.Colors import composite, glyph_color, solid_paints
+
+NODE_TYPES = (
+    "OTHER",
+    "DOCUMENT",
+    "CANVAS",
+    "FRAME",
+    "GROUP",
+    "SECTION",
+    "COMPONENT",
+    "COMPONENT_SET",
+    "INSTANCE",
+    "RECTANGLE",
+    "ELLIPSE",
+    "VECTOR",
+    "LINE",
+    "STAR",
+    "POLYGON",
+    "BOOLEAN_OPERATION",
+    "TEXT",
+)
+TYPE_CODES = {name: code for code, name in enumerate(NODE_TYPES)}
+
+# node types that hold screens rather than being part of one
+CONTAINER_CODES = (TYPE_CODES["DOCUMENT"], TYPE_CODES["CANVAS"])
+BUTTON_CODES = (TYPE_CODES["GROUP"], TYPE_CODES["FRAME"])
+LABEL_CODES = (TYPE_CODES["TEXT"], TYPE_CODES["VECTOR"], TYPE_CODES["ELLIPSE"])
+RECTANGLE_CODE = TYPE_CODES["RECTANGLE"]
+TEXT_CODE = TYPE_CODES["TEXT"]
+
+# node properties the table is built from
+NODE_KEYS = ("id", "type", "name", "characters", "opacity", "style", "fills", "backgroundColor", "absoluteBoundingBox")
+
+# earlier siblings (e.g. a button's background rectangle) checked as backdrops
+SIBLING_BACKDROP_WINDOW = 8
+
+PRIORITIES = ("high", "medium", "low")
+PRIORITY_CODES = {name: code for code, name in enumerate(PRIORITIES)}
+LOW_PRIORITY = PRIORITY_CODES["low"]
+
+TEXT_SAMPLE_LENGTH = 20
+
+
+def classify_priority(node_name: str):
+    name = (node_name or "").lower()
+    if "primary" in name or "high" in name:
+        return "high"
+    if "secondary" in name or "medium" in name:
+        return "medium"
+    return "low"
+
+
+def is_large_text(node: dict):
+    style = node.get("style", {})
+    font_size = style.get("fontSize", 0)
+    font_weight = style.get("fontWeight", 400)
+    return font_size >= 18 or (font_size >= 14 and font_weight >= 700)
+
+
+def button_rect(node: dict):
+    """Return the background rectangle of a button-like node, or None.
+
+    Children are scanned once, so the check costs O(children) per node.
+    """
+    if node.get("type") not in ("GROUP", "FRAME"):
+        return None
+
+    rect = None
+    has_label = False
+    for child in node.get("children") or ():
+        child_type = child.get("type")
+        if child_type == "RECTANGLE":
+            if rect is None and child.get("absoluteBoundingBox"):
+                rect = child
+        elif child_type in ("TEXT", "VECTOR", "ELLIPSE"):
+            has_label = True
+
+    if rect is None or not has_label:
+        return None
+
+    box = rect["absoluteBoundingBox"]
+    if box["width"] >= 24 and box["height"] >= 24:
+        return rect
+    return None
+
+
+def _channel(value: float):
+    return int(value * 255)
+
+
+class NodeTable:
+    """Struct-of-arrays view of a Figma document.
+
+    Row ``i`` is the ``i``-th node in pre-order, so every parent row comes
+    before its children. Columns:
+
+    * ``type`` (uint8, see ``NODE_TYPES``), ``parent`` and ``depth`` (int32),
+      ``frame`` (int32 index into ``frame_ids``, -1 outside any frame)
+    * ``x``/``y``/``w``/``h`` (float64, NaN without ``absoluteBoundingBox``)
+    * ``font_size`` (NaN when unset) and ``font_weight`` (float64)
+    * ``fill`` (uint8 RGB, the composited glyph colour of TEXT rows) with
+      ``has_fill``, and ``backdrop`` (uint8 RGB painted behind the node,
+      ``backdrop_float`` before truncation)
+
+    Button-like groups are kept in a separate, much smaller table:
+    ``button_node``, ``button_box`` (rect x1/y1/x2/y2), ``button_height``
+    and ``button_priority`` (index into ``PRIORITIES``).
+    """
+
+    def __init__(self, builder: "NodeTableBuilder"):
+        self.size = len(builder.type)
+        self.ids = builder.ids
+        self.frame_ids = builder.frame_ids
+        self.text_samples = builder.text_samples
+
+        self.type = np.frombuffer(builder.type, dtype=np.uint8)
+        self.parent = np.frombuffer(builder.parent, dtype=np.int32)
+        self.depth = np.frombuffer(builder.depth, dtype=np.int32)
+        self.frame = np.frombuffer(builder.frame, dtype=np.int32)
+
+        self.x = np.frombuffer(builder.x, dtype=np.float64)
+        self.y = np.frombuffer(builder.y, dtype=np.float64)
+        self.w = np.frombuffer(builder.w, dtype=np.float64)
+        self.h = np.frombuffer(builder.h, dtype=np.float64)
+
+        self.font_size = np.frombuffer(builder.font_size, dtype=np.float64)
+        self.font_weight = np.frombuffer(builder.font_weight, dtype=np.float64)
+
+        # style only counts on text nodes
+        is_text = self.type == TEXT_CODE
+        self.font_size = np.where(is_text, self.font_size, np.nan)
+        self.font_weight = np.where(is_text, self.font_weight, 400.0)
+
+        self.fill = builder.fill
+        self.has_fill = builder.has_fill
+        self.backdrop = builder.backdrop
+        self.backdrop_float = builder.backdrop_float
+
+        self.button_node = np.frombuffer(builder.button_node, dtype=np.int32)
+        self.button_box = np.frombuffer(builder.button_box, dtype=np.float64).reshape(-1, 4)
+        self.button_height = np.frombuffer(builder.button_height, dtype=np.float64)
+        self.button_priority = np.frombuffer(builder.button_priority, dtype=np.uint8)
+
+    def __len__(self):
+        return self.size
+
+    def is_type(self, *names: str):
+        """Boolean mask of rows whose type is one of ``names``."""
+        return np.isin(self.type, [TYPE_CODES[name] for name in names])
+
+    @classmethod
+    def from_document(cls, document: dict):
+        builder = NodeTableBuilder()
+        builder.walk(document)
+        return cls(builder.resolve())
+
+
+class NodeTableBuilder:
+    """Collects node features into compact ``array`` columns.
+
+    Rows are opened in pre-order with ``start`` and their fields filled in
+    by ``set`` as they become known, so the builder can be fed either from
+    an in-memory document (``walk``) or from a JSON event stream where a
+    node's ``fills`` or bounding box may only arrive after its children.
+    Everything that depends on ancestors or siblings (depth, frame,
+    backdrop, glyph colour, buttons) is derived afterwards by ``resolve``.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.frame_ids = []
+        self.text_samples = {}
+
+        # raw per-row fields
+        self.type = array("B")
+        self.parent = array("i")
+        self.priority = array("B")
+        self.x = array("d")
+        self.y = array("d")
+        self.w = array("d")
+        self.h = array("d")
+        self.has_box = array("B")
+        self.font_size = array("d")
+        self.font_weight = array("d")
+        self.opacity = array("d")
+        self.fills_state = array("B")  # 0: no fills key, 1: empty list, 2: has fills
+        self.paints = {}
+        self.background_colors = {}
+
+        # derived by resolve()
+        self.depth = array("i")
+        self.frame = array("i")
+        self.fill = None
+        self.has_fill = None
+        self.backdrop = None
+
+        self.button_node = array("i")
+        self.button_box = array("d")
+        self.button_height = array("d")
+        self.button_priority = array("B")
+
+    def __len__(self):
+        return len(self.type)
+
+    def start(self, parent: int):
+        """Open a new row under ``parent`` (-1 for the root) and return its index."""
+        self.ids.append(None)
+        self.type.append(0)
+        self.parent.append(parent)
+        self.priority.append(LOW_PRIORITY)
+        self.x.append(np.nan)
+        self.y.append(np.nan)
+        self.w.append(np.nan)
+        self.h.append(np.nan)
+        self.has_box.append(0)
+        self.font_size.append(np.nan)
+        self.font_weight.append(400)
+        self.opacity.append(1)
+        self.fills_state.append(0)
+        return len(self.type) - 1
+
+    def set(self, row: int, key: str, value):
+        """Record one node property; keys outside ``NODE_KEYS`` are ignored."""
+        if key == "id":
+            self.ids[row] = value
+        elif key == "type":
+            self.type[row] = TYPE_CODES.get(value, 0)
+        elif key == "name":
+            self.priority[row] = PRIORITY_CODES[classify_priority(value)]
+        elif key == "characters":
+            if value:
+                self.text_samples[row] = value.strip()[:TEXT_SAMPLE_LENGTH]
+        elif key == "opacity":
+            if value is not None:
+                self.opacity[row] = value
+        elif key == "style":
+            if value:
+                self.font_size[row] = value.get("fontSize") or np.nan
+                self.font_weight[row] = value.get("fontWeight") or 400
+        elif key == "fills":
+            if value is not None:
+                self.fills_state[row] = 2 if value else 1
+                paints = solid_paints(value)
+                if paints:
+                    self.paints[row] = paints
+        elif key == "backgroundColor":
+            if value:
+                self.background_colors[row] = value
+        elif key == "absoluteBoundingBox":
+            if value:
+                self.has_box[row] = 1
+                self.x[row] = value.get("x") or 0
+                self.y[row] = value.get("y") or 0
+                self.w[row] = value.get("width") or 0
+                self.h[row] = value.get("height") or 0
+
+    def walk(self, document: dict):
+        """Iterative pre-order walk that appends every node of an in-memory document.
+
+        Equivalent to ``start`` followed by ``set`` for every key in
+        ``NODE_KEYS``, with the column appends bound to locals since this
+        loop runs once per node.
+        """
+        ids, types, parents, priorities = self.ids.append, self.type.append, self.parent.append, self.priority.append
+        xs, ys, ws, hs, boxes = self.x.append, self.y.append, self.w.append, self.h.append, self.has_box.append
+        font_sizes, font_weights = self.font_size.append, self.font_weight.append
+        opacities, fills_states = self.opacity.append, self.fills_state.append
+        paints, background_colors, text_samples = self.paints, self.background_colors, self.text_samples
+        nan = np.nan
+
+        row = len(self.type)
+        stack = [(document, -1)]
+        while stack:
+            node, parent = stack.pop()
+            get = node.get
+
+            ids(get("id"))
+            types(TYPE_CODES.get(get("type"), 0))
+            parents(parent)
+            priorities(PRIORITY_CODES[classify_priority(get("name"))])
+
+            box = get("absoluteBoundingBox")
+            if box:
+                boxes(1)
+                xs(box.get("x") or 0)
+                ys(box.get("y") or 0)
+                ws(box.get("width") or 0)
+                hs(box.get("height") or 0)
+            else:
+                boxes(0)
+                xs(nan)
+                ys(nan)
+                ws(nan)
+                hs(nan)
+
+            style = get("style")
+            if style:
+                font_sizes(style.get("fontSize") or nan)
+                font_weights(style.get("fontWeight") or 400)
+            else:
+                font_sizes(nan)
+                font_weights(400)
+
+            opacity = get("opacity")
+            opacities(1 if opacity is None else opacity)
+
+            fills = get("fills")
+            if fills is not None:
+                fills_states(2 if fills else 1)
+                if fills:
+                    node_paints = solid_paints(fills)
+                    if node_paints:
+                        paints[row] = node_paints
+            else:
+                fills_states(0)
+                background = get("backgroundColor")
+                if background:
+                    background_colors[row] = background
+
+            characters = get("characters")
+            if characters:
+                text_samples[row] = characters.strip()[:TEXT_SAMPLE_LENGTH]
+
+            children = get("children")
+            if children:
+                stack.extend((child, row) for child in reversed(children))
+            row += 1
+
+    def _paints(self, row: int):
+        if self.fills_state[row]:
+            return self.paints.get(row, ())
+        background = self.background_colors.get(row)
+        return solid_paints(None, background) if background else ()
+
+    def resolve(self, backdrop=(1.0, 1.0, 1.0), depth: int = 0, frame_root: bool = False):
+        """Derive depth, top-level frame, backdrop, glyph colour and buttons.
+
+        One pass over the rows in pre-order: a parent row always precedes its
+        children, so ancestor state (depth, frame, backdrop) is ready when a
+        child is reached, and a parent's children are met in sibling order.
+        Backdrops are propagated top-down: a parent's own paint is composited
+        over its backdrop, then over any of the last ``SIBLING_BACKDROP_WINDOW``
+        painted earlier siblings whose box contains the child's centre.
+
+        By default row 0 is a document root on a white page. To resolve a
+        subtree on its own, pass the root's ``backdrop`` and ``depth`` in the
+        full document and set ``frame_root`` when the root is a top-level
+        frame; the result then matches the same rows of the whole document.
+        """
+        size = len(self.type)
+        parent, node_type, opacity = self.parent, self.type, self.opacity
+        x, y, w, h, has_box = self.x, self.y, self.w, self.h, self.has_box
+        ids, frame_ids, fills_state, all_paints = self.ids, self.frame_ids, self.fills_state, self.paints
+
+        depth = array("i", [depth]) * size
+        frame = array("i", [-1]) * size
+        backdrop_r = array("d", [backdrop[0]]) * size
+        backdrop_g = array("d", [backdrop[1]]) * size
+        backdrop_b = array("d", [backdrop[2]]) * size
+        # children of the root start frames, unless the root is a frame itself
+        frame_parent = 0
+        if frame_root and size:
+            frame[0] = len(frame_ids)
+            frame_ids.append(ids[0])
+            frame_parent = -1
+
+        # per parent row: [own paint, painted sibling rows, first rectangle row, has label]
+        siblings = {}
+        for i in range(1, size):
+            p = parent[i]
+            depth[i] = depth[p] + 1
+
+            if p == frame_parent or node_type[p] in CONTAINER_CODES:
+                frame[i] = len(frame_ids)
+                frame_ids.append(ids[i])
+            else:
+                frame[i] = frame[p]
+
+            state = siblings.get(p)
+            if state is None:
+                parent_backdrop = (backdrop_r[p], backdrop_g[p], backdrop_b[p])
+                state = siblings[p] = [composite(self._paints(p), opacity[p], parent_backdrop), [], -1, False]
+
+            color = state[0]
+            plates = state[1]
+            if plates and has_box[i]:
+                cx = x[i] + w[i] / 2
+                cy = y[i] + h[i] / 2
+                for q in plates[-SIBLING_BACKDROP_WINDOW:]:
+                    if x[q] <= cx <= x[q] + w[q] and y[q] <= cy <= y[q] + h[q]:
+                        color = composite(all_paints[q], opacity[q], color)
+            backdrop_r[i], backdrop_g[i], backdrop_b[i] = color
+
+            t = node_type[i]
+            if has_box[i] and t != TEXT_CODE and fills_state[i] == 2:
+                plates.append(i)
+            if t == RECTANGLE_CODE:
+                if state[2] < 0 and has_box[i]:
+                    state[2] = i
+            elif t in LABEL_CODES:
+                state[3] = True
+
+        self.depth = depth
+        self.frame = frame
+
+        backdrop = np.stack(
+            [np.frombuffer(backdrop_r), np.frombuffer(backdrop_g), np.frombuffer(backdrop_b)], axis=1
+        )
+        fill = backdrop.copy()
+        has_fill = np.zeros(size, dtype=bool)
+        for i, paints in self.paints.items():
+            if node_type[i] == TEXT_CODE:
+                fill[i] = glyph_color(paints, opacity[i], (backdrop_r[i], backdrop_g[i], backdrop_b[i]))
+                has_fill[i] = True
+        self.backdrop_float = backdrop
+        # truncate like figma_color_to_rgb
+        self.backdrop = (backdrop * 255).astype(np.uint8)
+        self.fill = (fill * 255).astype(np.uint8)
+        self.has_fill = has_fill
+
+        for p in sorted(siblings):
+            rect, has_label = siblings[p][2], siblings[p][3]
+            if node_type[p] not in BUTTON_CODES or rect < 0 or not has_label:
+                continue
+            if w[rect] >= 24 and h[rect] >= 24:
+                self.button_node.append(p)
+                self.button_box.extend((x[rect], y[rect], x[rect] + w[rect], y[rect] + h[rect]))
+                self.button_height.append(h[rect])
+                self.button_priority.append(self.priority[p])
+
+        return self
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+import orjson
+from fastapi import HTTPException, Request
+
+# raw bodies are refused as soon as they are known to be bigger than this
+RAW_MAX_BYTES = int(os.getenv("ANALYSIS_RAW_MAX_BYTES", str(256 * 1024 * 1024)))
+# documents with more nodes are refused before their nodes are analysed
+RAW_MAX_NODES = int(os.getenv("ANALYSIS_RAW_MAX_NODES", "2000000"))
+
+
+class DocumentRejected(ValueError):
+    """A raw Figma body that is not JSON or exceeds a limit, with the HTTP status to answer with."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(status, detail)
+        self.status = status
+        self.detail = detail
+
+
+def too_many_nodes(max_nodes: int):
+    return DocumentRejected(413, f"Figma document has more than {max_nodes} nodes")
+
+
+def decode_json(body: bytes):
+    """Decode a JSON body with orjson; raises ``DocumentRejected`` (400) if it is not JSON."""
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise DocumentRejected(400, f"Invalid JSON body: {e}") from e
+
+
+def check_node_limit(document: dict, max_nodes: int):
+    """Raise ``DocumentRejected`` (413) as soon as ``document`` turns out to have more than ``max_nodes`` nodes."""
+    count = 0
+    stack = [document]
+    while stack:
+        count += 1
+        if count > max_nodes:
+            raise too_many_nodes(max_nodes)
+        children = stack.pop().get("children")
+        if children:
+            stack.extend(children)
+
+
+def _check_length(request: Request, max_bytes: int):
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise HTTPException(413, f"Request body is larger than {max_bytes} bytes")
+
+
+async def read_body(request: Request, max_bytes: int = RAW_MAX_BYTES):
+    """The request body, refused with 413 once more than ``max_bytes`` have arrived."""
+    _check_length(request, max_bytes)
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(413, f"Request body is larger than {max_bytes} bytes")
+        chunks.append(chunk)
+    if not size:
+        raise HTTPException(400, "Request body is empty")
+    return b"".join(chunks)
+
+
+async def spool_body(request: Request, max_bytes: int = RAW_MAX_BYTES):
+    """Write the request body to a temp file as it arrives, with the limits of ``read_body``.
+
+    Returns the path of the file, which the caller removes.
+    """
+    _check_length(request, max_bytes)
+    fd, path = tempfile.mkstemp(prefix="analysis-upload-", suffix=".json")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(413, f"Request body is larger than {max_bytes} bytes")
+                spool.write(chunk)
+        if not size:
+            raise HTTPException(400, "Request body is empty")
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+
+
+def cache_key(document_key: str, device: str, ruleset_version: str):
+    """Digest identifying one analysis: document version, device and ruleset."""
+    return hashlib.sha256(f"{document_key}|{device}|{ruleset_version}".encode()).hexdigest()
+
+
+def file_version_key(file_key: str, version: str = None, last_modified: str = None, node_ids=None, depth: int = None):
+    """Document key of a Figma file revision, or None when the revision is unknown.
+
+    An import of only some nodes (``node_ids``, cut at ``depth``) is a
+    document of its own and gets its own key.
+    """
+    if not file_key or not (version or last_modified):
+        return None
+    key = f"file:{file_key}@{version or last_modified}"
+    if node_ids:
+        key += f"#nodes={','.join(node_ids)}"
+        if depth:
+            key += f";depth={depth}"
+    return key
+
+
+def content_key(digest: str):
+    """Document key of an inline payload, from the sha256 of the JSON it is persisted as."""
+    return f"sha256:{digest}"
+
+
+class ResultCache:
+    """Thread-safe in-process LRU of analysis responses with a TTL.
+
+    Entries older than ``ttl`` seconds are dropped when they are looked up;
+    once ``maxsize`` is reached the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+result_cache = ResultCache()
@@ -0,0 +1,87 @@
+import hashlib
+from functools import lru_cache
+
+import orjson
+
+# part of every cache key; bump whenever a rule changes
+RULESET_VERSION = "4"
+
+DEFAULT_THRESHOLDS = {
+    # minimum button height per priority
+    "button_size": {"high": 72, "medium": 60, "low": 48},
+    # recommended gap between neighbouring buttons per priority
+    "button_spacing": {"high": [12, 24], "medium": [24, 40], "low": [32, 48]},
+    "contrast": {"normal": 4.5, "large": 3.0},
+    "font_size": {
+        "desktop": {"min": 14, "ideal": [14, 17]},
+        "mobile": {"min": 11, "ideal": [15, 17]},
+    },
+    # minimum sizes, and the gap kept between the hit areas of neighbouring buttons
+    "touch_target": {"control": 44, "text": 30, "spacing": 8},
+    "layout_depth": {"max": 3},
+}
+
+
+def _merge(defaults, overrides, path: str):
+    """``overrides`` laid over ``defaults``; raises ValueError on anything the defaults lack."""
+    if isinstance(defaults, dict):
+        if not isinstance(overrides, dict):
+            raise ValueError(f"{path} must be an object")
+        unknown = [key for key in overrides if key not in defaults]
+        if unknown:
+            raise ValueError(f"Unknown threshold: {path}.{unknown[0]}")
+        return {key: _merge(value, overrides.get(key, value), f"{path}.{key}") for key, value in defaults.items()}
+
+    if isinstance(defaults, list):
+        if not isinstance(overrides, (list, tuple)) or len(overrides) != 2:
+            raise ValueError(f"{path} must be a [min, max] range")
+        low, high = (_merge(defaults[0], overrides[0], path), _merge(defaults[1], overrides[1], path))
+        if low > high:
+            raise ValueError(f"{path} must be a [min, max] range")
+        return [low, high]
+
+    if isinstance(overrides, bool) or not isinstance(overrides, (int, float)) or overrides <= 0:
+        raise ValueError(f"{path} must be a positive number")
+    return overrides
+
+
+class RuleSet:
+    """The thresholds of one rule profile.
+
+    ``version`` is ``RULESET_VERSION`` for the default thresholds and gets
+    a digest of the thresholds appended otherwise, so results cached or
+    stored under one profile are never served for another.
+    """
+
+    def __init__(self, thresholds: dict):
+        self.thresholds = thresholds
+        self.version = RULESET_VERSION
+        if thresholds != DEFAULT_THRESHOLDS:
+            digest = hashlib.sha256(self.to_json().encode()).hexdigest()
+            self.version = f"{RULESET_VERSION}-{digest[:16]}"
+
+    def __eq__(self, other):
+        return isinstance(other, RuleSet) and other.version == self.version
+
+    def __hash__(self):
+        return hash(self.version)
+
+    def __getitem__(self, section: str):
+        return self.thresholds[section]
+
+    def to_json(self):
+        return orjson.dumps(self.thresholds, option=orjson.OPT_SORT_KEYS).decode()
+
+    @classmethod
+    def from_overrides(cls, overrides: dict = None):
+        """Default thresholds with ``overrides`` (any subset of the sections) applied."""
+        return cls(_merge(DEFAULT_THRESHOLDS, overrides or {}, "thresholds"))
+
+
+@lru_cache(maxsize=256)
+def load_ruleset(thresholds_json: str):
+    """Rule set of a stored profile, built once per distinct profile."""
+    return RuleSet.from_overrides(orjson.loads(thresholds_json))
+
+
+DEFAULT_RULESET = RuleSet(DEFAULT_THRESHOLDS)
@@ -1,21 +1,123 @@
-import json
+import base64
 import os
-from datetime import datetime
-
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+import ijson
 import requests
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session, defer, load_only
 
 from src.database.models.Analysis import Analysis
+from src.database.models.RuleProfile import RuleProfile
+from src.services.AnalysisEngine import DEVICES, ISSUE_CODES, AnalysisEngine, checklist, group_issues
+from src.services.AnalysisPool import analysis_pool
+from src.services.Colors import figma_color_to_rgb
+from src.services.Diagnostics import DIAGNOSTICS_ENABLED, NO_DIAGNOSTICS, Diagnostics, service_metrics
+from src.services.FastJSON import dump_bytes, dumps, loads
+from src.services.BlobStore import blob_digest, blob_store
+from src.services.FigmaStream import SpoolReader, SpoolWriter, node_table_from_stream
+from src.services.NodeTable import button_rect, is_large_text
+from src.services.RawBody import RAW_MAX_NODES, DocumentRejected
+from src.services.ResultCache import cache_key, content_key, file_version_key, result_cache
+from src.services.RuleSet import DEFAULT_RULESET, RuleSet, load_ruleset
 
 FIGMA_SERVICE_URL = os.getenv("FIGMA_SERVICE_URL", "http://figma-service:6702/api/v1")
 PROJECTS_SERVICE_URL = os.getenv("PROJECTS_SERVICE_URL", "http://project-service:6701/api/v1")
 PROJECTS_SERVICE_FALLBACK = "http://project-service:6701/api/v1"
 
+# issues kept in a row and its response; the full list is stored as a blob beyond that
+ISSUE_LIMIT = int(os.getenv("ANALYSIS_ISSUE_LIMIT", "200"))
+# node ids kept per issue group
+ISSUE_SAMPLE_SIZE = int(os.getenv("ANALYSIS_ISSUE_SAMPLE_SIZE", "10"))
+
+# recommendation per issue code, filled in from the issue group
+RECOMMENDATIONS = {
+    "font_size": "Increase font size to at least {threshold}px (currently {worst}px).",
+    "contrast": 'Improve color contrast to ≥ {threshold}:1 for text "{text_sample}"{more}.',
+    "button_height": "Increase button height to at least {threshold}px (currently {worst}px).",
+    "touch_target": "Increase touch target size to minimum {threshold}px.",
+    "touch_overlap": "Separate overlapping touch targets so their hit areas are at least {threshold}px apart.",
+    "touch_spacing": "Keep at least {threshold}px between touch targets (currently {worst}px).",
+    "layout_depth": "Reduce layout nesting depth to ≤ {threshold}.",
+}
+
+BATCH_CONCURRENCY = int(os.getenv("ANALYSIS_BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("ANALYSIS_BATCH_MAX_ITEMS", "1000"))
+
+# queued jobs are owned by the replica that runs them; set this when replicas share a hostname
+JOB_OWNER = os.getenv("ANALYSIS_INSTANCE_ID") or socket.gethostname()
+# jobs of other replicas still processing after this many seconds are taken as interrupted
+JOB_STALE_AFTER = float(os.getenv("ANALYSIS_JOB_STALE_AFTER", "3600"))
+
+ALL_DEVICES = "all"
+
+# Analysis columns a cache hit is served from and copied into its own row
+CACHED_FIELDS = ("cache_key", "results_json", "summary", "opinion", "recomendation", "raw_data_hash", "issues_hash")
+
+# metric columns of a row: (metric, key) they are read from and how a day's values are aggregated
+METRIC_COLUMNS = {
+    "min_contrast": (("contrast_ratio", "min_ratio"), func.min),
+    "min_font_size": (("font_size", "min_detected"), func.min),
+    "min_button_height": (("button_size", "min_detected"), func.min),
+    "min_button_spacing": (("button_spacing", "min_spacing"), func.min),
+    "min_touch_target": (("touch_target", "min_detected"), func.min),
+    "avg_depth": (("layout_depth", "avg_depth"), func.avg),
+    "issue_count": (None, func.max),
+}
+
+HISTORY_MAX_LIMIT = 100
+# columns listed by the history endpoint; raw data and results are never loaded for it
+HISTORY_FIELDS = ("id", "analysis_id", "device", "summary", "opinion", "created_at", *METRIC_COLUMNS)
+
+
+def metric_fields(analysis_result: dict):
+    """Values of the ``METRIC_COLUMNS`` of an analysis result."""
+    metrics = analysis_result.get("metrics") or {}
+    fields = {}
+    for column, (path, _) in METRIC_COLUMNS.items():
+        if path is None:
+            fields[column] = analysis_result.get("issue_count", len(analysis_result.get("issues") or []))
+        else:
+            metric, key = path
+            fields[column] = (metrics.get(metric) or {}).get(key)
+    return fields
+
+
+def figma_node_ids(figma_url: str = None, node_ids: list = None):
+    """Node ids to import instead of the whole file: ``node_ids``, else the ``node-id`` of ``figma_url``.
+
+    Ids are returned in the form of the Figma API ("1:2" rather than the
+    "1-2" of share links) without repeats, or None for the whole file.
+    """
+    if not node_ids and figma_url:
+        query = parse_qs(urlparse(figma_url).query)
+        node_ids = query.get("node-id") or query.get("node_id")
+    ids = [node_id.strip().replace("-", ":") for node_id in node_ids or [] if node_id and node_id.strip()]
+    return list(dict.fromkeys(ids)) or None
+
+
+def resolve_devices(device):
+    """Normalise a device name, a list of them or ``"all"`` to a list without repeats."""
+    if device == ALL_DEVICES:
+        return list(DEVICES)
+    devices = [device] if isinstance(device, str) else list(dict.fromkeys(device))
+    unknown = [d for d in devices if d not in DEVICES]
+    if unknown or not devices:
+        raise HTTPException(400, f"Unsupported device: {', '.join(unknown) or 'none given'}")
+    return devices
+
 
 class Services:
     def __init__(self, db: Session):
         self.db = db
+        # batch workers share the session for cache lookups, one at a time
+        self._db_lock = threading.Lock()
 
     # ======================================================
     #                RUN ANALYSIS ENTRYPOINT
@@ -23,23 +125,160 @@ class Services:
     def run_analysis(
         self,
         project_id: int,
-        device: str,
+        device,
+        figma_data: dict = None,
+        token: str = None,
+        figma_url: str = None,
+        stream: bool = False,
+        use_cache: bool = True,
+        analysis_id: str = None,
+        import_timeout: float = 10,
+        diagnostics: bool = False,
+        node_ids: list = None,
+        node_depth: int = None,
+        raw_body=None,
+    ):
+        """Analyse a project for one device, or for several from a single import.
+
+        ``device`` is a device name, a list of them or ``"all"``. A single
+        device returns its analysis; several return ``{"project_id",
+        "analyses"}`` with one analysis (and one stored row) per device.
+        With ``node_ids`` (or a ``node-id`` in ``figma_url``) only those
+        nodes are imported and analysed, ``node_depth`` levels deep.
+        ``raw_body`` is Figma JSON as received: bytes, or a binary file
+        that is parsed incrementally.
+        With ``diagnostics`` the response also carries the stage timings
+        and counters of this run, which are never stored or cached.
+        """
+        devices = resolve_devices(device)
+        # a queued job passes the id of its "processing" row, which is then completed in place
+        queued = analysis_id is not None
+        analysis_id = analysis_id or self._new_analysis_id(project_id)
+        recorder = self._diagnostics(diagnostics)
+
+        try:
+            outcomes = self._compute_analysis(
+                project_id,
+                devices,
+                analysis_id,
+                figma_data=figma_data,
+                token=token,
+                figma_url=figma_url,
+                stream=stream,
+                use_cache=use_cache,
+                import_timeout=import_timeout,
+                diagnostics=recorder,
+                node_ids=node_ids,
+                node_depth=node_depth,
+                raw_body=raw_body,
+            )
+        except DocumentRejected as e:
+            raise HTTPException(e.status, e.detail)
+
+        responses = []
+        with recorder.stage("db_write"):
+            for index, (fields, response) in enumerate(outcomes):
+                row_id = analysis_id if index == 0 else self._new_analysis_id(project_id)
+                self._store_analysis(row_id, project_id, queued and index == 0, **fields)
+                self._remember_result(fields, response)
+                recorder.count("response_bytes", len(fields["response_json"]))
+                responses.append(response)
+        service_metrics.record(recorder)
+
+        if isinstance(device, str) and device != ALL_DEVICES:
+            response = responses[0]
+        else:
+            response = {"project_id": project_id, "analyses": responses}
+        if diagnostics:
+            response = {**response, "diagnostics": recorder.to_dict()}
+        return response
+
+    @staticmethod
+    def _diagnostics(requested: bool = False):
+        """Recorder for one analysis: real when requested or enabled service-wide, a no-op otherwise."""
+        return Diagnostics() if requested or DIAGNOSTICS_ENABLED else NO_DIAGNOSTICS
+
+    def _compute_analysis(
+        self,
+        project_id: int,
+        devices: list,
+        analysis_id: str,
         figma_data: dict = None,
         token: str = None,
         figma_url: str = None,
+        stream: bool = False,
+        use_cache: bool = True,
+        import_timeout: float = 10,
+        ruleset: RuleSet = None,
+        diagnostics: Diagnostics = NO_DIAGNOSTICS,
+        node_ids: list = None,
+        node_depth: int = None,
+        raw_body=None,
+        reuse: bool = None,
     ):
+        """Import and analyse a document for each device without writing to the database.
+
+        The document is imported and its nodes extracted once; every device
+        profile is then evaluated against the same node table. Returns one
+        ``(Analysis column values, API response)`` pair per device, in the
+        order of ``devices``, so a caller can store one row or many at once.
+        Stage timings and counters are recorded in ``diagnostics``. Frame
+        partials are reused when ``reuse`` is set, and by default when the
+        project was analysed before.
+        """
+        node_table = None
+        # the JSON the pool analyses, and the part of it that is kept as raw data
+        body = None
+        imported = False
+        raw_bytes = None
+        raw_data_hash = None
+        document_key = None
+        max_nodes = None
+        outcomes = {}
+        ruleset = ruleset or self.get_ruleset(project_id)
+        # a link stored on the project is analysed whole; only a node-id the caller passed scopes it
+        node_ids = figma_node_ids(figma_url, node_ids)
+        if figma_data and node_ids:
+            raise HTTPException(400, "node_ids select nodes of a Figma import and cannot be used with figma_data")
 
         resolved_figma_url = figma_url
-        if not figma_data and not resolved_figma_url:
+        if not figma_data and raw_body is None and not resolved_figma_url:
             resolved_figma_url = self._get_project_figma_url(project_id, token)
 
+        # ---------------------------------------------
+        # CASE 0 — Figma JSON as the request body, never validated by pydantic
+        # ---------------------------------------------
+        if raw_body is not None:
+            max_nodes = RAW_MAX_NODES
+            if isinstance(raw_body, bytes):
+                body = raw_bytes = raw_body
+                raw_data_hash = blob_digest(raw_bytes)
+            else:
+                # the digest is only known once the body has been read, so the cache is checked after parsing
+                node_table, raw_data_hash, _ = self._stream_document(
+                    raw_body, analysis_id, diagnostics, imported=False, max_nodes=max_nodes
+                )
+            document_key = content_key(raw_data_hash)
+            with diagnostics.stage("cache_lookup"):
+                if use_cache and self._collect_cached(project_id, devices, document_key, ruleset, outcomes):
+                    return [outcomes[device] for device in devices]
+            # the body is decoded, and its nodes counted, where it is analysed
+
         # ---------------------------------------------
         # CASE 1 — user gives raw figma_data directly
         # ---------------------------------------------
-        if figma_data:
+        elif figma_data:
             if not isinstance(figma_data, dict):
                 raise HTTPException(status_code=400, detail="Invalid figma_data payload")
 
+            with diagnostics.stage("serialize"):
+                body = raw_bytes = dump_bytes(figma_data)
+                raw_data_hash = blob_digest(raw_bytes)
+            document_key = content_key(raw_data_hash)
+            with diagnostics.stage("cache_lookup"):
+                if use_cache and self._collect_cached(project_id, devices, document_key, ruleset, outcomes):
+                    return [outcomes[device] for device in devices]
+
         # ---------------------------------------------
         # CASE 2 — user gives figma_url → call figma-service
         # ---------------------------------------------
@@ -48,15 +287,27 @@ class Services:
                 raise HTTPException(401, "Authorization token required when using figma_url")
 
             payload = {"file_url": resolved_figma_url}
+            if node_ids:
+                payload.update(node_ids=node_ids, depth=node_depth)
             headers = {"Authorization": f"Bearer {token}"}
 
+            # an unchanged file revision is answered without importing it again; what is
+            # imported is stored under the revision it came with, which may be newer
+            if use_cache:
+                with diagnostics.stage("cache_lookup"):
+                    document_key = self._get_file_version_key(payload, headers)
+                    if document_key and self._collect_cached(project_id, devices, document_key, ruleset, outcomes):
+                        return [outcomes[device] for device in devices]
+
             try:
-                res = requests.post(
-                    f"{FIGMA_SERVICE_URL}/figma/import",
-                    json=payload,
-                    headers=headers,
-                    timeout=10,
-                )
+                with diagnostics.stage("import"):
+                    res = requests.post(
+                        f"{FIGMA_SERVICE_URL}/figma/import",
+                        json=payload,
+                        headers=headers,
+                        timeout=import_timeout,
+                        stream=stream,
+                    )
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Could not reach figma-service: {e}")
 
@@ -66,50 +317,392 @@ class Services:
                     detail=f"Figma import failed: {res.text}"
                 )
 
-            project_data = res.json().get("project")
-            if not project_data:
-                raise HTTPException(500, "Figma import did not return project data")
-
-            figma_data = project_data.get("project") or project_data
+            if stream:
+                res.raw.decode_content = True
+                try:
+                    node_table, raw_data_hash, fields = self._stream_document(res.raw, analysis_id, diagnostics)
+                finally:
+                    res.close()
+                document_key = file_version_key(
+                    fields.get("file_key"),
+                    fields.get("version"),
+                    fields.get("last_modified"),
+                    payload.get("node_ids"),
+                    payload.get("depth"),
+                )
+            else:
+                # decoded where it is analysed, which keeps the Figma file inside as the raw data
+                body = res.content
+                imported = True
 
         else:
             raise HTTPException(400, "You must provide either figma_data or figma_url")
 
-        # Run the core analysis engine
-        analysis_result = self._analyze_figma_data(figma_data, device)
-        conclusions = self._generate_conclusions(analysis_result)
+        # Run the core analysis engine for every device not served from the cache
+        pending = [device for device in devices if device not in outcomes]
+        # frame partials are only stored for projects that are analysed again
+        if node_table is not None:
+            reuse = False
+        elif reuse is None:
+            reuse = self._analysed_before(project_id)
+        with diagnostics.stage("analysis"):
+            if node_table is not None:
+                results = AnalysisEngine.evaluate_devices(node_table, pending, ruleset, diagnostics)
+            else:
+                analysed = analysis_pool.analyze(
+                    body,
+                    pending,
+                    ruleset=ruleset,
+                    diagnostics=diagnostics,
+                    reuse=reuse,
+                    figma_data=figma_data,
+                    max_nodes=max_nodes,
+                    imported=imported,
+                )
+                results = analysed["results"]
+        if imported:
+            raw_data_hash = analysed["import"]["raw_data_hash"]
+            document_key = analysed["import"]["document_key"]
+            diagnostics.count("raw_bytes", analysed["import"]["raw_bytes"])
+
+        if raw_bytes is not None:
+            with diagnostics.stage("persist_raw"):
+                blob_store.put(raw_bytes, raw_data_hash)
+            diagnostics.count("raw_bytes", len(raw_bytes))
+
+        with diagnostics.stage("conclusions"):
+            for device in pending:
+                outcomes[device] = self._new_result(
+                    project_id, device, results[device], document_key, raw_data_hash, ruleset, node_ids
+                )
+                diagnostics.count("issues", len(results[device]["issues"]))
+        return [outcomes[device] for device in devices]
 
-        # Save to DB
-        analysis = Analysis(
-            analysis_id=f"A-{project_id}-{int(datetime.utcnow().timestamp())}",
-            project_id=str(project_id),
+    def _new_result(
+        self,
+        project_id: int,
+        device: str,
+        analysis_result: dict,
+        document_key: str,
+        raw_data_hash: str,
+        ruleset: RuleSet = DEFAULT_RULESET,
+        node_ids: list = None,
+    ):
+        issues = analysis_result["issues"]
+        groups = group_issues(issues, ISSUE_SAMPLE_SIZE)
+        conclusions = self._generate_conclusions(analysis_result, groups)
+
+        # rows and responses keep the first ISSUE_LIMIT issues; GET .../issues streams all of them
+        stored = dict(
+            analysis_result,
+            issues=issues[:ISSUE_LIMIT],
+            issue_count=len(issues),
+            issue_groups=groups,
+            node_ids=node_ids,
+        )
+        issues_hash = None
+        if len(issues) > ISSUE_LIMIT:
+            issues_hash = blob_store.put(dump_bytes(issues))
+
+        fields = dict(
             status="completed",
+            cache_key=cache_key(document_key, device, ruleset.version) if document_key else None,
 
-            results_json=json.dumps(analysis_result),
-            raw_data=json.dumps(figma_data),
+            results_json=dumps(stored),
+            raw_data_hash=raw_data_hash,
+            issues_hash=issues_hash,
 
             summary=conclusions["summary"],
             opinion=conclusions["opinion"],
-            recomendation=json.dumps(conclusions["recommendations"]),
-
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow(),
+            recomendation=dumps(conclusions["recommendations"]),
         )
 
-        self.db.add(analysis)
-        self.db.commit()
-        self.db.refresh(analysis)
-
-        return {
+        return self._with_response_body(fields, {
             "project_id": project_id,
             "device": device,
             "summary": conclusions["summary"],
             "opinion": conclusions["opinion"],
             "recommendations": conclusions["recommendations"],
             "metrics": analysis_result["metrics"],
-            "issues": analysis_result["issues"],
+            **self._issue_fields(stored),
+            "node_ids": node_ids,
+            "cache_hit": False,
+        })
+
+    @staticmethod
+    def _issue_fields(results: dict):
+        """Capped issues, total and groups of stored results; rows from before issue codes have no groups."""
+        return {
+            "issues": results["issues"],
+            "issue_count": results.get("issue_count", len(results["issues"])),
+            "issue_groups": results.get("issue_groups", []),
         }
 
+    @staticmethod
+    def response_body(response: dict):
+        """JSON of a stored analysis as ``GET /analysis/{project_id}`` serves it."""
+        return dumps({**response, "cache_hit": False})
+
+    def _with_response_body(self, fields: dict, response: dict):
+        """Add the row's device, metric columns and pre-serialised response to its fields."""
+        fields = dict(
+            fields,
+            device=response["device"],
+            response_json=self.response_body(response),
+            **metric_fields(response),
+        )
+        return fields, response
+
+    # ======================================================
+    #             BATCH ANALYSIS OF MANY PROJECTS
+    # ======================================================
+    def run_batch(self, items: list, token: str = None, use_cache: bool = True):
+        """Analyse many (project, device) items concurrently and store them in one insert.
+
+        Items of the same project are grouped, so its link is looked up and
+        its document imported once for all of its devices. Groups run on at
+        most ``BATCH_CONCURRENCY`` threads (the CPU part goes to the analysis
+        pool). Failures are reported per item and do not stop the batch.
+        """
+        if len(items) > BATCH_MAX_ITEMS:
+            raise HTTPException(413, f"A batch may contain at most {BATCH_MAX_ITEMS} items")
+
+        groups = {}
+        for item in items:
+            groups.setdefault((item["project_id"], item.get("figma_url")), []).append(item["device"])
+        rulesets = self.get_rulesets({project_id for project_id, _ in groups})
+        analysed = self._analysed_projects({project_id for project_id, _ in groups})
+
+        def analyse(group):
+            (project_id, figma_url), devices = group
+            devices = list(dict.fromkeys(devices))
+            recorder = self._diagnostics()
+            try:
+                analysis_id = self._new_analysis_id(project_id)
+                outcomes = self._compute_analysis(
+                    project_id,
+                    devices,
+                    analysis_id,
+                    token=token,
+                    figma_url=figma_url,
+                    use_cache=use_cache,
+                    ruleset=rulesets[project_id],
+                    diagnostics=recorder,
+                    reuse=project_id in analysed,
+                )
+                service_metrics.record(recorder)
+            except Exception as e:
+                rejected = isinstance(e, (HTTPException, DocumentRejected))
+                error = str(e.detail) if rejected else f"Internal error: {e}"
+                return {device: (None, {"status": "failed", "error": error}) for device in devices}
+
+            return {
+                device: (fields, {"status": "completed", "result": response})
+                for device, (fields, response) in zip(devices, outcomes)
+            }
+
+        with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+            grouped = dict(zip(groups, executor.map(analyse, groups.items())))
+
+        rows = []
+        for (project_id, _), by_device in grouped.items():
+            for fields, outcome in by_device.values():
+                if fields is not None:
+                    rows.append(Analysis(
+                        analysis_id=self._new_analysis_id(project_id),
+                        project_id=project_id,
+                        created_at=datetime.utcnow(),
+                        updated_at=datetime.utcnow(),
+                        **fields,
+                    ))
+                    self._remember_result(fields, outcome["result"])
+
+        # one flush, sent as a multi-row INSERT
+        self.db.add_all(rows)
+        self.db.commit()
+
+        results = []
+        for item in items:
+            _, outcome = grouped[(item["project_id"], item.get("figma_url"))][item["device"]]
+            results.append({"project_id": item["project_id"], "device": item["device"], **outcome})
+        return {"results": results}
+
+    def _analysed_before(self, project_id: int):
+        """Whether the project has a completed analysis."""
+        with self._db_lock:
+            return (
+                self.db.query(Analysis.id)
+                .filter(Analysis.project_id == project_id, Analysis.status == "completed")
+                .first()
+                is not None
+            )
+
+    def _analysed_projects(self, project_ids):
+        """The ones of ``project_ids`` with a completed analysis, in one query."""
+        with self._db_lock:
+            rows = (
+                self.db.query(Analysis.project_id)
+                .filter(Analysis.project_id.in_(list(project_ids)), Analysis.status == "completed")
+                .distinct()
+                .all()
+            )
+        return {project_id for project_id, in rows}
+
+    def _new_analysis_id(self, project_id: int):
+        return f"A-{project_id}-{int(datetime.utcnow().timestamp())}-{uuid4().hex[:8]}"
+
+    def _store_analysis(self, analysis_id: str, project_id: int, queued: bool, **fields):
+        """Insert the analysis row, or fill in the queued job row with this id."""
+        analysis = None
+        if queued:
+            analysis = self.db.query(Analysis).filter(Analysis.analysis_id == analysis_id).first()
+        if analysis is None:
+            analysis = Analysis(analysis_id=analysis_id, project_id=project_id, created_at=datetime.utcnow())
+
+        for name, value in fields.items():
+            setattr(analysis, name, value)
+        analysis.updated_at = datetime.utcnow()
+
+        self.db.add(analysis)
+        self.db.commit()
+        self.db.refresh(analysis)
+        return analysis
+
+    # ======================================================
+    #                 ASYNCHRONOUS ANALYSIS JOBS
+    # ======================================================
+    def create_job(self, project_id: int, device: str = None):
+        """Persist a ``processing`` row for a queued analysis and return its id."""
+        analysis = Analysis(
+            analysis_id=self._new_analysis_id(project_id),
+            project_id=project_id,
+            device=device,
+            status="processing",
+            owner=JOB_OWNER,
+            created_at=datetime.utcnow(),
+            updated_at=datetime.utcnow(),
+        )
+        self.db.add(analysis)
+        self.db.commit()
+        return analysis.analysis_id
+
+    def fail_job(self, analysis_id: str, error: str):
+        self.db.rollback()
+        analysis = self.db.query(Analysis).filter(Analysis.analysis_id == analysis_id).first()
+        if not analysis:
+            return
+        analysis.status = "failed"
+        analysis.error = error
+        analysis.updated_at = datetime.utcnow()
+        self.db.commit()
+
+    def fail_interrupted_jobs(self, owner: str = JOB_OWNER, stale_after: float = JOB_STALE_AFTER):
+        """Mark jobs left ``processing`` by a previous run of this replica as failed.
+
+        Jobs of other replicas may still be running; they are only failed
+        once they have not been updated for ``stale_after`` seconds.
+        """
+        stale = datetime.utcnow() - timedelta(seconds=stale_after)
+        self.db.query(Analysis).filter(
+            Analysis.status == "processing",
+            or_(Analysis.owner == owner, Analysis.updated_at < stale),
+        ).update(
+            {"status": "failed", "error": "Interrupted by a service restart", "updated_at": datetime.utcnow()}
+        )
+        self.db.commit()
+
+    def get_job(self, analysis_id: str):
+        analysis = (
+            self.db.query(Analysis)
+            .options(defer(Analysis.raw_data))
+            .filter(Analysis.analysis_id == analysis_id)
+            .first()
+        )
+        if not analysis:
+            return None
+
+        return {
+            "job_id": analysis.analysis_id,
+            "project_id": int(analysis.project_id),
+            "status": analysis.status,
+            "error": analysis.error,
+            "result": self._analysis_response(analysis) if analysis.status == "completed" else None,
+        }
+
+    def _remember_result(self, fields: dict, response: dict):
+        if fields["cache_key"] and not response["cache_hit"]:
+            result_cache.put(fields["cache_key"], {name: fields[name] for name in CACHED_FIELDS})
+
+    # ======================================================
+    #                 RESULT CACHE LOOKUPS
+    # ======================================================
+    def _get_file_version_key(self, payload: dict, headers: dict):
+        """Ask figma-service for the file revision; None if it cannot tell."""
+        try:
+            res = requests.post(
+                f"{FIGMA_SERVICE_URL}/figma/version",
+                json=payload,
+                headers=headers,
+                timeout=5,
+            )
+        except Exception:
+            return None
+
+        if res.status_code != 200:
+            return None
+
+        data = res.json()
+        return file_version_key(
+            data.get("file_key"),
+            data.get("version"),
+            data.get("last_modified"),
+            payload.get("node_ids"),
+            payload.get("depth"),
+        )
+
+    def _collect_cached(self, project_id: int, devices: list, document_key: str, ruleset: RuleSet, outcomes: dict):
+        """Fill ``outcomes`` with cached results per device; True when every device was found."""
+        for device in devices:
+            cached = self._get_cached_result(cache_key(document_key, device, ruleset.version))
+            if cached:
+                outcomes[device] = self._cache_hit(project_id, cached)
+        return len(outcomes) == len(devices)
+
+    def _get_cached_result(self, key: str):
+        """Stored fields of a completed analysis with this cache key, in-process cache first."""
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+        with self._db_lock:
+            analysis = (
+                self.db.query(Analysis)
+                .filter(Analysis.cache_key == key, Analysis.status == "completed")
+                .order_by(Analysis.created_at.desc())
+                .first()
+            )
+        if not analysis:
+            return None
+
+        cached = {name: getattr(analysis, name) for name in CACHED_FIELDS}
+        result_cache.put(key, cached)
+        return cached
+
+    def _cache_hit(self, project_id: int, cached: dict):
+        """Row fields and response for a reused result; the row still becomes the latest analysis."""
+        parsed = loads(cached["results_json"])
+        return self._with_response_body({"status": "completed", **cached}, {
+            "project_id": project_id,
+            "device": parsed["device"],
+            "summary": cached["summary"],
+            "opinion": cached["opinion"],
+            "recommendations": loads(cached["recomendation"]),
+            "metrics": parsed["metrics"],
+            **self._issue_fields(parsed),
+            "node_ids": parsed.get("node_ids"),
+            "cache_hit": True,
+        })
+
     def _get_project_figma_url(self, project_id: int, token: str | None = None) -> str:
         """Fetch the project's Figma link from the Projects service."""
 
@@ -155,385 +748,79 @@ class Services:
 
         return figma_link
 
-    def figma_color_to_rgb(self, color: dict):
-        return [
-            int(color["r"] * 255),
-            int(color["g"] * 255),
-            int(color["b"] * 255),
-        ]
-
-    def is_large_text(self, node: dict):
-        style = node.get("style", {})
-        font_size = style.get("fontSize", 0)
-        font_weight = style.get("fontWeight", 400)
-        return font_size >= 18 or (font_size >= 14 and font_weight >= 700)
-
-    def find_background_color(self, node: dict):
-        parent = node.get("parent")
-
-        while parent:
-            fills = parent.get("fills", [])
-
-            for f in fills:
-                color = f.get("color")
-                if not color:
-                    continue
-                if color.get("a", 1) == 0:
-                    continue
-
-                return self.figma_color_to_rgb(color)
+    def _stream_document(
+        self,
+        raw,
+        analysis_id: str,
+        diagnostics: Diagnostics = NO_DIAGNOSTICS,
+        imported: bool = True,
+        max_nodes: int = None,
+    ):
+        """Parse a streamed figma-service response (or, not ``imported``, a raw body) into a node table.
+
+        The body is never held in memory: it is decoded incrementally and
+        gzipped into a spool file as it is read, which then becomes the raw
+        data blob. Of an import response only the Figma file is spooled,
+        re-encoded from the parser's events. Returns ``(table, blob digest,
+        top-level scalars of the spooled file)``; the last is empty for a
+        raw body.
+        """
+        path = blob_store.temp_path(analysis_id)
+        if imported:
+            source = raw
+            spool = SpoolWriter(path)
+        else:
+            source = SpoolReader(raw, path)
+            spool = source.spool
+        try:
+            with diagnostics.stage("stream_extract"):
+                node_table = node_table_from_stream(source, max_nodes, copy=spool if imported else None)
+            if imported and (node_table is None or not spool.size):
+                raise HTTPException(500, "Figma import did not return project data")
+            if node_table is None:
+                raise HTTPException(400, "Request body has no Figma document")
+        except ijson.JSONError as e:
+            spool.discard()
+            if imported:
+                raise HTTPException(502, f"Invalid JSON from figma-service: {e}")
+            raise HTTPException(400, f"Invalid JSON body: {e}")
+        except Exception:
+            spool.discard()
+            raise
+        if imported:
+            spool.close()
+        else:
+            source.close()
 
-            bg = parent.get("backgroundColor")
-            if bg and bg.get("a", 1) > 0:
-                return self.figma_color_to_rgb(bg)
+        diagnostics.count_table(node_table)
+        diagnostics.count("raw_bytes", spool.size)
+        with diagnostics.stage("persist_raw"):
+            return node_table, blob_store.put_file(spool.path, spool.digest), spool.fields
 
-            parent = parent.get("parent")
+    def figma_color_to_rgb(self, color: dict):
+        return figma_color_to_rgb(color)
 
-        return [255, 255, 255]
+    def is_large_text(self, node: dict):
+        return is_large_text(node)
 
     def is_button(self, node: dict):
-        if node.get("type") not in ["GROUP", "FRAME"]:
-            return False
-
-        children = node.get("children", [])
-        if not children:
-            return False
-
-        rect = next(
-            (c for c in children if c.get("type") == "RECTANGLE" and c.get("absoluteBoundingBox")),
-            None
-        )
-        if not rect:
-            return False
-
-        has_text = any(c.get("type") == "TEXT" for c in children)
-        has_icon = any(c.get("type") in ["VECTOR", "ELLIPSE"] for c in children)
-
-        if not (has_text or has_icon):
-            return False
-
-        box = rect["absoluteBoundingBox"]
-        return box["width"] >= 24 and box["height"] >= 24
+        return button_rect(node) is not None
 
     # ======================================================
     #            FIGMA DATA ANALYSIS CORE ENGINE
     # ======================================================
-    def _analyze_figma_data(self, figma_data: dict, device: str):
-        def walk(node):
-            yield node
-            for child in node.get("children", []):
-                yield from walk(child)
-
-        document = figma_data.get("document", {})
-        all_nodes = list(walk(document))
-
-        issues = []
-
-        BUTTON_THRESHOLDS = {
-            "high": 72,  # High priority button >= 72px
-            "medium": 60,  # Medium priority button >= 60px
-            "low": 48,  # Low priority button >= 48px
-        }
-
-        SPACING_RANGES = {
-            "high": (12, 24),
-            "medium": (24, 40),
-            "low": (32, 48),
-        }
-
-        CONTRAST = {"normal": 4.5, "large": 3.0}
-
-        FONT_MIN = {"desktop": 14, "mobile": 11}
-        FONT_IDEAL = {"desktop": (14, 17), "mobile": (15, 17)}
-
-        TOUCH_MIN_CONTROL = 44
-        TOUCH_MIN_TEXT = 30
-
-        LAYOUT_MAX_DEPTH = 3
-
-        metrics = {
-            "button_size": {
-                "min_detected": None,
-                "expected_min": BUTTON_THRESHOLDS["low"],
-                "priority_breakdown": {},
-                "status": "ok",
-            },
-            "button_spacing": {
-                "min_spacing": None,
-                "recommended_min": None,
-                "status": "ok",
-                "priority_breakdown": {},
-            },
-            "contrast_ratio": {
-                "min_ratio": None,
-                "required_min_normal": CONTRAST["normal"],
-                "required_min_large": CONTRAST["large"],
-                "status": "ok",
-            },
-            "font_size": {
-                "min_detected": None,
-                "recommended_min": FONT_MIN[device],
-                "ideal_range": FONT_IDEAL[device],
-                "status": "ok",
-            },
-            "touch_target": None,
-            "layout_depth": {"avg_depth": 0, "recommended_max": LAYOUT_MAX_DEPTH, "status": "ok"},
-        }
-
-        def classify_priority(node_name: str):
-            name = (node_name or "").lower()
-            if "primary" in name or "high" in name:
-                return "high"
-            if "secondary" in name or "medium" in name:
-                return "medium"
-            return "low"
-
-        button_boxes = []
-        # -------- BUTTONS --------
-        for node in all_nodes:
-            if not self.is_button(node):
-                continue
-
-            rect = next(
-                c for c in node["children"]
-                if c.get("type") == "RECTANGLE" and c.get("absoluteBoundingBox")
-            )
-
-            box = rect["absoluteBoundingBox"]
-            h = box["height"]
-
-            node_name = node.get("name", "")
-            priority = classify_priority(node_name)
-            button_boxes.append((box, priority, node))
-
-            breakdown = metrics["button_size"]["priority_breakdown"].setdefault(
-                priority, {"min_detected": None, "expected_min": BUTTON_THRESHOLDS[priority]}
-            )
-
-            if breakdown["min_detected"] is None or h < breakdown["min_detected"]:
-                breakdown["min_detected"] = h
-
-            if metrics["button_size"]["min_detected"] is None or h < metrics["button_size"]["min_detected"]:
-                 metrics["button_size"]["min_detected"] = h
-
-            if h < BUTTON_THRESHOLDS[priority]:
-                issues.append(
-                    {
-                        "issue": f"{priority.title()} priority button height too small",
-                        "expected_min": BUTTON_THRESHOLDS[priority],
-                        "actual": h,
-                        "node": node.get("id"),
-                    }
-                )
-
-        # Determine button spacing between detected buttons
-        def _distance(box_a, box_b):
-            ax1, ay1 = box_a.get("x", 0), box_a.get("y", 0)
-            ax2, ay2 = ax1 + box_a.get("width", 0), ay1 + box_a.get("height", 0)
-
-            bx1, by1 = box_b.get("x", 0), box_b.get("y", 0)
-            bx2, by2 = bx1 + box_b.get("width", 0), by1 + box_b.get("height", 0)
-
-            horiz_gap = max(0, max(bx1 - ax2, ax1 - bx2))
-            vert_gap = max(0, max(by1 - ay2, ay1 - by2))
-            return max(horiz_gap, vert_gap)
-
-        min_spacing = None
-        spacing_priority = None
-        for i in range(len(button_boxes)):
-            for j in range(i + 1, len(button_boxes)):
-                gap = _distance(button_boxes[i][0], button_boxes[j][0])
-                if gap <= 0:
-                    continue
-                if min_spacing is None or gap < min_spacing:
-                    min_spacing = gap
-                    # take stricter priority among the two buttons being compared
-                    priorities = sorted({button_boxes[i][1], button_boxes[j][1]}, key=lambda p: ["high", "medium", "low"].index(p))
-                    spacing_priority = priorities[0] if priorities else None
-
-        if spacing_priority:
-            metrics["button_spacing"]["recommended_min"] = SPACING_RANGES[spacing_priority][0]
-            metrics["button_spacing"]["priority_breakdown"][spacing_priority] = {
-                "min_detected": min_spacing,
-                "recommended_range": SPACING_RANGES[spacing_priority],
-            }
-        if min_spacing is not None:
-            min_spacing = round(min_spacing, 5)
-
-        metrics["button_spacing"]["min_spacing"] = min_spacing
-
-        if spacing_priority and min_spacing is not None and min_spacing < SPACING_RANGES[spacing_priority][0]:
-            metrics["button_spacing"]["status"] = "warning"
-            issues.append(
-                {
-                    "issue": f"Spacing below {spacing_priority} priority guidance",
-                    "expected_min": SPACING_RANGES[spacing_priority][0],
-                    "actual": min_spacing,
-                }
-            )
-
-        if metrics["button_size"]["min_detected"] and metrics["button_size"]["min_detected"] < BUTTON_THRESHOLDS["low"]:
-            metrics["button_size"]["status"] = "error"
-
-        # -------- FONTS --------
-        min_font = None
-        for node in all_nodes:
-            if node.get("type") == "TEXT":
-                style = node.get("style", {})
-                fs = style.get("fontSize")
-
-                if fs:
-                    if min_font is None or fs < min_font:
-                        min_font = fs
-
-                    if fs < FONT_MIN[device]:
-                        issues.append(
-                            {
-                                "issue": "Font too small",
-                                "expected_min": FONT_MIN[device],
-                                "actual": fs,
-                                "node": node.get("id"),
-                            }
-                        )
-
-        metrics["font_size"]["min_detected"] = min_font
-        if min_font and min_font < FONT_MIN[device]:
-            metrics["font_size"]["status"] = "warning"
-
-        # -------- CONTRAST --------
-        def luminance(rgb):
-            def f(c):
-                c = c / 255
-                return c / 12.92 if c <= 0.03928 else ((c + 0.055) / 1.055) ** 2.4
-
-            r, g, b = rgb
-            return 0.2126 * f(r) + 0.7152 * f(g) + 0.0722 * f(b)
-
-        def contrast_ratio(fg, bg):
-            L1 = luminance(fg)
-            L2 = luminance(bg)
-            return (max(L1, L2) + 0.05) / (min(L1, L2) + 0.05)
-
-        lowest_contrast = None
-
-        for node in all_nodes:
-            if node.get("type") != "TEXT":
-                continue
-
-            fills = node.get("fills")
-            if not fills or not isinstance(fills, list):
-                continue
-
-            fill = next((f for f in fills if f.get("visible", True) and f.get("color")), None)
-            if not fill:
-                continue
-
-            fg = self.figma_color_to_rgb(fill["color"])
-            bg = self.find_background_color(node)
-            if fg == bg:
-                continue
-            ratio = contrast_ratio(fg, bg)
-
-            if lowest_contrast is None or ratio < lowest_contrast:
-                lowest_contrast = ratio
-
-            is_large = self.is_large_text(node)
-            required = CONTRAST["large"] if is_large else CONTRAST["normal"]
-
-            if ratio < required:
-                text_sample = (node.get("characters") or "").strip()[:20]
-
-                issues.append(
-                    {
-                        "issue": "Insufficient contrast",
-                        "actual_ratio": round(ratio, 2),
-                        "required_ratio": required,
-                        "text_sample": text_sample,
-                        "node": node.get("id"),
-                    }
-                )
-
-        metrics["contrast_ratio"]["min_ratio"] = round(lowest_contrast, 2) if lowest_contrast else None
-
-        if lowest_contrast:
-            if lowest_contrast < CONTRAST["large"]:
-                metrics["contrast_ratio"]["status"] = "error"
-            elif lowest_contrast < CONTRAST["normal"]:
-                metrics["contrast_ratio"]["status"] = "warning"
-            else:
-                metrics["contrast_ratio"]["status"] = "ok"
-
-        # -------- TOUCH (mobile) --------
-        if device == "mobile":
-            smallest_touch = None
-            smallest_text_touch = None
-            for node in all_nodes:
-                box = rect["absoluteBoundingBox"]
-                if box:
-                    w, h = box.get("width"), box.get("height")
-                    if w and h:
-                        size = min(w, h)
-                        if node.get("type") == "TEXT":
-                            if smallest_text_touch is None or size < smallest_text_touch:
-                                smallest_text_touch = size
-                            if size < TOUCH_MIN_TEXT:
-                                issues.append(
-                                    {
-                                        "issue": "Tappable text target too small",
-                                        "actual": size,
-                                        "expected_min": TOUCH_MIN_TEXT,
-                                        "node": node.get("id"),
-                                    }
-                                )
-                        else:
-                            if smallest_touch is None or size < smallest_touch:
-                                smallest_touch = size
-                            if size < TOUCH_MIN_CONTROL:
-                                issues.append(
-                                    {
-                                        "issue": "Touch target too small",
-                                        "actual": size,
-                                        "expected_min": TOUCH_MIN_CONTROL,
-                                        "node": node.get("id"),
-                                    }
-                                )
-
-            metrics["touch_target"] = {
-                "min_detected": smallest_touch,
-                "recommended_min": TOUCH_MIN_CONTROL,
-                "text_min_detected": smallest_text_touch,
-                "text_recommended_min": TOUCH_MIN_TEXT,
-                "status": "ok"
-                if smallest_touch and smallest_touch >= TOUCH_MIN_CONTROL and smallest_text_touch and smallest_text_touch >= TOUCH_MIN_TEXT
-                else "error",
-            }
-
-        # -------- DEPTH --------
-        def depth(node):
-            if not node.get("children"):
-                return 0
-            return 1 + max(depth(c) for c in node["children"])
-
-        depths = [depth(n) for n in all_nodes]
-        avg_depth = sum(depths) / len(depths) if depths else 0
-        metrics["layout_depth"]["avg_depth"] = avg_depth
-
-        if avg_depth > LAYOUT_MAX_DEPTH:
-            metrics["layout_depth"]["status"] = "warning"
-            issues.append({
-                "issue": "Deep nesting",
-                "avg_depth": avg_depth,
-                "recommended_max": LAYOUT_MAX_DEPTH,
-            })
-
-        return {"device": device, "metrics": metrics, "issues": issues}
+    def _analyze_figma_data(self, figma_data: dict, device: str, ruleset: RuleSet = DEFAULT_RULESET):
+        return AnalysisEngine.compiled(device, ruleset).analyze(figma_data)
 
     # ======================================================
     #            OPINION + SUMMARY GENERATION
     # ======================================================
-    def _generate_conclusions(self, data: dict):
+    def _generate_conclusions(self, data: dict, groups: list = None):
+        """Summary, opinion and one recommendation per issue group of an analysis result."""
         issues = data["issues"]
-        count = len(issues)
+        count = data.get("issue_count", len(issues))
+        if groups is None:
+            groups = group_issues(issues, ISSUE_SAMPLE_SIZE)
 
         summary = f"Detected {count} usability and accessibility issues."
 
@@ -545,38 +832,11 @@ class Services:
             opinion = "Multiple UX and accessibility issues detected. Improvements required."
 
         recommendations = []
-
-        for i in issues:
-            issue_type = i["issue"].lower()
-
-            if "font" in issue_type:
-                recommendations.append(
-                    f"Increase font size to at least {i.get('expected_min')}px "
-                    f"(currently {i.get('actual')}px)."
-                )
-
-            if "contrast" in issue_type:
-                text = i.get("text_sample", "")
-                recommendations.append(
-                    f"Improve color contrast to ≥ {i.get('required_ratio')}:1 "
-                    f"for text \"{text}\"."
-                )
-
-            if "button" in issue_type:
-                recommendations.append(
-                    f"Increase button height to at least {i.get('expected_min')}px "
-                    f"(currently {i.get('actual')}px)."
-                )
-
-            if "touch" in issue_type:
-                recommendations.append(
-                    f"Increase touch target size to minimum {i.get('expected_min')}px."
-                )
-
-            if "nest" in issue_type:
-                recommendations.append(
-                    f"Reduce layout nesting depth to ≤ {i.get('recommended_max')}."
-                )
+        for group in groups:
+            template = RECOMMENDATIONS.get(group["code"])
+            if template:
+                more = f" and {group['count'] - 1} more" if group["count"] > 1 else ""
+                recommendations.append(template.format(**{"text_sample": "", **group}, more=more))
 
         # preserve order, remove duplicates
         recommendations = list(dict.fromkeys(recommendations))
@@ -590,71 +850,274 @@ class Services:
     # ======================================================
     #         RETRIEVE LAST ANALYSIS FROM DATABASE
     # ======================================================
-    def get_analysis(self, project_id: int):
-        analysis = (
-            self.db.query(Analysis)
-            .filter(Analysis.project_id == str(project_id))
-            .order_by(Analysis.created_at.desc())
-            .first()
-        )
+    def get_analysis(self, project_id: int, device: str = None):
+        """JSON body of the latest completed analysis of a project, optionally for one device.
+
+        The body is stored pre-serialised with each row, so a read is one
+        lookup on the (project_id, device, created_at) index and no JSON
+        is parsed; rows written before that are rebuilt from their fields.
+        """
+        query = self.db.query(Analysis).options(load_only(Analysis.id, Analysis.response_json))
+        query = query.filter(Analysis.project_id == project_id)
+        if device:
+            query = query.filter(Analysis.device == device)
+        analysis = query.filter(Analysis.status == "completed").order_by(Analysis.created_at.desc()).first()
 
         if not analysis:
             return None
+        if analysis.response_json:
+            return analysis.response_json
+
+        # deferred columns of legacy rows load on access
+        return self.response_body(self._analysis_response(analysis))
 
-        parsed = json.loads(analysis.results_json)
+    def _analysis_response(self, analysis: Analysis):
+        parsed = loads(analysis.results_json)
 
         return {
             "project_id": int(analysis.project_id),
             "device": parsed["device"],
             "summary": analysis.summary,
             "opinion": analysis.opinion,
-            "recommendations": json.loads(analysis.recomendation),
+            "recommendations": loads(analysis.recomendation),
             "metrics": parsed["metrics"],
-            "issues": parsed["issues"],
+            **self._issue_fields(parsed),
+            "node_ids": parsed.get("node_ids"),
         }
 
     # ======================================================
-    #          SIMPLE CHECKLIST FOR FRONTEND
+    #                   ANALYSIS HISTORY
     # ======================================================
-    def get_checklist(self):
+    def get_history(
+        self,
+        project_id: int,
+        device: str = None,
+        limit: int = 20,
+        cursor: str = None,
+        include_results: bool = False,
+        series: list = (),
+    ):
+        """One page of a project's completed analyses, newest first.
+
+        Pages are keyset-paginated on ``(created_at, id)``: ``next_cursor``
+        encodes the last row of the page and the next page starts strictly
+        after it, so deep pages cost the same as the first. Only the
+        ``HISTORY_FIELDS`` are loaded unless ``include_results`` is set.
+        ``series`` names metric columns to aggregate per day in SQL.
+        """
+        unknown = [metric for metric in series if metric not in METRIC_COLUMNS]
+        if unknown:
+            raise HTTPException(400, f"Unknown metric: {', '.join(unknown)}")
+        limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+        columns = [getattr(Analysis, name) for name in HISTORY_FIELDS]
+        if include_results:
+            columns.append(Analysis.results_json)
+        query = self._history_query(project_id, device).options(load_only(*columns))
+
+        if cursor:
+            created_at, row_id = self._decode_cursor(cursor)
+            query = query.filter(
+                or_(
+                    Analysis.created_at < created_at,
+                    and_(Analysis.created_at == created_at, Analysis.id < row_id),
+                )
+            )
+
+        rows = query.order_by(Analysis.created_at.desc(), Analysis.id.desc()).limit(limit + 1).all()
+        page = rows[:limit]
+
+        items = []
+        for analysis in page:
+            item = {name: getattr(analysis, name) for name in HISTORY_FIELDS if name != "id"}
+            if include_results:
+                parsed = loads(analysis.results_json)
+                item["metrics"] = parsed["metrics"]
+                item["issues"] = parsed["issues"]
+            items.append(item)
+
         return {
-            "categories": [
-                {
-                    "name": "Button Size",
-                    "rules": [
-                        {"description": "High priority button ≥ 72px", "desktop": 72, "mobile": 72},
-                        {"description": "Medium priority button ≥ 60px", "desktop": 60, "mobile": 60},
-                        {"description": "Low priority button ≥ 48px", "desktop": 48, "mobile": 48},
-                    ],
-                },
-                {
-                    "name": "Spacing",
-                    "rules": [
-                        {"description": "High priority buttons spacing 12–24px"},
-                        {"description": "Medium priority buttons spacing 24–40px"},
-                        {"description": "Low priority buttons spacing 32–48px"},
-                    ],
-                },
-                {
-                    "name": "Text Readability",
-                    "rules": [
-                        {"description": "Desktop title ideal 14–17px (min 14px)"},
-                        {"description": "Phone title ideal 15–17px (min 11–12px)"},
-                    ],
-                },
-                {
-                    "name": "Color Contrast",
-                    "rules": [
-                        {"description": "Normal text ratio ≥ 4.5:1"},
-                        {"description": "Large text/UI icons ratio ≥ 3:1"},
-                    ],
-                },
-                {
-                    "name": "Layout Structure",
-                    "rules": [
-                        {"description": "Maintain button hierarchy depth ≤ 3"},
-                        {"description": "Ensure clean visual hierarchy"},
-                    ],
-                },
-            ]
-        }
\ No newline at end of file
+            "project_id": project_id,
+            "items": items,
+            "next_cursor": self._encode_cursor(page[-1]) if len(rows) > limit else None,
+            "series": {metric: self._metric_series(project_id, device, metric) for metric in series},
+        }
+
+    def _history_query(self, project_id: int, device: str = None):
+        query = self.db.query(Analysis).filter(Analysis.project_id == project_id, Analysis.status == "completed")
+        if device:
+            query = query.filter(Analysis.device == device)
+        return query
+
+    def _metric_series(self, project_id: int, device: str, metric: str):
+        """Daily aggregate of one metric column, computed by the database."""
+        column = getattr(Analysis, metric)
+        aggregate = METRIC_COLUMNS[metric][1]
+        day = func.date(Analysis.created_at)
+        rows = (
+            self._history_query(project_id, device)
+            .with_entities(day, aggregate(column), func.count(column))
+            .filter(column.isnot(None))
+            .group_by(day)
+            .order_by(day)
+            .all()
+        )
+        return [{"date": str(date), "value": value, "analyses": count} for date, value, count in rows]
+
+    @staticmethod
+    def _encode_cursor(analysis: Analysis):
+        return base64.urlsafe_b64encode(f"{analysis.created_at.isoformat()}|{analysis.id}".encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(created_at), int(row_id)
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+
+    # ======================================================
+    #        RAW FIGMA DATA OF THE LAST ANALYSIS (LAZY)
+    # ======================================================
+    def get_raw_data(self, project_id: int):
+        """Locate the raw Figma data behind the latest analysis of a project.
+
+        Returns ``{"blob_path": ...}`` for gzip blobs, ``{"raw_data": ...}``
+        for rows stored before the blob store existed, or None.
+        """
+        analysis = (
+            self.db.query(Analysis)
+            .options(load_only(Analysis.id, Analysis.raw_data_hash))
+            .filter(Analysis.project_id == project_id, Analysis.status == "completed")
+            .order_by(Analysis.created_at.desc())
+            .first()
+        )
+        if not analysis:
+            return None
+
+        if analysis.raw_data_hash:
+            if not blob_store.exists(analysis.raw_data_hash):
+                return None
+            return {"blob_path": blob_store.path(analysis.raw_data_hash)}
+
+        # legacy rows kept the JSON inline; only now is the column loaded
+        if analysis.raw_data:
+            return {"raw_data": analysis.raw_data}
+        return None
+
+    # ======================================================
+    #        FULL ISSUE LIST OF THE LAST ANALYSIS (NDJSON)
+    # ======================================================
+    def get_issue_stream(self, project_id: int, device: str = None, code: str = None):
+        """Every issue of the latest analysis as NDJSON lines, optionally of one ``code``.
+
+        Issues beyond ``ISSUE_LIMIT`` are read from the issue blob while
+        the lines are consumed, so the full list is never held in memory.
+        Returns None when the project has no analysis.
+        """
+        if code is not None and code not in ISSUE_CODES:
+            raise HTTPException(400, f"Unknown issue code: {code}")
+
+        query = (
+            self.db.query(Analysis)
+            .options(load_only(Analysis.id, Analysis.issues_hash))
+            .filter(Analysis.project_id == project_id, Analysis.status == "completed")
+        )
+        if device:
+            query = query.filter(Analysis.device == device)
+        analysis = query.order_by(Analysis.created_at.desc()).first()
+        if not analysis:
+            return None
+
+        if analysis.issues_hash:
+            if not blob_store.exists(analysis.issues_hash):
+                raise HTTPException(404, "The issue list of this analysis is no longer stored")
+            issues = self._stored_issues(analysis.issues_hash)
+        else:
+            # the row holds every issue; the deferred column loads on access
+            issues = loads(analysis.results_json)["issues"]
+
+        return (
+            dumps(issue) + "\n"
+            for issue in issues
+            if code is None or issue.get("code") == code
+        )
+
+    @staticmethod
+    def _stored_issues(digest: str):
+        with blob_store.open(digest) as blob:
+            yield from ijson.items(blob, "item", use_float=True)
+
+    # ======================================================
+    #              RULE PROFILES PER PROJECT
+    # ======================================================
+    def get_ruleset(self, project_id: int = None):
+        """Rule set a project is analysed with: its stored profile, or the defaults."""
+        if project_id is None:
+            return DEFAULT_RULESET
+        with self._db_lock:
+            profile = (
+                self.db.query(RuleProfile)
+                .options(load_only(RuleProfile.id, RuleProfile.thresholds_json))
+                .filter(RuleProfile.project_id == project_id)
+                .first()
+            )
+        if not profile:
+            return DEFAULT_RULESET
+        return load_ruleset(profile.thresholds_json)
+
+    def get_rulesets(self, project_ids):
+        """``get_ruleset`` for many projects in one query."""
+        rulesets = dict.fromkeys(project_ids, DEFAULT_RULESET)
+        with self._db_lock:
+            profiles = (
+                self.db.query(RuleProfile)
+                .options(load_only(RuleProfile.project_id, RuleProfile.thresholds_json))
+                .filter(RuleProfile.project_id.in_(list(rulesets)))
+                .all()
+            )
+        for profile in profiles:
+            rulesets[profile.project_id] = load_ruleset(profile.thresholds_json)
+        return rulesets
+
+    def get_rule_profile(self, project_id: int):
+        ruleset = self.get_ruleset(project_id)
+        return {"project_id": project_id, "version": ruleset.version, "thresholds": ruleset.thresholds}
+
+    def set_rule_profile(self, project_id: int, overrides: dict):
+        """Store threshold overrides for a project; later analyses and cache keys use them."""
+        try:
+            ruleset = RuleSet.from_overrides(overrides)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+
+        profile = self.db.query(RuleProfile).filter(RuleProfile.project_id == project_id).first()
+        if profile is None:
+            profile = RuleProfile(project_id=project_id, thresholds_json="{}", version=ruleset.version)
+        # the full thresholds are stored, so a profile keeps its meaning if the defaults change
+        profile.thresholds_json = ruleset.to_json()
+        profile.version = ruleset.version
+        profile.updated_at = datetime.utcnow()
+        self.db.add(profile)
+        self.db.commit()
+        return self.get_rule_profile(project_id)
+
+    def delete_rule_profile(self, project_id: int):
+        """Go back to the default thresholds; True if the project had a profile."""
+        deleted = self.db.query(RuleProfile).filter(RuleProfile.project_id == project_id).delete()
+        self.db.commit()
+        return bool(deleted)
+
+    # ======================================================
+    #          SIMPLE CHECKLIST FOR FRONTEND
+    # ======================================================
+    def get_checklist(self, project_id: int = None):
+        """Checklist of the rules a project is analysed with, generated from the rule registry."""
+        return checklist(self.get_ruleset(project_id))
+
+    # ======================================================
+    #                    SERVICE METRICS
+    # ======================================================
+    def get_service_metrics(self):
+        """Totals of the diagnostics recorded by this process since it started."""
+        return service_metrics.snapshot()
@@ -0,0 +1,158 @@
+import heapq
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+import numpy as np
+
+
+def close_pairs(edges, margin: float = 0.0):
+    """Pairs ``(i, j)``, ``i < j``, of ``(x1, y1, x2, y2)`` boxes closer than ``margin``.
+
+    Closeness is the Chebyshev gap ``max(b.x1 - a.x2, a.x1 - b.x2, b.y1 -
+    a.y2, a.y1 - b.y2)``, negative for boxes that overlap, so ``margin=0``
+    finds overlapping boxes only. A sweep line
+    moves over x: boxes enter by their left edge and leave (through a heap)
+    once the line is ``margin`` past their right edge. Active boxes are
+    kept sorted by top edge, and an entering box is only compared with
+    those whose top edge is within the tallest box of its own span, so
+    boxes of similar height cost O(n log n) plus the pairs reported.
+    """
+    edges = np.asarray(edges, dtype=np.float64).reshape(-1, 4)
+    if len(edges) < 2:
+        return []
+    x1, y1, x2, y2 = (column.tolist() for column in edges.T)
+    tallest = float((edges[:, 3] - edges[:, 1]).max())
+
+    active = []
+    leaving = []
+    pairs = []
+    for i in np.argsort(edges[:, 0], kind="stable").tolist():
+        while leaving and leaving[0][0] <= x1[i]:
+            _, j = heapq.heappop(leaving)
+            del active[bisect_left(active, (y1[j], j))]
+
+        low = bisect_left(active, (y1[i] - margin - tallest, -1))
+        high = bisect_left(active, (y2[i] + margin, -1))
+        for _, j in active[low:high]:
+            # the second test only matters for zero-width boxes
+            if y2[j] > y1[i] - margin and x1[j] < x2[i] + margin:
+                pairs.append((j, i) if j < i else (i, j))
+
+        insort(active, (y1[i], i))
+        heapq.heappush(leaving, (x2[i] + margin, i))
+    return pairs
+
+
+class GridIndex:
+    """Uniform grid over axis-aligned boxes for nearest-gap queries.
+
+    The cell size defaults to the median box extent, so a typical box lives
+    in a handful of cells and its nearest neighbour is found within the
+    first few rings around it. Building is O(n) and each query only looks
+    at nearby cells instead of every other box. A box with no close
+    neighbour stops after ``MAX_RINGS`` rings and searches the boxes sorted
+    by left edge instead, so a far outlier does not scan every empty cell
+    in between.
+    """
+
+    # rings scanned around a box before the search moves to the boxes sorted by x
+    MAX_RINGS = 8
+
+    def __init__(self, boxes, cell_size: float = None):
+        self.boxes = boxes
+        self.edges = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if cell_size is None:
+            extents = sorted(max(b[2] - b[0], b[3] - b[1]) for b in boxes) or [1]
+            cell_size = extents[len(extents) // 2]
+        self.cell_size = max(float(cell_size), 1.0)
+
+        self.order = np.argsort(self.edges[:, 0], kind="stable")
+        self.sorted_x1 = self.edges[self.order, 0]
+        self.widest = float((self.edges[:, 2] - self.edges[:, 0]).max()) if len(self.edges) else 0.0
+
+        self.cells = defaultdict(list)
+        self.bounds = None
+        for i, box in enumerate(boxes):
+            cx1, cy1, cx2, cy2 = self._cell_range(box)
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    self.cells[(cx, cy)].append(i)
+
+            if self.bounds is None:
+                self.bounds = [cx1, cy1, cx2, cy2]
+            else:
+                bounds = self.bounds
+                bounds[0], bounds[1] = min(bounds[0], cx1), min(bounds[1], cy1)
+                bounds[2], bounds[3] = max(bounds[2], cx2), max(bounds[3], cy2)
+
+    def _cell_range(self, box):
+        size = self.cell_size
+        return int(box[0] // size), int(box[1] // size), int(box[2] // size), int(box[3] // size)
+
+    def _ring(self, cx1, cy1, cx2, cy2, r):
+        if r == 0:
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    yield cx, cy
+            return
+
+        x_lo, x_hi, y_lo, y_hi = cx1 - r, cx2 + r, cy1 - r, cy2 + r
+        for cx in range(x_lo, x_hi + 1):
+            yield cx, y_lo
+            yield cx, y_hi
+        for cy in range(y_lo + 1, y_hi):
+            yield x_lo, cy
+            yield x_hi, cy
+
+    def _closest(self, i: int, others: np.ndarray):
+        """``(gap, j)`` for the box of ``others`` with the smallest positive gap to box ``i``, or ``(None, None)``."""
+        if not len(others):
+            return None, None
+        box = self.boxes[i]
+        e = self.edges[others]
+        horiz_gap = np.maximum(e[:, 0] - box[2], box[0] - e[:, 2])
+        vert_gap = np.maximum(e[:, 1] - box[3], box[1] - e[:, 3])
+        gaps = np.maximum(horiz_gap, vert_gap)
+        gaps[(gaps <= 0) | (others == i)] = np.inf
+
+        k = int(gaps.argmin())
+        if gaps[k] == np.inf:
+            return None, None
+        return float(gaps[k]), int(others[k])
+
+    def nearest(self, i: int):
+        """Return ``(gap, j)`` for the closest box with a positive gap to box ``i``.
+
+        Boxes that touch or overlap box ``i`` are ignored. Returns
+        ``(None, None)`` when no other box qualifies.
+        """
+        box = self.boxes[i]
+        cx1, cy1, cx2, cy2 = self._cell_range(box)
+        bx1, by1, bx2, by2 = self.bounds
+        reach = max(cx1 - bx1, cy1 - by1, bx2 - cx2, by2 - cy2, 0)
+
+        best, best_j = None, None
+        for r in range(min(reach, self.MAX_RINGS) + 1):
+            candidates = []
+            for cell in self._ring(cx1, cy1, cx2, cy2, r):
+                candidates.extend(self.cells.get(cell, ()))
+
+            # boxes spanning several cells may repeat; that only costs a duplicate gap
+            gap, j = self._closest(i, np.array(candidates, dtype=np.intp))
+            if gap is not None and (best is None or gap < best):
+                best, best_j = gap, j
+
+            # anything outside the scanned rings is at least r cells away
+            if best is not None and best <= r * self.cell_size:
+                return best, best_j
+        if reach <= self.MAX_RINGS:
+            return best, best_j
+
+        # only boxes whose x range comes closer than the best gap so far can beat it
+        limit = np.inf if best is None else best
+        low = np.searchsorted(self.sorted_x1, box[0] - limit - self.widest)
+        high = np.searchsorted(self.sorted_x1, box[2] + limit)
+        gap, j = self._closest(i, self.order[low:high])
+        if gap is not None and (best is None or gap < best):
+            best, best_j = gap, j
+        return best, best_j
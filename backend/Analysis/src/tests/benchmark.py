@@ -0,0 +1,337 @@
+"""Benchmarks of the analysis pipeline on synthetic Figma documents.
+
+Run from ``backend/Analysis``::
+
+    python -m src.tests.benchmark --nodes 10000 100000 --device all
+    python -m src.tests.benchmark --nodes 100000 --save baseline.json
+    python -m src.tests.benchmark --nodes 100000 --compare baseline.json
+    python -m src.tests.benchmark --nodes 100000 --json
+
+Every stage is timed over ``--repeat`` runs (the best and the median are
+reported) after one run under ``tracemalloc`` for its peak memory, which
+also warms up imports and the analysis pool, so neither skews the timings. ``--compare`` flags stages that got
+slower or bigger than a saved run by more than ``--tolerance``. ``--json``
+also compares the stdlib ``json`` with ``FastJSON`` on the document and
+its analysis response.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+from fastapi.responses import JSONResponse
+from sqlmodel import Session, SQLModel, create_engine
+
+from src.services.AnalysisEngine import DEVICES
+from src.services.AnalysisPool import analysis_pool
+from src.services.BlobStore import blob_store
+from src.services.DocumentShards import partial_store
+from src.services.FastJSON import FastJSONResponse, dump_bytes, loads
+from src.services.ResultCache import result_cache
+from src.services.Services import Services
+
+DEFAULT_SHARES = {"TEXT": 0.35, "RECTANGLE": 0.3, "FRAME": 0.15, "GROUP": 0.05, "VECTOR": 0.1, "ELLIPSE": 0.05}
+CONTAINER_TYPES = ("FRAME", "GROUP")
+BUTTON_LABELS = ("Primary Button", "Secondary Button", "Button", "Cancel", "High CTA", "Medium action")
+WORDS = ("sign", "in", "continue", "profile", "settings", "search", "share", "cart", "home", "next")
+
+
+def synthetic_document(
+    nodes: int = 10_000,
+    depth: int = 8,
+    fanout: int = 8,
+    shares: dict = None,
+    button_share: float = 0.1,
+    palette: int = 12,
+    pages: int = 1,
+    seed: int = 0,
+    frame_nodes: int = 1_000,
+):
+    """A Figma file response with exactly ``nodes`` nodes below its pages.
+
+    The pages take turns holding top-level frames of ``frame_nodes`` nodes
+    (the last one may be smaller), each filled breadth-first: a container
+    gets up to ``fanout`` children and containers with room are revisited
+    until the frame is full; the frame itself takes ``fanout`` more
+    children whenever nothing else has room. No node is more than
+    ``depth`` levels below its page. Children are
+    drawn by the type ``shares``; a ``button_share`` of the frames are
+    button-like groups (a rectangle and a label), and fills come from a
+    palette of ``palette`` colours. The same arguments give the same
+    document.
+    """
+    rnd = random.Random(seed)
+    shares = shares or DEFAULT_SHARES
+    types, weights = list(shares), list(shares.values())
+    colours = [
+        {"r": round(rnd.random(), 3), "g": round(rnd.random(), 3), "b": round(rnd.random(), 3), "a": 1}
+        for _ in range(max(1, palette))
+    ]
+    count = 0
+
+    def new_node(node_type: str, parent_box: dict):
+        nonlocal count
+        count += 1
+        width = max(4, round(parent_box["width"] * rnd.uniform(0.1, 0.9)))
+        height = max(4, round(parent_box["height"] * rnd.uniform(0.1, 0.9)))
+        node = {
+            "id": f"{count}:{rnd.randrange(1 << 16)}",
+            "name": f"{node_type.title()} {count}",
+            "type": node_type,
+            "absoluteBoundingBox": {
+                "x": parent_box["x"] + rnd.randint(0, max(0, round(parent_box["width"]) - width)),
+                "y": parent_box["y"] + rnd.randint(0, max(0, round(parent_box["height"]) - height)),
+                "width": width,
+                "height": height,
+            },
+        }
+        if node_type != "TEXT" and rnd.random() < 0.6:
+            node["fills"] = [{"type": "SOLID", "color": rnd.choice(colours)}]
+        if node_type == "TEXT":
+            node["characters"] = " ".join(rnd.choices(WORDS, k=rnd.randint(1, 4)))
+            node["style"] = {"fontSize": rnd.choice((10, 11, 12, 14, 16, 18, 24)), "fontWeight": rnd.choice((400, 700))}
+            node["fills"] = [{"type": "SOLID", "color": rnd.choice(colours)}]
+        return node
+
+    def button(parent_box: dict):
+        node = new_node("FRAME", parent_box)
+        node["name"] = rnd.choice(BUTTON_LABELS)
+        box = node["absoluteBoundingBox"]
+        box["width"], box["height"] = rnd.randint(64, 240), rnd.randint(28, 80)
+        rect = new_node("RECTANGLE", box)
+        rect["absoluteBoundingBox"] = dict(box)
+        label = new_node("TEXT", box)
+        node["children"] = [rect, label]
+        return node
+
+    page_nodes = []
+    queue = deque()
+    screen = {"x": 0, "y": 0, "width": 1440, "height": 1024}
+    for page in range(pages):
+        page_nodes.append({"id": f"0:{page + 1}", "name": f"Page {page + 1}", "type": "CANVAS", "children": []})
+
+    frame_index = 0
+    frame_start = 0
+    containers = []
+    while count < nodes:
+        if not containers or count - frame_start >= frame_nodes:
+            # the frame is full: open another top-level frame
+            page = page_nodes[frame_index % pages]
+            frame_start = count
+            frame = new_node("FRAME", screen)
+            frame["absoluteBoundingBox"] = {**screen, "x": frame_index * 1600}
+            frame["children"] = []
+            page["children"].append(frame)
+            frame_room = fanout
+            containers = [(frame, 1)]
+            queue = deque(containers)
+            frame_index += 1
+            continue
+        if not queue:
+            # another round over the containers of this frame that still have room
+            queue.extend((node, level) for node, level in containers if len(node["children"]) < fanout)
+            if not queue:
+                queue.append(containers[0])
+                frame_room += fanout
+
+        parent, level = queue.popleft()
+        box = parent["absoluteBoundingBox"]
+        room = (frame_room if parent is frame else fanout) - len(parent["children"])
+        for _ in range(rnd.randint(1, room)):
+            if count >= nodes:
+                break
+            node_type = rnd.choices(types, weights)[0]
+            nests = node_type in CONTAINER_TYPES and level + 1 < depth
+            if nests and node_type == "FRAME" and nodes - count >= 3 and rnd.random() < button_share:
+                parent["children"].append(button(box))
+                continue
+            node = new_node(node_type, box)
+            parent["children"].append(node)
+            if nests:
+                node["children"] = []
+                queue.append((node, level + 1))
+                containers.append((node, level + 1))
+
+    return {
+        "name": "Synthetic benchmark file",
+        "version": str(seed),
+        "document": {"id": "0:0", "name": "Document", "type": "DOCUMENT", "children": page_nodes},
+    }
+
+
+def measure(run, repeat: int):
+    """Peak traced memory of a first run of ``run``, then its best and median time over ``repeat`` runs."""
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {"best_s": min(times), "median_s": statistics.median(times), "peak_mb": peak / 2**20}
+
+
+def benchmark(figma_data: dict, device: str = "desktop", repeat: int = 3, workdir: str = None):
+    """Measure ``_analyze_figma_data``, ``_generate_conclusions`` and ``run_analysis`` on ``figma_data``.
+
+    ``run_analysis`` runs without the result cache against a SQLite file
+    and a blob store in ``workdir``, with an empty shard store every time.
+    Analyses offloaded to the analysis pool count only their merge towards
+    the peak memory; its workers keep the shard store of the ``workdir``
+    they were started with.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="analysis-bench-")
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    SQLModel.metadata.create_all(engine)
+    blob_store.root = os.path.join(workdir, "blobs")
+    partial_store.root = os.path.join(workdir, "partials")
+    os.environ["ANALYSIS_PARTIAL_DIR"] = partial_store.root
+
+    devices = list(DEVICES) if device == "all" else [device]
+    service = Services(db=None)
+    result = service._analyze_figma_data(figma_data, devices[0])
+
+    def persist():
+        shutil.rmtree(partial_store.root, ignore_errors=True)
+        result_cache.clear()
+        with Session(engine) as db:
+            Services(db).run_analysis(1, device, figma_data=figma_data, use_cache=False)
+
+    stages = {
+        "analyze_figma_data": lambda: [service._analyze_figma_data(figma_data, d) for d in devices],
+        "generate_conclusions": lambda: service._generate_conclusions(result),
+        "run_analysis": persist,
+    }
+    return {name: measure(run, repeat) for name, run in stages.items()}
+
+
+def json_benchmark(figma_data: dict, device: str = "desktop", repeat: int = 3):
+    """``measure`` of encoding, decoding and rendering ``figma_data`` and its analysis with ``json`` and ``FastJSON``.
+
+    Every stage also reports its throughput in ``mb_per_s``, from the
+    size of the compact JSON and the best time.
+    """
+    service = Services(db=None)
+    result = service._analyze_figma_data(figma_data, device)
+    response = {**result, **service._generate_conclusions(result)}
+
+    stages = {}
+    for name, payload in (("document", figma_data), ("response", response)):
+        text = json.dumps(payload)
+        size_mb = len(dump_bytes(payload)) / 2**20
+        runs = {
+            f"json.dumps {name}": lambda: json.dumps(payload),
+            f"FastJSON.dumps {name}": lambda: dump_bytes(payload),
+            f"json.loads {name}": lambda: json.loads(text),
+            f"FastJSON.loads {name}": lambda: loads(text),
+            f"JSONResponse {name}": lambda: JSONResponse(payload),
+            f"FastJSONResponse {name}": lambda: FastJSONResponse(payload),
+        }
+        for stage, run in runs.items():
+            stages[stage] = measure(run, repeat)
+            stages[stage]["mb_per_s"] = size_mb / max(stages[stage]["best_s"], 1e-9)
+    return stages
+
+
+def regressions(current: dict, baseline: dict, tolerance: float):
+    """Lines describing every stage metric more than ``tolerance`` above ``baseline``."""
+    lines = []
+    for size, stages in current.items():
+        for stage, metrics in stages.items():
+            before = baseline.get(size, {}).get(stage)
+            if not before:
+                continue
+            for metric in ("best_s", "peak_mb"):
+                if before[metric] > 0 and metrics[metric] > before[metric] * (1 + tolerance):
+                    lines.append(
+                        f"{size} {stage} {metric}: {before[metric]:.4f} -> {metrics[metric]:.4f} "
+                        f"(+{metrics[metric] / before[metric] - 1:.0%})"
+                    )
+    return lines
+
+
+def _shares(value: str):
+    shares = {}
+    for pair in value.split(","):
+        node_type, _, share = pair.partition("=")
+        shares[node_type.strip().upper()] = float(share)
+    return shares
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--depth", type=int, default=8)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--shares", type=_shares, default=None, help="e.g. TEXT=0.4,RECTANGLE=0.3,FRAME=0.3")
+    parser.add_argument("--button-share", type=float, default=0.1)
+    parser.add_argument("--palette", type=int, default=12)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--frame-nodes", type=int, default=1_000, help="nodes per top-level frame")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--device", choices=[*DEVICES, "all"], default="desktop")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None, help="analysis pool workers; 0 analyses in process")
+    parser.add_argument("--save", help="write the results as JSON to this path")
+    parser.add_argument("--compare", help="JSON of an earlier --save to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="also compare json and FastJSON on each document")
+    args = parser.parse_args(argv)
+
+    if args.workers is not None:
+        analysis_pool.workers = args.workers
+
+    workdir = tempfile.mkdtemp(prefix="analysis-bench-")
+    results = {}
+    print(f"{'nodes':>9} {'stage':<26} {'best s':>9} {'median s':>9} {'peak MB':>9}")
+    for nodes in args.nodes:
+        figma_data = synthetic_document(
+            nodes,
+            args.depth,
+            args.fanout,
+            args.shares,
+            args.button_share,
+            args.palette,
+            args.pages,
+            args.seed,
+            args.frame_nodes,
+        )
+        results[str(nodes)] = benchmark(figma_data, args.device, args.repeat, workdir)
+        if args.json:
+            results[str(nodes)].update(json_benchmark(figma_data, args.device, args.repeat))
+        for stage, metrics in results[str(nodes)].items():
+            throughput = f" {metrics['mb_per_s']:>9.1f} MB/s" if "mb_per_s" in metrics else ""
+            print(
+                f"{nodes:>9} {stage:<26} {metrics['best_s']:>9.4f} {metrics['median_s']:>9.4f} "
+                f"{metrics['peak_mb']:>9.1f}{throughput}"
+            )
+    analysis_pool.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            slower = regressions(results, json.load(baseline), args.tolerance)
+        for line in slower:
+            print(f"REGRESSION {line}")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,20 @@
+import asyncio
+import gzip
+import io
+import json
+import os
 import sys
+from datetime import datetime
 from pathlib import Path
 
+import numpy as np
+
 import pytest
 pytest.importorskip("sqlmodel")
 
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
 from sqlmodel import Session, SQLModel, create_engine
 
 BASE_DIR = Path(__file__).resolve().parents[2]
@@ -11,7 +22,21 @@ if str(BASE_DIR) not in sys.path:
     sys.path.append(str(BASE_DIR))
 
 from src.database.models.Analysis import Analysis  # noqa: E402
+from src.services.AnalysisEngine import AnalysisEngine  # noqa: E402
+from src.services.AnalysisPool import AnalysisPool  # noqa: E402
+from src.services.BlobStore import BlobStore, blob_store  # noqa: E402
+from src.services.Diagnostics import Diagnostics, service_metrics  # noqa: E402
+from src.services.DocumentShards import DocumentShards, frame_table, partial_store  # noqa: E402
+from src.services.FastJSON import FastJSONResponse, dump_bytes  # noqa: E402
+from src.services.JobRunner import JobRunner  # noqa: E402
+from src.services.FigmaStream import SpoolReader, SpoolWriter, node_table_from_stream  # noqa: E402
+from src.services.ResultCache import cache_key, result_cache  # noqa: E402
+from src.services.RuleSet import DEFAULT_RULESET, RULESET_VERSION  # noqa: E402
+from src.services.NodeTable import NodeTable  # noqa: E402
+from src.services.RawBody import read_body  # noqa: E402
 from src.services.Services import Services  # noqa: E402
+from src.services.SpatialIndex import GridIndex  # noqa: E402
+from src.tests.benchmark import synthetic_document  # noqa: E402
 
 
 @pytest.fixture()
@@ -22,6 +47,15 @@ def session():
         yield session
 
 
+@pytest.fixture(autouse=True)
+def blob_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "root", str(tmp_path / "blobs"))
+    monkeypatch.setattr(partial_store, "root", str(tmp_path / "partials"))
+    # picked up by spawned analysis workers
+    monkeypatch.setenv("ANALYSIS_BLOB_DIR", str(tmp_path / "blobs"))
+    monkeypatch.setenv("ANALYSIS_PARTIAL_DIR", str(tmp_path / "partials"))
+
+
 def test_figma_color_to_rgb():
     services = Services(db=None)
     rgb = services.figma_color_to_rgb({"r": 0.5, "g": 0.25, "b": 0.0})
@@ -62,4 +96,835 @@ def test_run_analysis_persists_results(session):
 
     stored = session.query(Analysis).first()
     assert stored is not None
-    assert str(stored.project_id) == "5"
\ No newline at end of file
+    assert stored.project_id == 5 and stored.device == "desktop"
+
+
+def test_latest_analysis_is_served_pre_serialised(session, monkeypatch):
+    services = Services(session)
+    figma_data = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 10}}]}}
+    services.run_analysis(project_id=4, device="mobile", figma_data=figma_data, use_cache=False)
+    desktop = services.run_analysis(project_id=4, device="desktop", figma_data=figma_data, use_cache=False)
+
+    monkeypatch.setattr("src.services.Services.loads", None)
+    latest = services.get_analysis(4)
+    mobile = services.get_analysis(4, device="mobile")
+    monkeypatch.undo()
+
+    assert json.loads(latest) == json.loads(json.dumps(desktop))
+    assert json.loads(mobile)["device"] == "mobile"
+    assert services.get_analysis(5) is None
+
+
+def test_diagnostics_are_returned_on_request_and_never_stored(session):
+    service_metrics.reset()
+    services = Services(session)
+    figma_data = synthetic_document(nodes=500, button_share=0.5, seed=1)
+
+    plain = services.run_analysis(project_id=6, device="desktop", figma_data=figma_data, use_cache=False)
+    result = services.run_analysis(
+        project_id=6, device="all", figma_data=figma_data, use_cache=False, diagnostics=True
+    )
+
+    assert "diagnostics" not in plain
+    diagnostics = result["diagnostics"]
+    stages = {"traversal", "resolve", "rule.button", "spacing", "rule.contrast", "db_write"}
+    assert stages <= set(diagnostics["timings_ms"])
+    counters = diagnostics["counters"]
+    table = NodeTable.from_document(figma_data["document"])
+    assert counters["nodes"] == len(table) and counters["buttons"] == len(table.button_node)
+    assert counters["issues"] == sum(analysis["issue_count"] for analysis in result["analyses"])
+    assert counters["raw_bytes"] == len(dump_bytes(figma_data))
+    assert "diagnostics" not in services.get_analysis(6)
+
+    # only the instrumented run counts towards the service metrics
+    metrics = services.get_service_metrics()
+    assert metrics["analyses"] == 1 and metrics["counters"]["nodes"] == len(table)
+
+
+def test_issues_are_grouped_capped_and_streamed_in_full(session, monkeypatch):
+    monkeypatch.setattr("src.services.Services.ISSUE_LIMIT", 5)
+    services = Services(session)
+    labels = [
+        {"id": f"t{i}", "type": "TEXT", "style": {"fontSize": 10 + i % 2}, "characters": "label"}
+        for i in range(300)
+    ]
+    figma_data = {"document": {"children": [{"id": "f", "type": "FRAME", "children": labels}]}}
+
+    result = services.run_analysis(project_id=12, device="desktop", figma_data=figma_data)
+
+    assert len(result["issues"]) == 5 and result["issue_count"] == 300
+    (group,) = [group for group in result["issue_groups"] if group["code"] == "font_size"]
+    assert group["count"] == 300 and group["worst"] == 10 and group["nodes"] == [f"t{i}" for i in range(10)]
+    assert result["recommendations"].count("Increase font size to at least 14px (currently 10px).") == 1
+    assert result["summary"] == "Detected 300 usability and accessibility issues."
+    assert session.query(Analysis).one().issue_count == 300
+
+    lines = list(services.get_issue_stream(12, code="font_size"))
+    assert [json.loads(line)["node"] for line in lines] == [f"t{i}" for i in range(300)]
+    assert json.loads(lines[1]) == {
+        "code": "font_size", "issue": "Font too small", "expected_min": 14, "actual": 11, "node": "t1",
+    }
+    assert list(services.get_issue_stream(12, code="contrast")) == []
+    assert services.get_issue_stream(13) is None
+    with pytest.raises(HTTPException) as error:
+        services.get_issue_stream(12, code="font")
+    assert error.value.status_code == 400
+
+
+def test_raw_body_is_decoded_once_and_limited(session, monkeypatch):
+    frame = {"id": "f", "type": "FRAME", "children": [
+        {"id": f"t{i}", "type": "TEXT", "style": {"fontSize": 12}} for i in range(3)
+    ]}
+    body = json.dumps({"document": {"type": "DOCUMENT", "children": [frame]}}).encode()
+    services = Services(session)
+
+    in_memory = services.run_analysis(1, "desktop", raw_body=body)
+    streamed = services.run_analysis(1, "desktop", raw_body=io.BytesIO(body), use_cache=False)
+    # the same bytes are the same document, whichever way they were sent
+    cached = services.run_analysis(1, "desktop", raw_body=io.BytesIO(body))
+
+    assert in_memory["metrics"] == streamed["metrics"] and in_memory["metrics"]["font_size"]["min_detected"] == 12
+    assert cached["cache_hit"]
+    assert json.loads(blob_store.read(session.query(Analysis).first().raw_data_hash)) == json.loads(body)
+
+    monkeypatch.setattr("src.services.Services.RAW_MAX_NODES", 4)
+    for raw_body in (body, io.BytesIO(body)):
+        with pytest.raises(HTTPException) as error:
+            services.run_analysis(1, "desktop", raw_body=raw_body, use_cache=False)
+        assert error.value.status_code == 413
+    with pytest.raises(HTTPException) as error:
+        services.run_analysis(1, "desktop", raw_body=b'{"document": ')
+    assert error.value.status_code == 400
+
+    class FakeRequest:
+        headers = {}
+
+        async def stream(self):
+            for chunk in (body[:10], body[10:]):
+                yield chunk
+
+    assert asyncio.run(read_body(FakeRequest(), max_bytes=len(body))) == body
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(read_body(FakeRequest(), max_bytes=len(body) - 1))
+    assert error.value.status_code == 413
+
+
+def test_raw_body_taken_by_the_pool_is_only_decoded_by_its_worker(session, monkeypatch):
+    body = json.dumps({"document": {"type": "DOCUMENT", "children": [
+        {"id": f"t{i}", "type": "TEXT", "style": {"fontSize": 12}} for i in range(5)
+    ]}}).encode()
+    pool = AnalysisPool(workers=1, min_bytes=0)
+    monkeypatch.setattr("src.services.Services.analysis_pool", pool)
+    # spawned workers import their own copy of the module
+    monkeypatch.setattr("src.services.AnalysisPool.decode_json", None)
+    services = Services(session)
+    try:
+        result = services.run_analysis(1, "desktop", raw_body=body, use_cache=False)
+        monkeypatch.setattr("src.services.Services.RAW_MAX_NODES", 4)
+        with pytest.raises(HTTPException) as error:
+            services.run_analysis(1, "desktop", raw_body=body, use_cache=False)
+    finally:
+        pool.shutdown()
+
+    assert result["metrics"]["font_size"]["min_detected"] == 12
+    assert error.value.status_code == 413
+
+
+def test_fast_json_renders_rows_datetimes_and_numpy_like_the_stdlib():
+    created_at = datetime(2024, 5, 1, 12, 30, 5, 120000)
+    row = Analysis(analysis_id="a", project_id=1, status="completed", created_at=created_at)
+    content = {
+        "row": row,
+        "histogram": {2: np.int64(3)},
+        "ratio": np.float64(4.5),
+        "palette": np.array([1, 2]),
+        "text": "≥ 4.5:1",
+    }
+
+    body = json.loads(FastJSONResponse(content).body)
+
+    assert body["row"]["created_at"] == created_at.isoformat() and body["row"]["analysis_id"] == "a"
+    assert body["histogram"] == {"2": 3} and body["ratio"] == 4.5 and body["palette"] == [1, 2]
+    assert FastJSONResponse(content).body.decode().endswith('"text":"≥ 4.5:1"}')
+
+
+def test_repeated_analysis_is_served_from_cache(session):
+    result_cache.clear()
+    services = Services(session)
+    figma_data = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 10}}]}}
+
+    first = services.run_analysis(project_id=7, device="mobile", figma_data=figma_data)
+    # a new process only has the persisted rows to go on
+    result_cache.clear()
+    second = services.run_analysis(project_id=7, device="mobile", figma_data=figma_data)
+    other_device = services.run_analysis(project_id=7, device="desktop", figma_data=figma_data)
+
+    assert first["cache_hit"] is False and second["cache_hit"] is True
+    assert json.loads(json.dumps({**first, "cache_hit": True})) == second
+    assert other_device["cache_hit"] is False
+
+    rows = session.query(Analysis).order_by(Analysis.id).all()
+    assert len(rows) == 3
+    assert rows[0].cache_key == rows[1].cache_key != rows[2].cache_key
+    # the document is stored once and shared by every row that used it
+    assert rows[0].raw_data is None and rows[0].raw_data_hash == rows[1].raw_data_hash == rows[2].raw_data_hash
+    raw = services.get_raw_data(7)
+    with gzip.open(raw["blob_path"]) as blob:
+        assert json.loads(blob.read()) == figma_data
+
+
+def test_project_rule_profile_changes_thresholds_cache_key_and_checklist(session):
+    result_cache.clear()
+    services = Services(session)
+    figma_data = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 12}}]}}
+
+    before = services.run_analysis(project_id=8, device="desktop", figma_data=figma_data)
+    profile = services.set_rule_profile(8, {"font_size": {"desktop": {"min": 10, "ideal": [10, 12]}}})
+    after = services.run_analysis(project_id=8, device="desktop", figma_data=figma_data)
+    other_project = services.run_analysis(project_id=9, device="desktop", figma_data=figma_data)
+
+    assert before["metrics"]["font_size"]["recommended_min"] == 14 and before["issues"]
+    assert after["cache_hit"] is False
+    assert after["metrics"]["font_size"]["recommended_min"] == 10 and not after["issues"]
+    assert other_project["cache_hit"] is True and other_project["issues"] == before["issues"]
+    rows = session.query(Analysis).order_by(Analysis.id).all()
+    assert rows[0].cache_key == rows[2].cache_key != rows[1].cache_key
+
+    checklist = services.get_checklist(8)
+    assert checklist["version"] == profile["version"] != services.get_checklist()["version"]
+    text_readability = next(c for c in checklist["categories"] if c["name"] == "Text Readability")
+    assert text_readability["rules"][0]["desktop"] == 10
+
+    with pytest.raises(HTTPException) as error:
+        services.set_rule_profile(8, {"button_size": {"huge": 90}})
+    assert error.value.status_code == 400
+    assert services.delete_rule_profile(8) and services.get_ruleset(8).version == RULESET_VERSION
+
+
+def test_history_pages_by_keyset_and_aggregates_metrics_in_sql(session):
+    services = Services(session)
+    for font_size in (10, 12, 16):
+        figma_data = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": font_size}}]}}
+        services.run_analysis(project_id=8, device="desktop", figma_data=figma_data, use_cache=False)
+    services.run_analysis(project_id=8, device="mobile", figma_data=figma_data, use_cache=False)
+
+    first = services.get_history(8, device="desktop", limit=2, series=["min_font_size"])
+    second = services.get_history(8, device="desktop", limit=2, cursor=first["next_cursor"], include_results=True)
+
+    assert [item["min_font_size"] for item in first["items"]] == [16, 12]
+    assert "metrics" not in first["items"][0]
+    assert [item["min_font_size"] for item in second["items"]] == [10]
+    assert second["items"][0]["metrics"]["font_size"]["min_detected"] == 10
+    assert second["next_cursor"] is None
+    (point,) = first["series"]["min_font_size"]
+    assert point["value"] == 10 and point["analyses"] == 3
+    with pytest.raises(HTTPException):
+        services.get_history(8, series=["raw_data"])
+
+    # history of every device is read in cursor order straight from its index
+    assert [item["device"] for item in services.get_history(8)["items"]] == ["mobile"] + ["desktop"] * 3
+    query = services._history_query(8).order_by(Analysis.created_at.desc(), Analysis.id.desc())
+    sql = query.statement.compile(session.get_bind(), compile_kwargs={"literal_binds": True})
+    plan = " ".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert "ix_analysis_project_created" in plan and "TEMP B-TREE" not in plan
+
+
+def test_queued_job_completes_its_processing_row(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    runner = JobRunner(session_factory, workers=1)
+
+    with session_factory() as db:
+        services = Services(db)
+        done_id = services.create_job(3)
+        failed_id = services.create_job(3)
+        assert services.get_job(done_id)["status"] == "processing"
+        assert services.get_analysis(3) is None
+
+    figma_data = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 20}}]}}
+    runner.submit(done_id, 3, "desktop", figma_data=figma_data, use_cache=False).result()
+    # figma_url without a token is rejected before anything is imported
+    runner.submit(failed_id, 3, "desktop", figma_url="https://www.figma.com/file/ABC").result()
+
+    with session_factory() as db:
+        services = Services(db)
+        done = services.get_job(done_id)
+        assert done["status"] == "completed"
+        assert {**done["result"], "cache_hit": False} == json.loads(services.get_analysis(3))
+        failed = services.get_job(failed_id)
+        assert failed["status"] == "failed" and "token" in failed["error"]
+        assert db.query(Analysis).count() == 2
+
+
+def test_restart_fails_only_its_own_or_stale_jobs(session):
+    services = Services(session)
+    own = services.create_job(3)
+    other = services._store_analysis(services._new_analysis_id(3), 3, False, status="processing", owner="replica-2")
+    stale = services._store_analysis(services._new_analysis_id(3), 3, False, status="processing", owner="replica-2")
+    stale.updated_at = datetime(2020, 1, 1)
+    session.commit()
+
+    services.fail_interrupted_jobs()
+
+    assert services.get_job(own)["status"] == "failed"
+    assert services.get_job(other.analysis_id)["status"] == "processing"
+    assert services.get_job(stale.analysis_id)["status"] == "failed"
+
+
+def test_analysis_pool_runs_engine_in_worker_process():
+    figma_data = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 9}}]}}
+    body = json.dumps(figma_data).encode()
+    pool = AnalysisPool(workers=1, max_tasks_per_child=1, min_bytes=0)
+    try:
+        results = pool.analyze(body, ["desktop"])["results"]
+        # the recycled worker is replaced transparently
+        assert pool.analyze(body, ["desktop"])["results"] == results
+    finally:
+        pool.shutdown()
+
+    assert results["desktop"] == AnalysisEngine("desktop").analyze(figma_data)
+
+
+def test_analysis_pool_sends_each_worker_only_its_frames(monkeypatch):
+    screens = [
+        {"id": f"s{i}", "type": "FRAME", "fills": [{"color": {"r": 0, "g": 0, "b": i / 4}}], "children": [
+            {"id": f"t{i}", "type": "TEXT", "style": {"fontSize": 9 + i},
+             "absoluteBoundingBox": {"x": 0, "y": 0, "width": 40, "height": 10 + i},
+             "fills": [{"color": {"r": 0.5, "g": 0.5, "b": 0.5}}]},
+        ]}
+        for i in range(5)
+    ]
+    figma_data = {"document": {"type": "DOCUMENT", "children": [
+        {"type": "CANVAS", "children": screens[:2]},
+        {"type": "CANVAS", "children": screens[2:]},
+    ]}}
+    handovers = []
+    frame_tasks = AnalysisPool._frame_tasks
+
+    def recorded_tasks(*args):
+        for task in frame_tasks(*args):
+            handovers.append(json.loads(task[1]))
+            yield task
+
+    monkeypatch.setattr("src.services.DocumentShards.PARTIAL_MIN_NODES", 2)
+    monkeypatch.setattr(AnalysisPool, "_frame_tasks", staticmethod(recorded_tasks))
+    pool = AnalysisPool(workers=2, min_bytes=0, shard_bytes=1)
+    diagnostics = Diagnostics()
+    try:
+        body = json.dumps(figma_data).encode()
+        results = pool.analyze(body, ["desktop", "mobile"], diagnostics=diagnostics, figma_data=figma_data)["results"]
+    finally:
+        pool.shutdown()
+
+    assert results == AnalysisEngine.analyze_devices(figma_data, ["desktop", "mobile"])
+    assert [[frame["id"] for frame in frames] for frames in handovers] == [["s0", "s2", "s4"], ["s1", "s3"]]
+    assert diagnostics.state()["counters"]["worker_parts"] == 2
+
+
+def test_batch_looks_up_each_project_once_and_reports_per_item(session, monkeypatch):
+    lookups, imports = [], []
+    document = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 12}}]}}
+
+    class FakeResponse:
+        def __init__(self, status_code, payload):
+            self.status_code = status_code
+            self.payload = payload
+            self.content = json.dumps(payload).encode()
+            self.headers = {"content-type": "application/json"}
+            self.text = self.content.decode()
+
+        def json(self):
+            return self.payload
+
+    def fake_get(url, headers, timeout):
+        project_id = int(url.rsplit("/", 1)[1])
+        lookups.append(project_id)
+        if project_id == 2:
+            return FakeResponse(404, {})
+        return FakeResponse(200, {"project": {"figma_link": f"https://www.figma.com/file/P{project_id}"}})
+
+    def fake_post(url, json, headers, timeout, stream=False):
+        imports.append(json["file_url"])
+        return FakeResponse(200, {"project": document})
+
+    monkeypatch.setattr("src.services.Services.requests.get", fake_get)
+    monkeypatch.setattr("src.services.Services.requests.post", fake_post)
+    # whether a project was analysed before is looked up for the whole batch, not on its threads
+    monkeypatch.setattr(Services, "_analysed_before", None)
+
+    items = [
+        {"project_id": 1, "device": "desktop"},
+        {"project_id": 1, "device": "mobile"},
+        {"project_id": 2, "device": "desktop"},
+    ]
+    results = Services(session).run_batch(items, token="t", use_cache=False)["results"]
+
+    assert sorted(lookups) == [1, 2]
+    # both devices of project 1 come from one import
+    assert imports == ["https://www.figma.com/file/P1"]
+    assert [(r["project_id"], r["device"], r["status"]) for r in results] == [
+        (1, "desktop", "completed"),
+        (1, "mobile", "completed"),
+        (2, "desktop", "failed"),
+    ]
+    assert results[1]["result"]["metrics"]["font_size"]["min_detected"] == 12
+    assert session.query(Analysis).count() == 2
+
+
+def test_node_ids_import_only_the_requested_subtrees_under_their_own_cache_key(session, monkeypatch):
+    requests_sent = []
+    frame = {"id": "12:34", "type": "FRAME", "children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 12}}]}
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, payload):
+            self.payload = payload
+            self.content = json.dumps(payload).encode()
+
+        def json(self):
+            return self.payload
+
+    def fake_post(url, json, headers, timeout, stream=False):
+        requests_sent.append((url.rsplit("/", 1)[1], json))
+        if url.endswith("/version"):
+            return FakeResponse({"file_key": "ABC", "version": "7"})
+        document = {"type": "DOCUMENT", "children": [{"type": "CANVAS", "children": [frame]}]}
+        return FakeResponse({"project": {"file_key": "ABC", "version": "7", "document": document, **json}})
+
+    monkeypatch.setattr("src.services.Services.requests.post", fake_post)
+    services = Services(session)
+
+    url = "https://www.figma.com/design/ABC/x"
+    scoped = services.run_analysis(1, "desktop", token="t", figma_url=f"{url}?node-id=12-34", node_depth=2)
+    again = services.run_analysis(1, "desktop", token="t", figma_url=url, node_ids=["12:34"], node_depth=2)
+    whole = services.run_analysis(1, "desktop", token="t", figma_url=url)
+
+    assert requests_sent[1] == ("import", {"file_url": f"{url}?node-id=12-34", "node_ids": ["12:34"], "depth": 2})
+    assert scoped["node_ids"] == again["node_ids"] == ["12:34"] and again["cache_hit"]
+    # the whole file is a different document, whatever the revision
+    assert whole["node_ids"] is None and not whole["cache_hit"]
+    assert requests_sent[-1] == ("import", {"file_url": url})
+    # the raw data is the Figma file, not the figma-service response around it
+    with gzip.open(services.get_raw_data(1)["blob_path"]) as blob:
+        assert json.loads(blob.read())["document"]["children"][0]["children"] == [frame]
+    with pytest.raises(HTTPException) as error:
+        services.run_analysis(1, "desktop", figma_data={"document": frame}, node_ids=["12:34"])
+    assert error.value.status_code == 400
+
+
+def test_import_is_cached_under_the_revision_it_came_with(session, monkeypatch):
+    document = {"type": "DOCUMENT", "children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 12}}]}
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, payload):
+            self.payload = payload
+            self.content = json.dumps(payload).encode()
+            self.raw = io.BytesIO(self.content)
+
+        def json(self):
+            return self.payload
+
+        def close(self):
+            pass
+
+    def fake_post(url, json, headers, timeout, stream=False):
+        if url.endswith("/version"):
+            return FakeResponse({"file_key": "REV", "version": "7"})
+        # the file changed between the revision lookup and the import
+        return FakeResponse({"project": {"file_key": "REV", "version": "8", "document": document}})
+
+    monkeypatch.setattr("src.services.Services.requests.post", fake_post)
+    services = Services(session)
+    for stream in (False, True):
+        services.run_analysis(1, "desktop", token="t", figma_url="https://www.figma.com/design/REV/x", stream=stream)
+
+    imported = cache_key("file:REV@8", "desktop", DEFAULT_RULESET.version)
+    assert [row.cache_key for row in session.query(Analysis)] == [imported, imported]
+
+
+def test_import_taken_by_the_pool_is_unwrapped_and_kept_by_its_worker(session, monkeypatch):
+    file = {"file_key": "ABC", "version": "7", "document": {"type": "DOCUMENT", "children": [
+        {"id": "t", "type": "TEXT", "style": {"fontSize": 12}},
+    ]}}
+    bodies = [json.dumps({"project": file}).encode(), b'{"project": ']
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, content):
+            self.content = content
+
+    monkeypatch.setattr("src.services.Services.requests.post", lambda *a, **k: FakeResponse(bodies.pop(0)))
+    pool = AnalysisPool(workers=1, min_bytes=0)
+    monkeypatch.setattr("src.services.Services.analysis_pool", pool)
+    # spawned workers import their own copy of the module
+    monkeypatch.setattr("src.services.AnalysisPool.decode_json", None)
+    services = Services(session)
+    url = "https://www.figma.com/design/ABC/x"
+    try:
+        result = services.run_analysis(1, "desktop", token="t", figma_url=url, use_cache=False)
+        with pytest.raises(HTTPException) as error:
+            services.run_analysis(1, "desktop", token="t", figma_url=url, use_cache=False)
+    finally:
+        pool.shutdown()
+
+    assert result["metrics"]["font_size"]["min_detected"] == 12
+    assert json.loads(blob_store.read(session.query(Analysis).one().raw_data_hash)) == file
+    assert error.value.status_code == 502
+
+
+def test_all_devices_share_one_extraction_and_store_a_row_each(session):
+    services = Services(session)
+    figma_data = {"document": {"children": [{"id": "t", "type": "TEXT", "style": {"fontSize": 12},
+                                             "absoluteBoundingBox": {"x": 0, "y": 0, "width": 20, "height": 20}}]}}
+
+    combined = services.run_analysis(project_id=4, device="all", figma_data=figma_data, use_cache=False)
+
+    assert [a["device"] for a in combined["analyses"]] == ["desktop", "mobile"]
+    for analysis in combined["analyses"]:
+        single = services._analyze_figma_data(figma_data, analysis["device"])
+        assert analysis["metrics"] == single["metrics"] and analysis["issues"] == single["issues"]
+    assert session.query(Analysis).count() == 2
+    with pytest.raises(HTTPException):
+        services.run_analysis(project_id=4, device=["tablet"], figma_data=figma_data)
+
+
+def test_reanalysis_only_recomputes_changed_frames(tmp_path, monkeypatch):
+    def screen(screen_id, font_size):
+        return {"id": screen_id, "type": "FRAME", "fills": [{"color": {"r": 0, "g": 0, "b": 0}}], "children": [
+            {"id": f"{screen_id}-cta", "type": "FRAME", "name": "Primary Button", "children": [
+                {"type": "RECTANGLE", "absoluteBoundingBox": {"x": 0, "y": 0, "width": 120, "height": 40}},
+                {"id": f"{screen_id}-label", "type": "TEXT", "characters": "Continue",
+                 "style": {"fontSize": font_size}, "fills": [{"color": {"r": 0.2, "g": 0.2, "b": 0.2}}]},
+            ]},
+        ]}
+
+    def document(font_size):
+        return {"document": {"type": "DOCUMENT", "children": [
+            {"type": "CANVAS", "backgroundColor": {"r": 0.9, "g": 0.9, "b": 0.9}, "children": [
+                screen("a", 16), screen("b", font_size), screen("c", 16),
+            ]},
+        ]}}
+
+    store = BlobStore(str(tmp_path / "partials"))
+    devices = ("desktop", "mobile")
+    # frames this small are analysed with the whole document and never stored
+    DocumentShards.analyze_devices(document(16), devices, store)
+    assert not (tmp_path / "partials").exists()
+
+    monkeypatch.setattr("src.services.DocumentShards.PARTIAL_MIN_NODES", 3)
+    DocumentShards.analyze_devices(document(16), devices, store)
+
+    analysed = []
+    table = frame_table
+    monkeypatch.setattr(
+        "src.services.DocumentShards.frame_table",
+        lambda frame, *args: analysed.append(frame["id"]) or table(frame, *args),
+    )
+    results, reused = DocumentShards(document(10)["document"]).analyze(devices, store)
+
+    assert analysed == ["b"] and reused == 2
+    assert results == AnalysisEngine.analyze_devices(document(10), devices)
+    assert results["desktop"]["metrics"]["font_size"]["min_detected"] == 10
+
+
+def test_bounded_blob_store_removes_least_recently_used_blobs(tmp_path):
+    store = BlobStore(str(tmp_path / "partials"), max_bytes=1_000_000)
+    digests = [store.put(os.urandom(1_000)) for _ in range(3)]
+    for age, digest in enumerate(digests):
+        os.utime(store.path(digest), (1_000 + age, 1_000 + age))
+    # reading the oldest blob makes the second one the least recently used
+    store.read(digests[0])
+
+    store.max_bytes = int(os.path.getsize(store.path(digests[0])) * 3.5)
+    digests.append(store.put(os.urandom(1_000)))
+
+    assert [store.exists(d) for d in digests] == [True, False, True, True]
+
+
+def test_analysis_handles_deeply_nested_documents():
+    services = Services(db=None)
+    document = {"id": "root", "type": "FRAME", "children": []}
+    node = document
+    for i in range(5000):
+        child = {"id": f"n{i}", "type": "GROUP", "children": []}
+        node["children"].append(child)
+        node = child
+    node["children"].append({"id": "label", "type": "TEXT", "style": {"fontSize": 16}})
+
+    result = services._analyze_figma_data({"document": document}, "desktop")
+
+    assert result["metrics"]["font_size"]["min_detected"] == 16
+    assert result["metrics"]["layout_depth"]["status"] == "warning"
+
+
+def test_run_analysis_stores_documents_nested_deeper_than_orjson_encodes(session):
+    services = Services(session)
+    document = {"id": "root", "type": "FRAME", "children": []}
+    node = document
+    # 150 node levels are 300 levels of JSON nesting, past orjson's limit of 255
+    for i in range(150):
+        child = {"id": f"n{i}", "type": "GROUP", "children": []}
+        node["children"].append(child)
+        node = child
+    node["children"].append({"id": "label", "type": "TEXT", "style": {"fontSize": 16}})
+    figma_data = {"document": document}
+
+    result = services.run_analysis(project_id=9, device="desktop", figma_data=figma_data, use_cache=False)
+
+    assert result["metrics"]["font_size"]["min_detected"] == 16
+    assert json.loads(blob_store.read(session.query(Analysis).one().raw_data_hash)) == figma_data
+
+
+def test_layout_depth_reports_distribution():
+    services = Services(db=None)
+    document = {
+        "type": "DOCUMENT",
+        "children": [
+            {"type": "FRAME", "children": [{"type": "TEXT"}, {"type": "GROUP", "children": [{"type": "TEXT"}]}]},
+            {"type": "TEXT"},
+        ],
+    }
+
+    depth = services._analyze_figma_data({"document": document}, "desktop")["metrics"]["layout_depth"]
+
+    assert depth["node_depth_histogram"] == [1, 2, 2, 1]
+    assert depth["node_depth_percentiles"] == {"p50": 1, "p90": 3, "max": 3}
+    assert depth["max_node_depth"] == 3
+    assert depth["avg_depth"] == (3 + 2 + 0 + 1 + 0 + 0) / 6
+
+
+def _button(node_id, name, x, y):
+    box = {"x": x, "y": y, "width": 80, "height": 80}
+    return {
+        "id": node_id,
+        "type": "FRAME",
+        "name": name,
+        "absoluteBoundingBox": box,
+        "children": [
+            {"type": "RECTANGLE", "absoluteBoundingBox": box},
+            {"type": "TEXT", "style": {"fontSize": 16}},
+        ],
+    }
+
+
+def test_button_spacing_is_computed_per_frame():
+    services = Services(db=None)
+    document = {
+        "type": "DOCUMENT",
+        "children": [
+            {
+                "type": "CANVAS",
+                "children": [
+                    {"id": "screen-a", "type": "FRAME", "children": [
+                        _button("a1", "Primary", 0, 0),
+                        _button("a2", "Secondary", 90, 0),
+                    ]},
+                    # overlaps screen-a in absolute coordinates but is a separate screen
+                    {"id": "screen-b", "type": "FRAME", "children": [
+                        _button("b1", "Button", 0, 85),
+                        _button("b2", "Button", 0, 205),
+                    ]},
+                ],
+            }
+        ],
+    }
+
+    spacing = services._analyze_figma_data({"document": document}, "desktop")["metrics"]["button_spacing"]
+
+    assert spacing["frames"] == {
+        "screen-a": {"min_spacing": 10, "priority": "high"},
+        "screen-b": {"min_spacing": 40, "priority": "low"},
+    }
+    assert spacing["min_spacing"] == 10 and isinstance(spacing["min_spacing"], int)
+    assert spacing["priority_breakdown"]["high"]["min_detected"] == 10
+    assert spacing["priority_breakdown"]["low"]["min_detected"] == 40
+
+
+def test_nearest_gap_of_a_far_button_does_not_scan_every_ring(monkeypatch):
+    rings = []
+    ring = GridIndex._ring
+    monkeypatch.setattr(GridIndex, "_ring", lambda self, *cells: rings.append(cells) or ring(self, *cells))
+    index = GridIndex([(0, 0, 40, 40), (60, 0, 100, 40), (50_000, 0, 50_040, 40)])
+
+    assert [index.nearest(i) for i in range(3)] == [(20.0, 1), (20.0, 0), (49_900.0, 1)]
+    # the far one used to widen its rings all the way, about 1,250 of them
+    assert len(rings) <= 3 * (GridIndex.MAX_RINGS + 1)
+
+
+def test_touch_targets_with_overlapping_or_close_hit_areas_are_reported_per_frame():
+    def button(node_id, x, y, width=60, height=30):
+        box = {"x": x, "y": y, "width": width, "height": height}
+        return {
+            "id": node_id,
+            "type": "FRAME",
+            "name": "Button",
+            "absoluteBoundingBox": box,
+            "children": [
+                {"id": f"{node_id}-bg", "type": "RECTANGLE", "absoluteBoundingBox": box},
+                {"id": f"{node_id}-label", "type": "TEXT", "style": {"fontSize": 16}},
+            ],
+        }
+
+    screen = {"id": "screen", "type": "FRAME", "absoluteBoundingBox": {"x": 0, "y": 0, "width": 400, "height": 800}}
+    figma_data = {"document": {"children": [{"type": "CANVAS", "children": [
+        # 30px high, so their 44px hit areas overlap by 4px although the buttons are 10px apart
+        {**screen, "children": [button("a", 0, 0), button("b", 0, 40), button("c", 0, 89), button("d", 300, 600)]},
+        # as close as "a" and "b", but in another frame
+        {**screen, "id": "other", "children": [button("e", 0, 110)]},
+    ]}]}}
+
+    result = AnalysisEngine("mobile").analyze(figma_data)
+    crowding = [issue for issue in result["issues"] if issue["code"] in ("touch_overlap", "touch_spacing")]
+
+    # "c" sits 5px below the hit area of "b"
+    assert [(issue["code"], issue["node"], issue["other_node"], issue["actual"]) for issue in crowding] == [
+        ("touch_overlap", "a", "b", -4),
+        ("touch_spacing", "b", "c", 5),
+    ]
+    touch = result["metrics"]["touch_target"]
+    assert touch["crowded_pairs"] == 2 and touch["min_hit_area_gap"] == -4 and touch["recommended_spacing"] == 8
+    assert AnalysisEngine("desktop").analyze(figma_data)["metrics"]["touch_target"] is None
+
+
+def test_contrast_uses_propagated_backdrop():
+    services = Services(db=None)
+    white_text = {"r": 1, "g": 1, "b": 1}
+    document = {
+        "type": "DOCUMENT",
+        "children": [
+            {"type": "CANVAS", "backgroundColor": {"r": 1, "g": 1, "b": 1, "a": 1}, "children": [
+                {"id": "screen", "type": "FRAME", "fills": [{"color": {"r": 0, "g": 0, "b": 0, "a": 1}}], "children": [
+                    # white on black: fine
+                    {"id": "title", "type": "TEXT", "style": {"fontSize": 16}, "fills": [{"color": white_text}]},
+                    {"id": "button", "type": "GROUP", "children": [
+                        {
+                            "type": "RECTANGLE",
+                            "absoluteBoundingBox": {"x": 0, "y": 0, "width": 100, "height": 40},
+                            # 50% white over black
+                            "fills": [{"color": {"r": 1, "g": 1, "b": 1, "a": 1}, "opacity": 0.5}],
+                        },
+                        {
+                            "id": "label",
+                            "type": "TEXT",
+                            "characters": "Buy",
+                            "style": {"fontSize": 16},
+                            "absoluteBoundingBox": {"x": 10, "y": 10, "width": 40, "height": 20},
+                            "fills": [{"color": white_text}],
+                        },
+                    ]},
+                ]},
+            ]},
+        ],
+    }
+
+    result = services._analyze_figma_data({"document": document}, "desktop")
+
+    contrast_issues = [i for i in result["issues"] if i["issue"] == "Insufficient contrast"]
+    assert [i["node"] for i in contrast_issues] == ["label"]
+    assert contrast_issues[0]["actual_ratio"] == 4.0
+
+
+def test_contrast_palette_groups_colour_pairs(monkeypatch):
+    services = Services(db=None)
+    grey = {"r": 0.6, "g": 0.6, "b": 0.6}
+    black = {"r": 0, "g": 0, "b": 0}
+    texts = [
+        {"id": f"t{i}", "type": "TEXT", "style": {"fontSize": 16}, "fills": [{"color": color}]}
+        for i, color in enumerate([grey, grey, black, grey])
+    ]
+
+    result = services._analyze_figma_data({"document": {"type": "DOCUMENT", "children": texts}}, "desktop")
+
+    palette = result["metrics"]["contrast_ratio"]["palette"]
+    assert [(p["foreground"], p["nodes"], p["status"]) for p in palette] == [
+        ("#999999", 3, "fail"),
+        ("#000000", 1, "ok"),
+    ]
+    assert [i["node"] for i in result["issues"] if i["issue"] == "Insufficient contrast"] == ["t0", "t1", "t3"]
+    assert result["metrics"]["contrast_ratio"]["palette_count"] == 2
+
+    monkeypatch.setattr("src.services.AnalysisEngine.PALETTE_LIMIT", 1)
+    result = services._analyze_figma_data({"document": {"type": "DOCUMENT", "children": texts}}, "desktop")
+    contrast = result["metrics"]["contrast_ratio"]
+    assert [p["foreground"] for p in contrast["palette"]] == ["#999999"] and contrast["palette_count"] == 2
+
+
+def test_node_table_extracts_columns_in_pre_order():
+    document = {
+        "type": "DOCUMENT",
+        "children": [
+            {"id": "screen", "type": "FRAME", "children": [
+                {"id": "title", "type": "TEXT", "style": {"fontSize": 12, "fontWeight": 700},
+                 "absoluteBoundingBox": {"x": 1, "y": 2, "width": 30, "height": 10},
+                 "fills": [{"color": {"r": 0, "g": 0, "b": 0}}]},
+            ]},
+            {"id": "icon", "type": "VECTOR"},
+        ],
+    }
+
+    table = NodeTable.from_document(document)
+
+    assert len(table) == 4
+    assert table.ids == [None, "screen", "title", "icon"]
+    assert table.parent.tolist() == [-1, 0, 1, 0]
+    assert table.depth.tolist() == [0, 1, 2, 1]
+    assert [table.frame_ids[f] if f >= 0 else None for f in table.frame.tolist()] == [None, "screen", "screen", "icon"]
+    assert table.is_type("TEXT").tolist() == [False, False, True, False]
+    assert table.font_size[2] == 12 and table.font_weight[2] == 700
+    assert table.fill[2].tolist() == [0, 0, 0] and table.backdrop[2].tolist() == [255, 255, 255]
+
+
+def test_streamed_import_matches_in_memory_analysis(tmp_path):
+    document = {
+        "type": "DOCUMENT",
+        "children": [
+            {"id": "screen", "type": "FRAME", "fills": [{"color": {"r": 0, "g": 0, "b": 0}}], "children": [
+                {"id": "cta", "type": "FRAME", "name": "Primary Button", "children": [
+                    {"type": "RECTANGLE", "absoluteBoundingBox": {"x": 0, "y": 0, "width": 120, "height": 40}},
+                    {"id": "label", "type": "TEXT", "characters": "Continue", "style": {"fontSize": 10},
+                     "absoluteBoundingBox": {"x": 10, "y": 10, "width": 60, "height": 12},
+                     "fills": [{"color": {"r": 0.2, "g": 0.2, "b": 0.2}}]},
+                ]},
+            ]},
+        ],
+    }
+    # children before the node's own keys, as an event stream may deliver them
+    response = {"message": "ok", "project": {"id": 1, "document": dict(reversed(list(document.items())))}}
+    body = json.dumps(response).encode()
+
+    reader = SpoolReader(io.BytesIO(body), str(tmp_path / "A-1.json.gz"))
+    table = node_table_from_stream(reader)
+    reader.close()
+
+    assert AnalysisEngine("mobile").evaluate(table) == AnalysisEngine("mobile").analyze({"document": document})
+    with gzip.open(reader.path) as spool:
+        assert spool.read() == body
+
+    # only the Figma file inside the response is copied, whichever wrapper it comes in
+    for wrapped in (response, {"project": {"project": response["project"], "figma_link": "x"}}):
+        copy = SpoolWriter(str(tmp_path / "A-2.json.gz"))
+        assert node_table_from_stream(io.BytesIO(json.dumps(wrapped).encode()), copy=copy) is not None
+        copy.close()
+        with gzip.open(copy.path) as spool:
+            assert json.loads(spool.read()) == response["project"]
+
+
+def test_synthetic_document_has_the_requested_shape():
+    shape = dict(nodes=2_000, depth=4, fanout=6, button_share=0.5, pages=2, seed=3, frame_nodes=250)
+    figma_data = synthetic_document(**shape)
+    table = NodeTable.from_document(figma_data["document"])
+
+    # the document and its two pages come on top of the requested nodes
+    assert len(table) == 2_000 + 3
+    assert table.depth.max() == 4 + 1
+    assert len(table.button_node) > 0
+    # the top-level frames are filled up to their size instead of ending wherever a branch does
+    frames = [frame for page in figma_data["document"]["children"] for frame in page["children"]]
+    assert [len(page["children"]) for page in figma_data["document"]["children"]] == [4, 4]
+    assert all(250 <= len(NodeTable.from_document(frame)) < 260 for frame in frames[:-1])
+    assert synthetic_document(**shape) == figma_data
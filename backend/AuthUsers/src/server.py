@@ -2,6 +2,7 @@ from pathlib import Path
 
 from fastapi import FastAPI
 from fastapi.openapi.docs import get_swagger_ui_html
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy import inspect, text
@@ -44,6 +45,7 @@ def create_app() -> FastAPI:
         version=APP_VERSION,
         docs_url=None,
         redoc_url=None,
+        default_response_class=ORJSONResponse,
     )
 
     _ensure_new_columns()
@@ -2,6 +2,7 @@ import os
 
 from fastapi import FastAPI
 from fastapi.openapi.docs import get_swagger_ui_html
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from sqlalchemy import inspect, text
@@ -54,6 +55,7 @@ def create_app() -> FastAPI:
         version=APP_VERSION,
         docs_url=None,
         redoc_url=None,
+        default_response_class=ORJSONResponse,
     )
 
     _ensure_optional_columns()
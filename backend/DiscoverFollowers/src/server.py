@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.openapi.docs import get_swagger_ui_html
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from .global_settings import APP_NAME, APP_DESCRIPTION, APP_VERSION
@@ -14,6 +15,7 @@ def create_app() -> FastAPI:
         version=APP_VERSION,
         docs_url=None,
         redoc_url=None,
+        default_response_class=ORJSONResponse,
     )
 
     SQLModel.metadata.create_all(engine)
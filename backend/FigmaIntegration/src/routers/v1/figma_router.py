@@ -122,6 +122,8 @@ class Fig:
             file_url=schema.file_url,
             access_token=figma_account.access_token,
             user_id=user_id,
+            node_ids=schema.node_ids,
+            depth=schema.depth,
         )
         logger.info(
             "Figma import fetched file %s for user %s: name=%s",
@@ -136,6 +138,31 @@ class Fig:
             "project": project_data,
         }
 
+    @figma_router.post("/version")
+    def file_version(
+        self,
+        schema: FigmaImportSchema,
+        request: Request,
+        db: Session = Depends(get_db),
+        authorization: str = Header(None),
+    ):
+        token = authorization.replace("Bearer ", "") if authorization else request.cookies.get("token")
+        if not token:
+            raise HTTPException(status_code=401, detail="Authorization header missing")
+        user_data = get_user_data(token)
+        user_id = _extract_user_id(user_data)
+
+        figma_account = db.query(FigmaAccount).filter(FigmaAccount.user_id == user_id).first()
+        if not figma_account:
+            raise HTTPException(status_code=401, detail="You must connect Figma first")
+
+        service = Services(db)
+        return service.get_file_version(
+            file_url=schema.file_url,
+            access_token=figma_account.access_token,
+            user_id=user_id,
+        )
+
     @figma_router.get("/callback")
     def figma_callback(self, request: Request, db: Session = Depends(get_db)):
         """
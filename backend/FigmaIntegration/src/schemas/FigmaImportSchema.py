@@ -1,8 +1,14 @@
-from pydantic import BaseModel
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
 
 
 class FigmaImportSchema(BaseModel):
     file_url: str
+    # import only these nodes (and their subtrees) instead of the whole file
+    node_ids: Optional[List[str]] = None
+    # levels kept below each node in node_ids; the whole subtree when omitted
+    depth: Optional[int] = Field(default=None, ge=1)
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
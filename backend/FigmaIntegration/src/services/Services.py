@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 import logging
 import os
 
@@ -124,14 +124,60 @@ class Services:
             raise HTTPException(status_code=401, detail="You must connect Figma first")
         return account.access_token
 
-    def get_projects(self, file_url: str, access_token: Optional[str], user_id: int):
+    def normalize_node_ids(self, node_ids: Optional[List[str]]) -> List[str]:
+        """Node ids in API form ("1:2", not the "1-2" of share links), without repeats."""
+        normalized = [node_id.strip().replace("-", ":") for node_id in node_ids or [] if node_id and node_id.strip()]
+        return list(dict.fromkeys(normalized))
+
+    def _nodes_document(self, data: dict, node_ids: List[str], file_key: str) -> dict:
+        """A document holding only the subtrees of a ``/nodes`` response, in the order requested.
+
+        Requested pages stay pages; any other node is placed on one page of
+        its own, so it is analysed as a top-level frame.
+        """
+        nodes = data.get("nodes") or {}
+        missing = [node_id for node_id in node_ids if not (nodes.get(node_id) or {}).get("document")]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Figma node not found: {', '.join(missing)}")
+
+        pages = []
+        frames = {"id": "scope", "name": "Selected nodes", "type": "CANVAS", "children": []}
+        for node_id in node_ids:
+            node = nodes[node_id]["document"]
+            if node.get("type") == "CANVAS":
+                pages.append(node)
+            else:
+                frames["children"].append(node)
+        if frames["children"]:
+            pages.append(frames)
+        logger.info("Fetched %s node subtrees of Figma file %s", len(node_ids), file_key)
+        return {"id": "0:0", "name": "Document", "type": "DOCUMENT", "children": pages}
+
+    def get_projects(
+        self,
+        file_url: str,
+        access_token: Optional[str],
+        user_id: int,
+        node_ids: Optional[List[str]] = None,
+        depth: Optional[int] = None,
+    ):
         token = access_token or self._get_account_token(user_id)
         file_key = self.extract_file_key(file_url)
+        node_ids = self.normalize_node_ids(node_ids)
 
         headers = {"Authorization": f"Bearer {token}"}
-        res = requests.get(
-            f"https://api.figma.com/v1/files/{file_key}", headers=headers, timeout=10
-        )
+        if node_ids:
+            # only the requested subtrees, cut ``depth`` levels below them when given
+            params = {"ids": ",".join(node_ids)}
+            if depth:
+                params["depth"] = depth
+            res = requests.get(
+                f"https://api.figma.com/v1/files/{file_key}/nodes", params=params, headers=headers, timeout=10
+            )
+        else:
+            res = requests.get(
+                f"https://api.figma.com/v1/files/{file_key}", headers=headers, timeout=10
+            )
         if res.status_code != 200:
             try:
                 error_detail = res.json().get("err")
@@ -151,6 +197,8 @@ class Services:
             raise HTTPException(status_code=400, detail=detail)
 
         data = res.json()
+        if node_ids:
+            data["document"] = self._nodes_document(data, node_ids, file_key)
         document = data.get("document") or {}
         children = document.get("children") or []
         logger.info(
@@ -165,6 +213,8 @@ class Services:
         query_params = parse_qs(parsed_url.query)
         node_candidates = query_params.get("node-id") or query_params.get("node_id")
         node_id = node_candidates[0] if node_candidates else None
+        if node_ids:
+            node_id = node_ids[0]
 
         if not node_id and children and isinstance(children, list):
             node_id = (children[0] or {}).get("id")
@@ -207,10 +257,44 @@ class Services:
             "name": data.get("name"),
             "preview_url": preview_url,
             "project_id": figma_file.project_id,
+            "version": data.get("version"),
+            "last_modified": last_modified_raw,
+            "node_ids": node_ids or None,
+            "depth": depth if node_ids else None,
         }
         logger.info("Imported project payload for %s: %s", file_key, project_payload)
         return project_payload, figma_file
 
+    def get_file_version(self, file_url: str, access_token: Optional[str], user_id: int):
+        """Return the file key, version and lastModified without downloading the node tree."""
+        token = access_token or self._get_account_token(user_id)
+        file_key = self.extract_file_key(file_url)
+
+        headers = {"Authorization": f"Bearer {token}"}
+        # depth=1 stops at the pages, so the response stays small for any file size
+        res = requests.get(
+            f"https://api.figma.com/v1/files/{file_key}",
+            params={"depth": 1},
+            headers=headers,
+            timeout=10,
+        )
+        if res.status_code != 200:
+            logger.error(
+                "Failed to fetch version of Figma file %s for user %s (status=%s): %s",
+                file_key,
+                user_id,
+                res.status_code,
+                res.text,
+            )
+            raise HTTPException(status_code=400, detail="Cannot fetch file from Figma")
+
+        data = res.json()
+        return {
+            "file_key": file_key,
+            "version": data.get("version"),
+            "last_modified": data.get("lastModified"),
+        }
+
     def get_preview_image(self, file_key: str, node_id: str, token: str) -> Optional[str]:
         normalized_node_id = node_id.replace("-", ":") if node_id else node_id
         params = {"ids": normalized_node_id, "format": "png"}
@@ -2,6 +2,7 @@ import sys
 from pathlib import Path
 
 import pytest
+from fastapi import HTTPException
 
 pytest.importorskip("requests")
 
@@ -50,4 +51,23 @@ def test_get_preview_image_returns_url(monkeypatch):
 
     preview = services.get_preview_image("file-key", "12:34", "token")
 
-    assert preview == "http://image.cdn/preview.png"
\ No newline at end of file
+    assert preview == "http://image.cdn/preview.png"
+
+def test_nodes_document_keeps_only_the_requested_subtrees():
+    services = Services(db=None)
+    node_ids = services.normalize_node_ids(["0-1", "12-34", "12:34", " "])
+    data = {
+        "nodes": {
+            "0:1": {"document": {"id": "0:1", "type": "CANVAS", "children": []}},
+            "12:34": {"document": {"id": "12:34", "type": "FRAME", "children": []}},
+        }
+    }
+
+    document = services._nodes_document(data, node_ids, "file-key")
+
+    assert node_ids == ["0:1", "12:34"]
+    assert [page["id"] for page in document["children"]] == ["0:1", "scope"]
+    assert document["children"][1]["children"] == [data["nodes"]["12:34"]["document"]]
+    with pytest.raises(HTTPException) as error:
+        services._nodes_document({"nodes": {"0:1": None}}, ["0:1"], "file-key")
+    assert error.value.status_code == 404